@@ -0,0 +1,348 @@
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .leave_ledger import LEAVE_TYPES
+
+# Per leave type: days credited each month, the most that carries over into
+# a new year (None = no cap) and the most that can be held at all (None = no cap)
+DEFAULT_POLICY = {
+    "Annual Leave": {"monthly": 1.5, "carry_over_cap": 10, "max_balance": None},
+    "Sick Leave": {"monthly": 1.0, "carry_over_cap": 0, "max_balance": None},
+    "Casual Leave": {"monthly": 0.5, "carry_over_cap": 0, "max_balance": None},
+}
+
+
+def load_policy(path: Optional[str] = None) -> Dict[str, dict]:
+    """The accrual policy: DEFAULT_POLICY, overridden per leave type by ACCRUAL_POLICY_FILE (JSON)."""
+    policy = {t: dict(rules) for t, rules in DEFAULT_POLICY.items()}
+    path = path or os.getenv("ACCRUAL_POLICY_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for leave_type, rules in json.load(f).items():
+                if leave_type not in policy:
+                    raise ValueError(f"Unknown leave type in {path}: {leave_type}")
+                policy[leave_type].update(rules)
+    return policy
+
+
+def _cap(values: pd.Series, cap) -> pd.Series:
+    return values if cap is None else values.clip(upper=cap)
+
+
+def accrue(balances: pd.DataFrame, policy: Dict[str, dict], months: int = 1):
+    """Credit `months` of accrual to every employee at once, capped at max_balance."""
+    result = balances.copy()
+    for leave_type in LEAVE_TYPES:
+        rules = policy[leave_type]
+        credited = result[leave_type] + rules["monthly"] * months
+        # Never push anyone who is already over the cap further over it, but
+        # don't take days away either
+        result[leave_type] = np.maximum(
+            _cap(credited, rules["max_balance"]), result[leave_type]
+        )
+    return result
+
+
+def carry_over(balances: pd.DataFrame, policy: Dict[str, dict]):
+    """Year end: cut every balance down to its carry-over cap (negative balances are kept)."""
+    result = balances.copy()
+    for leave_type in LEAVE_TYPES:
+        result[leave_type] = _cap(
+            result[leave_type], policy[leave_type]["carry_over_cap"]
+        )
+    return result
+
+
+def _snapshot(table) -> pd.DataFrame:
+    table.invalidate()
+    records = table.get_all_records()
+    frame = pd.DataFrame(records, columns=["Employee ID"] + LEAVE_TYPES)
+    frame["Employee ID"] = frame["Employee ID"].astype(str)
+    for leave_type in LEAVE_TYPES:
+        frame[leave_type] = pd.to_numeric(frame[leave_type], errors="coerce").fillna(0)
+    return frame
+
+
+def _tidy(value: float):
+    value = round(float(value), 2)
+    return int(value) if value.is_integer() else value
+
+
+def _changes(before: pd.DataFrame, after: pd.DataFrame) -> Dict[str, dict]:
+    """The changed cells, as {employee_id: {leave_type: new value}}."""
+    changed = after[LEAVE_TYPES].ne(before[LEAVE_TYPES])
+    changes = {}
+    for position in np.nonzero(changed.any(axis=1).to_numpy())[0]:
+        row = after.iloc[position]
+        changes[row["Employee ID"]] = {
+            t: _tidy(row[t]) for t in LEAVE_TYPES if changed.iloc[position][t]
+        }
+    return changes
+
+
+def _write_changes(table, changes: Dict[str, dict]) -> int:
+    """Write only the changed cells, in one batched update. Returns rows written."""
+    updates = {}
+    for employee_id, values in changes.items():
+        row_num, _ = table.find("Employee ID", employee_id)
+        if row_num:
+            updates[row_num] = values
+    if updates:
+        table.update_rows(updates)
+    return len(updates)
+
+
+def _landed(snapshot: pd.DataFrame, started: dict) -> bool:
+    """
+    Whether an interrupted run's write reached the table: it is one batched
+    update, so more of its rows at their new values than at their old ones
+    means it did.
+    """
+    rows = {row["Employee ID"]: row for row in snapshot.to_dict("records")}
+    at_target = at_before = 0
+    for employee_id, targets in started["targets"].items():
+        row = rows.get(employee_id)
+        if row is None:
+            continue
+        now = {t: _tidy(row[t]) for t in targets}
+        if now == targets:
+            at_target += 1
+        elif now == started["before"][employee_id]:
+            at_before += 1
+    return at_target > at_before
+
+
+class AccrualState:
+    """
+    Which periods have already been processed, so re-runs are no-ops.
+
+    A run is recorded as started, with every cell it is about to write (old
+    and new values), before it writes anything, and as done afterwards. If
+    it is interrupted in between, the next run can tell from the table
+    whether the write landed instead of crediting the period twice.
+
+    With a shared session backend the state is kept there instead, so a
+    process that takes over the scheduler knows what the last one did; it
+    starts from the file the first time.
+    """
+
+    def __init__(self, path: str, backend=None):
+        self.path = path
+        self.backend = backend
+
+    def _read(self) -> dict:
+        if self.backend:
+            entries = self.backend.journal_entries("accrual_state")
+            if entries:
+                return json.loads(entries[-1][1])
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def done(self, kind: str, period: str) -> bool:
+        return period in self._read().get(kind, [])
+
+    def last(self, kind: str) -> Optional[str]:
+        """The latest period processed, if any."""
+        return max(self._read().get(kind, []), default=None)
+
+    def started(self, kind: str, period: str) -> Optional[dict]:
+        """The {"before": ..., "targets": ...} recorded by `begin()` for an unfinished run."""
+        return self._read().get("in_progress", {}).get(f"{kind}:{period}")
+
+    def begin(self, kind: str, period: str, before: dict, targets: dict):
+        state = self._read()
+        state.setdefault("in_progress", {})[f"{kind}:{period}"] = {
+            "before": before,
+            "targets": targets,
+        }
+        self._write(state)
+
+    def mark(self, kind: str, period: str):
+        state = self._read()
+        if period not in state.get(kind, []):
+            state.setdefault(kind, []).append(period)
+        state.get("in_progress", {}).pop(f"{kind}:{period}", None)
+        self._write(state)
+
+    def _write(self, state: dict):
+        if self.backend:
+            # Each write is a new entry; older ones are dropped after it
+            old = [seq for seq, _ in self.backend.journal_entries("accrual_state")]
+            self.backend.journal_append("accrual_state", json.dumps(state))
+            self.backend.journal_remove("accrual_state", old)
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def run_job(
+    table,
+    kind: str,
+    period: str,
+    state: AccrualState,
+    policy: Optional[Dict[str, dict]] = None,
+    ledger=None,
+    dry_run: bool = False,
+    force: bool = False,
+) -> int:
+    """
+    Run the monthly accrual or the year-end carry-over for everyone.
+
+    Takes one snapshot of the balance table, computes every new balance as
+    column operations, and writes the changed cells back in one batched
+    update. A run interrupted after its write isn't applied again (see
+    AccrualState).
+
+    Args:
+        table: The Leaves Balance table
+        kind: "accrual" (period YYYY-MM) or "carry_over" (period YYYY)
+        state: Records processed periods; a period already done is skipped
+        policy: Accrual policy (default: load_policy())
+        ledger: The app's LeaveLedger, if running inside the app; pending
+            ledger changes are folded in first and the ledger is re-based on
+            the new values afterwards, so nothing is lost to a race
+        dry_run: Compute and report, but don't write
+        force: Run even if the period was already processed
+
+    Returns:
+        int: Number of employees whose balance changed
+    """
+    if kind not in ("accrual", "carry_over"):
+        raise ValueError(f"Unknown job: {kind}")
+    if state.done(kind, period) and not force:
+        print(f"⏭️ {kind} for {period} already done")
+        return 0
+    policy = policy or load_policy()
+
+    def job():
+        before = _snapshot(table)
+        started = state.started(kind, period)
+        if started and not dry_run and not force and _landed(before, started):
+            state.mark(kind, period)
+            print(f"✅ {kind} for {period} was written before an interruption")
+            return len(started["targets"])
+        after = (
+            accrue(before, policy) if kind == "accrual" else carry_over(before, policy)
+        )
+        changed = int(after[LEAVE_TYPES].ne(before[LEAVE_TYPES]).any(axis=1).sum())
+        if dry_run:
+            print(f"🔎 {kind} for {period} would change {changed} employee(s)")
+            print(after.to_string(index=False))
+            return changed
+        changes = _changes(before, after)
+        old = _changes(after, before)
+        state.begin(kind, period, old, changes)
+        written = _write_changes(table, changes)
+        state.mark(kind, period)
+        print(f"✅ {kind} for {period}: {written} employee(s) updated")
+        return changed
+
+    if ledger is None or dry_run:
+        return job()
+    return ledger.exclusive(job)
+
+
+def due_jobs(state: AccrualState, today: datetime.date) -> List[Tuple[str, str]]:
+    """
+    (kind, period) for every job up to today, oldest first: each month since
+    the last accrual processed (just this month if there is none), January
+    preceded by the previous year's carry-over. Periods already done are
+    skipped by `run_job()`.
+    """
+    month = today.replace(day=1)
+    last = state.last("accrual")
+    if last:
+        year, number = map(int, last.split("-"))
+        following = datetime.date(year + number // 12, number % 12 + 1, 1)
+        month = min(month, following)
+    jobs = []
+    while month <= today:
+        if month.month == 1:
+            jobs.append(("carry_over", str(month.year - 1)))
+        jobs.append(("accrual", month.strftime("%Y-%m")))
+        month = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return jobs
+
+
+def start_scheduler(
+    table, state: AccrualState, ledger=None, interval: float = 3600, leader=None
+):
+    """
+    Run due jobs in a background thread: the previous year's carry-over in
+    January, then each month's accrual, once per period. Months missed while
+    the app was down are caught up in order on the next pass. With `leader`,
+    jobs only run while this process leads.
+    """
+
+    def run():
+        while True:
+            if leader and not leader.is_leader():
+                # Check again soon, so a new leader doesn't wait an interval
+                time.sleep(min(interval, 60))
+                continue
+            try:
+                for kind, period in due_jobs(state, datetime.date.today()):
+                    run_job(table, kind, period, state, ledger=ledger)
+            except Exception as e:
+                print(f"⚠️ Scheduled accrual failed, will retry: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="accrual-scheduler", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    from .core.session_backends import shared_backend
+    from .data_dir import data_path
+    from .storage import open_tables
+
+    parser = argparse.ArgumentParser(
+        description="Monthly leave accrual and year-end carry-over for all employees"
+    )
+    parser.add_argument("job", choices=["accrual", "carry-over"])
+    parser.add_argument(
+        "--period",
+        help="YYYY-MM for accrual (default: this month), YYYY for carry-over (default: last year)",
+    )
+    parser.add_argument(
+        "--policy", help="Accrual policy JSON (default: ACCRUAL_POLICY_FILE)"
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument(
+        "--force", action="store_true", help="Re-run a processed period"
+    )
+    args = parser.parse_args()
+
+    kind = args.job.replace("-", "_")
+    today = datetime.date.today()
+    period = args.period or (
+        today.strftime("%Y-%m") if kind == "accrual" else str(today.year - 1)
+    )
+    balance, _, _ = open_tables()
+    run_job(
+        balance,
+        kind,
+        period,
+        AccrualState(data_path("accrual_state.json"), backend=shared_backend()),
+        policy=load_policy(args.policy),
+        dry_run=args.dry_run,
+        force=args.force,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,25 @@ import os
 import uuid
 import datetime
 import threading
-from .utils import call_function
-from .models import generate_response
+import hmac
+from .utils import (
+    call_function,
+    init_policies,
+    log_writer,
+    lead_digest,
+    leave_ledger,
+    leave_index,
+    team_availability,
+    STARTUP_WAIT_SECONDS,
+)
+from .models import generate_response, load_local_model, prompt_cache_stats
+from .sheets_config import warm_up as warm_up_sheets, balance_ws
+from .accrual import AccrualState, start_scheduler as start_accrual_scheduler
+from .data_dir import data_path, lock_data_dir
+from .bulk_import import import_leave, read_table
+from .storage.quota import quota_stats
+from .singleflight import singleflight_stats
+from . import startup
 import json
 
 from .core.auth_middleware import (
@@ -15,13 +32,21 @@ from .core.auth_middleware import (
     get_auth_stats,
     authenticated_employee_mapping,
 )
+from .core.mailer import outbox
+from .core.session_store import (
+    SESSION_MAX_MB,
+    session_stats,
+    start_sweeper as start_session_sweeper,
+)
+from .core.session_backends import leadership, open_session_store, shared_backend
 from .core.auth import (
     verify_otp,
     is_authenticated,
     pending_otps,
+    otp_stats,
     get_authenticated_employee,
 )
-from .constants import system_call_llama, system_call_openai
+from .constants import system_call_for
 from .watch_inbox import watch_inbox
 
 load_dotenv()
@@ -58,10 +83,13 @@ if USE_NGROK:
         print("   Or download ngrok manually from https://ngrok.com/download")
         USE_NGROK = False
 
-# Store conversation history per user
-conversation_history = {}
+# Store conversation history per user; bounded by SESSION_MAX_MB in total
+conversation_history = open_session_store(
+    "conversation_history", max_bytes=int(SESSION_MAX_MB * 1024 * 1024)
+)
 # Dictionary to store user session data
-user_sessions = {}
+# Format: {session_id: {"user_id": str}}
+user_sessions = open_session_store("user_sessions")
 
 use_local_model = True
 MODEL_ID = os.getenv("HF_MODEL_ID")
@@ -70,7 +98,59 @@ if not MODEL_ID:
     use_local_model = False
 
 
-system_call = system_call_llama if use_local_model else system_call_openai
+def system_call() -> str:
+    """Today's system prompt for the configured model."""
+    return system_call_for(use_local_model)
+
+
+# Slow initialisation runs in the background, in parallel; each request only
+# waits for the components it needs (see /readyz for progress).
+def start_sheets():
+    warm_up_sheets()
+    leave_ledger.load()
+    leave_index.load()
+    team_availability.load()
+
+
+# Without a SESSION_BACKEND, journals, the ledger and the schedulers below
+# live in this process's data directory, and a second worker stops here
+# instead of corrupting them. With one they are shared, and any number of
+# workers can run: the background jobs run in whichever is the leader
+if shared_backend() is None:
+    lock_data_dir()
+leadership.start()
+startup.register("sheets", start_sheets)
+startup.register("policies", init_policies)
+if use_local_model:
+    startup.register("model", load_local_model)
+startup.start()
+# Replays any leave rows that were queued but not written before a restart
+log_writer.start()
+# Expires idle sessions, OTPs and conversations in the background
+start_session_sweeper()
+# Sends queued email (and any left unsent before a restart) in the background
+outbox.start()
+# Lead digests waiting when the app stopped go out one window after start
+if lead_digest:
+    lead_digest.start()
+leave_ledger.start_compactor(
+    float(os.getenv("LEDGER_COMPACT_SECONDS", 60)), leader=leadership
+)
+# Picks up leave and directory rows added or edited in the sheets by hand
+LEAVE_INDEX_REFRESH_SECONDS = float(os.getenv("LEAVE_INDEX_REFRESH_SECONDS", 60))
+leave_index.start_refresher(LEAVE_INDEX_REFRESH_SECONDS)
+team_availability.start_refresher(LEAVE_INDEX_REFRESH_SECONDS)
+# Applies the leads' email replies (started in every worker; the leader reads)
+print("🔄 Starting inbox watcher thread...")
+threading.Thread(target=watch_inbox, daemon=True).start()
+# Monthly accrual / year-end carry-over (otherwise run `python -m src.accrual`)
+if os.getenv("ACCRUAL_SCHEDULER", "").lower() in ("1", "true", "yes"):
+    start_accrual_scheduler(
+        balance_ws,
+        AccrualState(data_path("accrual_state.json"), backend=shared_backend()),
+        ledger=leave_ledger,
+        leader=leadership,
+    )
 
 app = Flask(
     __name__,
@@ -84,11 +164,18 @@ def process_message(message, user_id):
     print(f"📨 Received message: '{message}'")
 
     # Initialize conversation history
-    if user_id not in conversation_history:
-        conversation_history[user_id] = [{"role": "system", "content": system_call}]
+    user_conv_history = conversation_history.get(user_id) or [
+        {"role": "system", "content": system_call()}
+    ]
+    try:
+        return _process_message(message, user_id, user_conv_history)
+    finally:
+        # The history is changed in place; store it back so the session
+        # store's size accounting (and expiry) see the latest version
+        conversation_history[user_id] = user_conv_history
 
-    user_conv_history = conversation_history[user_id]
 
+def _process_message(message, user_id, user_conv_history):
     # Debug commands
     if message == "debug_auth":
         authenticated_emp = get_authenticated_employee(user_id)
@@ -101,10 +188,8 @@ def process_message(message, user_id):
         from .core.auth import clear_authentication
 
         clear_authentication(user_id)
-        if user_id in pending_function_calls:
-            del pending_function_calls[user_id]
-        if user_id in conversation_history:
-            conversation_history[user_id] = [{"role": "system", "content": system_call}]
+        pending_function_calls.pop(user_id, None)
+        user_conv_history[:] = [{"role": "system", "content": system_call()}]
         return {
             "message": "🧹 All session data reset",
             "require_auth": False,
@@ -114,7 +199,9 @@ def process_message(message, user_id):
 
     # Generate response
     # while True:
-    tool_call, response = generate_response(user_conv_history, use_local_model)
+    tool_call, response = generate_response(
+        user_conv_history, use_local_model, session_id=user_id
+    )
     executed_tool = False
     assistant_message = ""
 
@@ -151,7 +238,9 @@ def process_message(message, user_id):
                     }
                 )
             else:
-                user_conv_history.append(response)  # the function_call
+                # the function_call, as a plain dict so the history can be
+                # stored in a shared session backend
+                user_conv_history.append(response.model_dump(exclude_none=True))
                 user_conv_history.append(
                     {
                         "type": "function_call_output",
@@ -160,7 +249,9 @@ def process_message(message, user_id):
                     }
                 )
 
-            tool_call, response2 = generate_response(user_conv_history, use_local_model)
+            tool_call, response2 = generate_response(
+                user_conv_history, use_local_model, session_id=user_id
+            )
             user_conv_history.append({"role": "assistant", "content": response2})
             return {"message": response2, "require_auth": False}
 
@@ -208,13 +299,16 @@ def handle_otp_submission(otp_input, user_id):
         user_id,
     )
 
-    # Add to conversation history
-    user_conv_history = conversation_history[user_id]
+    # Add to conversation history (it may have expired while the OTP was pending)
+    user_conv_history = conversation_history.get(user_id) or [
+        {"role": "system", "content": system_call()}
+    ]
 
     # Normal function execution
     user_conv_history.append(
         {"role": "assistant", "content": call_result.get("message", "")}
     )
+    conversation_history[user_id] = user_conv_history
 
     # Clear pending call
     pending_function_calls.pop(user_id, None)
@@ -244,10 +338,27 @@ def chat():
     if not session_id:
         session_id = str(uuid.uuid4())
 
-    if session_id not in user_sessions:
-        user_sessions[session_id] = {"user_id": str(uuid.uuid4())}
+    session = user_sessions.get(session_id)
+    if session is None:
+        session = {"user_id": str(uuid.uuid4())}
+        user_sessions[session_id] = session
 
-    user_id = user_sessions[session_id]["user_id"]
+    user_id = session["user_id"]
+
+    try:
+        startup.wait_for("model", timeout=STARTUP_WAIT_SECONDS)
+    except startup.ComponentNotReady as e:
+        print(f"⏳ Chat request before model was ready: {e}")
+        return (
+            jsonify(
+                {
+                    "message": "⏳ I'm still starting up. Please try again in a moment.",
+                    "require_auth": False,
+                    "session_id": session_id,
+                }
+            ),
+            503,
+        )
 
     response = process_message(message, user_id)
 
@@ -266,16 +377,128 @@ def verify_otp_endpoint():
     otp = data.get("otp", "")
     session_id = data.get("session_id", "")
 
-    if session_id not in user_sessions:
+    session = user_sessions.get(session_id)
+    if session is None:
         return jsonify({"success": False, "message": "Invalid session"})
 
-    user_id = user_sessions[session_id]["user_id"]
+    user_id = session["user_id"]
 
     result = handle_otp_submission(otp, user_id)
 
     return jsonify(result)
 
 
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: 200 once every startup component is ready, 503 until then."""
+    ready = startup.all_ready()
+    return (
+        jsonify({"ready": ready, "components": startup.status()}),
+        200 if ready else 503,
+    )
+
+
+@app.route("/api/stats")
+def stats():
+    """Operational counters (Sheets API calls, throttling, retries, ...)."""
+    return jsonify(
+        {
+            "sheets": quota_stats(),
+            "singleflight": singleflight_stats(),
+            "mail": outbox.stats(),
+            "write_behind": log_writer.stats(),
+            "leadership": leadership.stats(),
+            "sessions": session_stats(),
+            "otp": otp_stats(),
+            "prompt_cache": prompt_cache_stats(),
+        }
+    )
+
+
+@app.route("/api/team-availability")
+def team_availability_endpoint():
+    """
+    Who on the caller's team is off, day by day.
+
+    Query params: session_id (an OTP-authenticated chat session), start and
+    end (YYYY-MM-DD).
+    """
+    session_id = request.args.get("session_id", "")
+    session = user_sessions.get(session_id)
+    if session is None:
+        return jsonify({"error": "Invalid session"}), 401
+    employee_id = get_authenticated_employee(session["user_id"])
+    if not employee_id:
+        return jsonify({"error": "Please verify your identity in the chat first"}), 401
+
+    lead = team_availability.team_lead_for(employee_id)
+    if not lead:
+        return jsonify({"error": f"No team found for employee {employee_id}"}), 404
+    try:
+        view = team_availability.who_is_off(
+            lead, request.args.get("start", ""), request.args.get("end", "")
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(view)
+
+
+def _is_admin(req) -> bool:
+    """Admin endpoints need `Authorization: Bearer $ADMIN_API_TOKEN` (disabled if unset)."""
+    token = os.getenv("ADMIN_API_TOKEN")
+    given = req.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    return bool(token) and hmac.compare_digest(given, token)
+
+
+@app.route("/api/admin/import", methods=["POST"])
+def bulk_import_endpoint():
+    """
+    Bulk-import leave requests from an uploaded CSV/XLSX (`file`).
+
+    Form fields: notify ("none" | "digest"), history, dry_run ("1" to enable).
+    Returns the per-row report from src/bulk_import.py.
+    """
+    if not _is_admin(request):
+        return jsonify({"error": "Admin token required"}), 403
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify({"error": "Upload the file as form field 'file'"}), 400
+    try:
+        startup.wait_for("sheets", timeout=STARTUP_WAIT_SECONDS)
+    except startup.ComponentNotReady as e:
+        return jsonify({"error": str(e)}), 503
+
+    flag = lambda name: request.form.get(name, "").lower() in ("1", "true", "yes")
+    try:
+        rows = read_table(upload.stream, upload.filename)
+        result = import_leave(
+            rows,
+            notify=request.form.get("notify", "none"),
+            history=flag("history"),
+            dry_run=flag("dry_run"),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+
+@app.route("/api/admin/mail/<message_id>")
+def mail_status(message_id):
+    """Delivery status of a queued email (queued, retrying, sent, failed, ...)."""
+    if not _is_admin(request):
+        return jsonify({"error": "Admin token required"}), 403
+    status = outbox.status(message_id)
+    if status is None:
+        return jsonify({"error": f"Unknown message {message_id}"}), 404
+    return jsonify(status)
+
+
 def start_ngrok():
     """Start ngrok tunnel"""
     port = 5000
@@ -284,9 +507,6 @@ def start_ngrok():
 
 
 if __name__ == "__main__":
-    print("🔄 Starting inbox watcher thread...")
-    threading.Thread(target=watch_inbox, daemon=True).start()
-
     # Start ngrok if available
     if USE_NGROK:
         try:
@@ -0,0 +1,282 @@
+import datetime
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional
+
+from .leave_calendar import parse_date
+
+# Statuses that mean someone will be (or may be) off
+ABSENT_STATUSES = ("pending", "approved")
+
+# Longest range one availability query may cover
+MAX_QUERY_DAYS = 92
+
+
+def _team_key(lead) -> str:
+    # Leads are email addresses; compare them case-insensitively
+    return str(lead or "").strip().lower()
+
+
+class TeamAvailability:
+    """
+    Materialised view of who is off, bucketed by lead and by day.
+
+    Built with one read of the logs and directory, then maintained as
+    requests are added, approved or rejected, and rebuilt periodically by
+    `start_refresher()` so rows edited in the sheets by hand show up. Answering "who on my team is
+    off next week?" is then a handful of dict lookups (one per day), however
+    many logs there are.
+
+    Teams are identified by their lead, as stored in the directory's Lead
+    column.
+
+    With `changes` (a SharedVersion), processes that each keep a view tell
+    each other about the requests they add or decide, and a view reloads
+    before its next use once another process has changed something.
+    """
+
+    def __init__(
+        self,
+        logs_table,
+        directory_table,
+        extra_logs: Optional[Callable[[], Iterable[dict]]] = None,
+        changes=None,
+    ):
+        """
+        Args:
+            logs_table: The leave logs table
+            directory_table: The employee directory
+            extra_logs: Returns log records not in the table yet (e.g. still
+                in the write-behind queue); called on load
+            changes: SharedVersion bumped whenever a process changes a request
+        """
+        self.logs = logs_table
+        self.directory = directory_table
+        self.extra_logs = extra_logs
+        self.changes = changes
+        self._lock = threading.RLock()
+        self._loaded = False
+        # Format: {lead: {date ordinal: {request_id: absence dict}}}
+        self._days = defaultdict(lambda: defaultdict(dict))
+        # Format: {request_id: (lead, start ordinal, end ordinal)}
+        self._requests: Dict[str, tuple] = {}
+        # Format: {lead: number of people reporting to them}
+        self._team_sizes: Dict[str, int] = defaultdict(int)
+        # Format: {employee_id: email (lowercase)}, to recognise leads
+        self._emails: Dict[str, str] = {}
+        # Format: {employee_id: (name, lead)}
+        self._employees: Dict[str, tuple] = {}
+        self._refresher = None
+
+    def load(self, fresh: bool = False):
+        """
+        Build the view from the logs and directory (again on each refresh).
+
+        Args:
+            fresh: Re-read the logs rather than use a cached copy
+        """
+        if self.changes:
+            self.changes.changed()
+        directory = list(self.directory.get_all_records())
+        # Queued rows first: one flushed in between is then in the table
+        extra = list(self.extra_logs()) if self.extra_logs else []
+        if fresh:
+            self.logs.invalidate()
+        logs = list(self.logs.get_all_records()) + extra
+        with self._lock:
+            self._days.clear()
+            self._requests.clear()
+            self._team_sizes.clear()
+            self._emails.clear()
+            self._employees.clear()
+            for record in directory:
+                employee_id = str(record["Employee ID"])
+                lead = _team_key(record.get("Lead"))
+                self._employees[employee_id] = (record.get("Name", ""), lead)
+                self._emails[employee_id] = _team_key(record.get("Email"))
+                if lead:
+                    self._team_sizes[lead] += 1
+
+            for log in logs:
+                employee_id = str(log["Employee ID"])
+                name, lead = self._employees.get(employee_id, ("", ""))
+                self._add(
+                    str(log["Request ID"]),
+                    employee_id,
+                    log.get("Employee Name") or name,
+                    lead,
+                    log.get("Leave Type", ""),
+                    str(log.get("Status", "")),
+                    log["Start Date"],
+                    log["End Date"],
+                )
+            first = not self._loaded
+            self._loaded = True
+        if first:
+            print(
+                f"👥 Team availability loaded: {len(self._requests)} absence(s) "
+                f"across {len(self._team_sizes)} team(s)"
+            )
+
+    def start_refresher(self, interval: float = 60.0):
+        """Rebuild from the tables every `interval` seconds in a background thread (idempotent)."""
+        if self._refresher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"⚠️ Team availability refresh failed, will retry: {e}")
+
+        self._refresher = threading.Thread(
+            target=run, name="team-availability-refresher", daemon=True
+        )
+        self._refresher.start()
+
+    def _ensure_loaded(self):
+        # Call with self._lock held
+        if not self._loaded:
+            self.load()
+        elif self.changes and self.changes.changed():
+            self.load(fresh=True)
+
+    def _changed(self):
+        # Call after a change other processes should pick up
+        if self.changes:
+            self.changes.bump()
+
+    def _add(
+        self,
+        request_id,
+        employee_id,
+        name,
+        lead,
+        leave_type,
+        status,
+        start_date,
+        end_date,
+    ):
+        # Call with self._lock held
+        self._remove(request_id)
+        lead = _team_key(lead)
+        start, end = parse_date(start_date), parse_date(end_date)
+        if not lead or status.lower() not in ABSENT_STATUSES or not start or not end:
+            return
+        start, end = start.toordinal(), end.toordinal()
+        absence = {
+            "request_id": request_id,
+            "employee_id": employee_id,
+            "name": name,
+            "leave_type": leave_type,
+            "status": status,
+        }
+        days = self._days[lead]
+        for day in range(start, end + 1):
+            days[day][request_id] = absence
+        self._requests[request_id] = (lead, start, end)
+
+    def _remove(self, request_id) -> bool:
+        # Call with self._lock held
+        entry = self._requests.pop(request_id, None)
+        if entry is None:
+            return False
+        lead, start, end = entry
+        days = self._days[lead]
+        for day in range(start, end + 1):
+            days[day].pop(request_id, None)
+            if not days[day]:
+                del days[day]
+        return True
+
+    def add(
+        self,
+        request_id,
+        employee_id,
+        name,
+        lead,
+        leave_type,
+        start_date,
+        end_date,
+        status="Pending",
+    ):
+        """Record a new (or changed) leave request."""
+        with self._lock:
+            self._ensure_loaded()
+            self._add(
+                str(request_id),
+                str(employee_id),
+                name,
+                lead,
+                leave_type,
+                status,
+                start_date,
+                end_date,
+            )
+        self._changed()
+
+    def set_status(self, request_id, status: str):
+        """Update a request's status; rejected requests drop out of the view."""
+        request_id = str(request_id)
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._requests.get(request_id)
+            if entry is None:
+                return
+            if status.lower() not in ABSENT_STATUSES:
+                self._remove(request_id)
+            else:
+                lead, start, _ = entry
+                # Every day shares the same absence dict
+                self._days[lead][start][request_id]["status"] = status
+        self._changed()
+
+    def team_lead_for(self, employee_id) -> Optional[str]:
+        """
+        The team an employee should see: their own reports if they are a
+        lead, otherwise the team they belong to.
+        """
+        employee_id = str(employee_id)
+        with self._lock:
+            self._ensure_loaded()
+            email = self._emails.get(employee_id)
+            if email and email in self._team_sizes:
+                return email
+            _, lead = self._employees.get(employee_id, ("", ""))
+            return lead or None
+
+    def who_is_off(self, lead: str, start_date, end_date) -> dict:
+        """
+        Absences in a team, day by day.
+
+        Returns:
+            dict: {"lead", "team_size", "days": {YYYY-MM-DD: [absence, ...]}}
+            with only the days on which someone is off
+        """
+        start, end = parse_date(start_date), parse_date(end_date)
+        if start is None or end is None:
+            raise ValueError(f"Unreadable dates: {start_date} to {end_date}")
+        if end < start:
+            raise ValueError("The end date must be on or after the start date.")
+        if (end - start).days >= MAX_QUERY_DAYS:
+            raise ValueError(f"Please ask about at most {MAX_QUERY_DAYS} days at once.")
+        lead = _team_key(lead)
+        with self._lock:
+            self._ensure_loaded()
+            days = self._days.get(lead, {})
+            result = {}
+            for day in range(start.toordinal(), end.toordinal() + 1):
+                absences = days.get(day)
+                if absences:
+                    result[datetime.date.fromordinal(day).isoformat()] = sorted(
+                        (dict(a) for a in absences.values()),
+                        key=lambda a: a["name"],
+                    )
+            return {
+                "lead": lead,
+                "team_size": self._team_sizes.get(lead, 0),
+                "days": result,
+            }
@@ -0,0 +1,391 @@
+import argparse
+import datetime
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from pydantic import TypeAdapter, ValidationError
+
+from .constants import BULK_IMPORT_DIGEST_ROW, BULK_IMPORT_DIGEST_TEMPLATE
+from .core.auth import send_mail
+from .core.mailer import outbox
+from .core.session_backends import leadership, shared_backend
+from .data_dir import lock_data_dir
+from .leave_calendar import validate_requests
+from .validation import AddLeaveLogArgs
+from .utils import (
+    directory_ws,
+    logs_ws,
+    leave_index,
+    leave_ledger,
+    leave_request_lock,
+    request_id_allocator,
+    team_availability,
+)
+
+NOTIFY_MODES = ("none", "digest")
+
+_rows_adapter = TypeAdapter(List[AddLeaveLogArgs])
+_FIELDS = set(AddLeaveLogArgs.model_fields)
+
+
+def read_table(source, filename: str) -> List[dict]:
+    """
+    Read a CSV or XLSX upload into row dicts keyed by AddLeaveLogArgs field.
+
+    Headers may be the field names (employee_id, leave_type, ...) or the
+    sheet headers (Employee ID, Leave Type, ...). Other columns are ignored.
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        frame = pd.read_csv(source, dtype=str, keep_default_na=False)
+    elif extension in (".xlsx", ".xlsm"):
+        frame = pd.read_excel(source, dtype=object)
+    else:
+        raise ValueError(f"Unsupported file type '{extension}'; use .csv or .xlsx")
+
+    frame.columns = [str(c).strip().lower().replace(" ", "_") for c in frame.columns]
+    rows = []
+    for record in frame.to_dict(orient="records"):
+        row = {}
+        for field, value in record.items():
+            if field not in _FIELDS or value is None or value == "":
+                continue
+            if isinstance(value, float) and pd.isna(value):
+                continue
+            if isinstance(value, (datetime.date, pd.Timestamp)):
+                value = value.strftime("%Y-%m-%d")
+            row[field] = value if field == "days" else str(value).strip()
+        rows.append(row)
+    return rows
+
+
+def validate_rows(
+    rows: List[dict],
+) -> Tuple[Dict[int, AddLeaveLogArgs], Dict[int, List[str]]]:
+    """
+    Validate every row through AddLeaveLogArgs in one pass.
+
+    Returns:
+        tuple: ({row index: parsed args}, {row index: [error messages]})
+    """
+    errors = defaultdict(list)
+    try:
+        return dict(enumerate(_rows_adapter.validate_python(rows))), {}
+    except ValidationError as e:
+        for error in e.errors():
+            index, *field = error["loc"]
+            where = ".".join(str(part) for part in field) or "row"
+            errors[index].append(f"{where}: {error['msg']}")
+    ok = [i for i in range(len(rows)) if i not in errors]
+    return dict(zip(ok, _rows_adapter.validate_python([rows[i] for i in ok]))), dict(
+        errors
+    )
+
+
+def _describe_claim(request_id) -> str:
+    # Rows of the file being imported are indexed as "import:<row index>"
+    if str(request_id).startswith("import:"):
+        return f"row {int(str(request_id).split(':')[1]) + 2} of this file"
+    return f"request #{request_id}"
+
+
+def _send_digests(accepted: List[dict]):
+    by_lead = defaultdict(list)
+    for item in accepted:
+        if item["lead"]:
+            by_lead[item["lead"]].append(item)
+    for lead, items in by_lead.items():
+        rows = "\n".join(BULK_IMPORT_DIGEST_ROW.format(**item) for item in items)
+        body = BULK_IMPORT_DIGEST_TEMPLATE.format(count=len(items), rows=rows)
+        subject = f"{len(items)} imported leave request(s) for your team"
+        if send_mail(lead, subject, body, f"StaffSync.AI - {subject}", otp=False):
+            print(f"✅ Import digest queued to LEAD: {lead} ({len(items)} request(s))")
+        else:
+            print(f"⚠️ Failed to queue import digest to {lead}")
+
+
+def import_leave(
+    rows: List[dict],
+    notify: str = "none",
+    history: bool = False,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Import many leave requests at once.
+
+    Rows are validated together (schema, working days, overlaps, balances
+    against one snapshot of the ledger), and all accepted rows are written
+    with a single `append_rows`. Rows with problems are left out and
+    reported; they don't stop the others.
+
+    Args:
+        rows: Row dicts as returned by `read_table()`
+        notify: "none" (no email) or "digest" (one summary email per lead)
+        history: Rows are past leave already reflected in balances, so
+            balances are neither checked nor changed and the team limit is
+            not applied
+        dry_run: Validate and report only; nothing is written
+
+    Returns:
+        dict: {"accepted", "rejected", "dry_run", "rows": [{"row", "ok",
+        "request_id" | "errors"}]} where "row" is the line in the file
+    """
+    if notify not in NOTIFY_MODES:
+        raise ValueError(f"notify must be one of {NOTIFY_MODES}")
+    # Under the lock add_leave_log takes, so the file's rows and requests
+    # made meanwhile (in any process) are checked against each other
+    with leave_request_lock:
+        return _import_leave(rows, notify, history, dry_run)
+
+
+def _import_leave(rows, notify, history, dry_run) -> dict:
+    parsed, errors = validate_rows(rows)
+    errors = defaultdict(list, errors)
+
+    # One read of the directory for names, leads and holiday regions
+    people = {str(r["Employee ID"]): r for r in directory_ws.get_all_records()}
+    for i, args in parsed.items():
+        if args.employee_id not in people:
+            errors[i].append(f"employee_id: unknown employee {args.employee_id}")
+
+    candidates = [i for i in parsed if i not in errors]
+    problems = validate_requests(
+        [parsed[i].start_date for i in candidates],
+        [parsed[i].end_date for i in candidates],
+        [parsed[i].days for i in candidates],
+        [people[parsed[i].employee_id].get("Region") or None for i in candidates],
+    )
+    for i, problem in zip(candidates, problems):
+        if problem:
+            errors[i].append(problem)
+
+    # Overlaps with existing leave and with earlier rows of this file
+    claims = {}
+    for i in parsed:
+        args = parsed[i]
+        if i in errors or args.status == "Rejected":
+            continue
+        lead = people[args.employee_id].get("Lead", "")
+        claim_id = f"import:{i}"
+        if history:
+            found = leave_index.conflicts(
+                args.employee_id, lead, args.start_date, args.end_date
+            )
+            claimed = not found["overlaps"]
+            if claimed:
+                leave_index.add(
+                    claim_id, args.employee_id, lead, args.start_date, args.end_date
+                )
+        else:
+            claimed, found = leave_index.claim(
+                claim_id, args.employee_id, lead, args.start_date, args.end_date
+            )
+        if claimed:
+            claims[i] = claim_id
+        elif found["overlaps"]:
+            errors[i].append(
+                "Overlaps existing leave: "
+                + ", ".join(_describe_claim(r) for r in found["overlaps"])
+            )
+        else:
+            errors[i].append("Too many teammates are already off on these dates")
+
+    # Balances: one snapshot, then each row spends from it in file order
+    remaining = {}
+    if not history:
+        for i in parsed:
+            if i in errors or parsed[i].status == "Rejected":
+                continue
+            args = parsed[i]
+            key = (args.employee_id, args.leave_type)
+            if key not in remaining:
+                remaining[key] = leave_ledger.available(*key) or 0
+            if args.days > remaining[key]:
+                errors[i].append(
+                    f"Insufficient {args.leave_type} balance: {remaining[key]} available, {args.days} requested"
+                )
+                leave_index.remove(claims.pop(i, None))
+            else:
+                remaining[key] -= args.days
+
+    accepted = [i for i in parsed if i not in errors]
+
+    def release_claims():
+        for claim_id in claims.values():
+            leave_index.remove(claim_id)
+
+    if dry_run or not accepted:
+        release_claims()
+        return _report(len(rows), accepted, {}, errors, dry_run)
+
+    submitted_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Reservations are keyed by row until the rows have their request IDs
+    reserved = []
+    if not history:
+        for i in accepted:
+            args = parsed[i]
+            if args.status != "Pending":
+                continue
+            if leave_ledger.reserve(
+                f"import:{i}", args.employee_id, args.leave_type, args.days
+            ):
+                reserved.append(i)
+            else:
+                # Another request spent the days since the snapshot
+                errors[i].append(f"Insufficient {args.leave_type} balance")
+        accepted = [i for i in accepted if i not in errors]
+
+    # IDs only for rows that passed every check, so rejected rows leave no gaps
+    try:
+        request_ids = dict(zip(accepted, request_id_allocator.next_ids(len(accepted))))
+    except Exception:
+        for i in reserved:
+            leave_ledger.release(f"import:{i}")
+        release_claims()
+        raise
+
+    new_rows = [
+        [
+            request_ids[i],
+            parsed[i].employee_id,
+            people[parsed[i].employee_id].get("Name", ""),
+            parsed[i].leave_type,
+            parsed[i].days,
+            parsed[i].start_date,
+            parsed[i].end_date,
+            parsed[i].status,
+            submitted_at,
+            "",  # Approved By
+            "",  # Approval Date
+        ]
+        for i in accepted
+    ]
+    try:
+        if new_rows:
+            logs_ws.append_rows(new_rows)
+    except Exception:
+        for i in reserved:
+            leave_ledger.release(f"import:{i}")
+        release_claims()
+        raise
+    # Re-keyed once the rows are in the table, so a reload finds them
+    for i in reserved:
+        leave_ledger.rename(f"import:{i}", request_ids[i])
+
+    digest = []
+    for i, row in zip(accepted, new_rows):
+        args = parsed[i]
+        request_id = request_ids[i]
+        lead = people[args.employee_id].get("Lead", "")
+        if args.status == "Approved" and not history:
+            leave_ledger.commit(
+                request_id, args.employee_id, args.leave_type, args.days
+            )
+        if i in claims:
+            # Swap the placeholder claim for the real request ID
+            leave_index.rename(claims.pop(i), request_id)
+        team_availability.add(
+            request_id,
+            args.employee_id,
+            row[2],
+            lead,
+            args.leave_type,
+            args.start_date,
+            args.end_date,
+            args.status,
+        )
+        digest.append(
+            {
+                "lead": lead,
+                "request_id": request_id,
+                "employee_name": row[2],
+                "leave_type": args.leave_type,
+                "days": args.days,
+                "start_date": args.start_date,
+                "end_date": args.end_date,
+                "status": args.status,
+            }
+        )
+    release_claims()  # rows dropped after claiming
+
+    print(f"📥 Imported {len(new_rows)} leave request(s); {len(errors)} rejected")
+    if notify == "digest":
+        _send_digests(digest)
+    return _report(len(rows), accepted, request_ids, errors, dry_run)
+
+
+def _report(total, accepted, request_ids, errors, dry_run) -> dict:
+    rows = []
+    for i in range(total):
+        if i in errors:
+            rows.append({"row": i + 2, "ok": False, "errors": errors[i]})
+        else:
+            rows.append({"row": i + 2, "ok": True, "request_id": request_ids.get(i)})
+    return {
+        "accepted": len(accepted),
+        "rejected": len(errors),
+        "dry_run": dry_run,
+        "rows": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk import leave requests from a CSV or XLSX file"
+    )
+    parser.add_argument("file")
+    parser.add_argument("--notify", choices=NOTIFY_MODES, default="none")
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="Past leave already reflected in balances (no balance checks or debits)",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument(
+        "--report", help="Write the full per-row report to this JSON file"
+    )
+    args = parser.parse_args()
+
+    if shared_backend() is None:
+        # The Request ID counter, ledger and outbox journals are the app's;
+        # if it is running, import through it instead
+        try:
+            lock_data_dir()
+        except RuntimeError as e:
+            parser.exit(
+                1, f"❌ {e}\nWhile the app is running, use POST /api/admin/import.\n"
+            )
+    else:
+        # Shared with the app; we send the mail ourselves only if no app
+        # process is leading
+        leadership.start()
+
+    with open(args.file, "rb") as f:
+        rows = read_table(f, args.file)
+    result = import_leave(
+        rows, notify=args.notify, history=args.history, dry_run=args.dry_run
+    )
+    leave_ledger.compact()
+    # The mail workers are daemon threads and would die with the process
+    if not outbox.flush(timeout=300):
+        print(
+            f"⚠️ {outbox.stats()['queue_length']} email(s) still queued; "
+            "the app sends them from the outbox when it next starts"
+        )
+
+    for row in result["rows"]:
+        if not row["ok"]:
+            print(f"Row {row['row']}: " + "; ".join(row["errors"]))
+    verb = "would be imported" if args.dry_run else "imported"
+    print(f"{result['accepted']} row(s) {verb}, {result['rejected']} rejected")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
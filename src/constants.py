@@ -55,6 +55,30 @@ tools = [
             "additionalProperties": False,
         },
     },
+    {
+        "type": "function",
+        "name": "get_team_availability",
+        "description": "List who on the employee's team is off (approved or pending leave) between two dates. Use this when the user asks who is away, off or available on their team. If the user is a lead, this covers the people reporting to them. User needs to provide employee id for this function, if not provided, ask politely first.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "employee_id": {
+                    "type": "string",
+                    "description": "The employee's unique ID.",
+                },
+                "start_date": {
+                    "type": "string",
+                    "description": "First day to check (YYYY‑MM‑DD).",
+                },
+                "end_date": {
+                    "type": "string",
+                    "description": "Last day to check (YYYY‑MM‑DD).",
+                },
+            },
+            "required": ["employee_id", "start_date", "end_date"],
+            "additionalProperties": False,
+        },
+    },
     {
         "type": "function",
         "name": "file_search",
@@ -72,9 +96,9 @@ tools = [
         },
     },
 ]
-system_call_openai = """You are Avy, an HR assistant for StaffSync.AI. You help employees with leave requests, balance inquiries, and HR policy questions. You can also search HR policy documents for relevant information. Today's date is {date}."""
+SYSTEM_CALL_OPENAI_TEMPLATE = """You are Avy, an HR assistant for StaffSync.AI. You help employees with leave requests, balance inquiries, and HR policy questions. You can also search HR policy documents for relevant information. Today's date is {date}."""
 
-system_call_llama = """
+SYSTEM_CALL_LLAMA_TEMPLATE = """
 Environment: ipython\n
     You are Avy, an HR assistant for StaffSync.AI. 
     ### How you work\n
@@ -91,17 +115,21 @@ Environment: ipython\n
     - When a user mentions 'tomorrow' for leave, use above dates\n\n
     ### Available tools\n"""
 
-system_call_openai = system_call_openai.format(
-    date=datetime.datetime.now().strftime("%Y-%m-%d")
-)
-system_call_llama = system_call_llama.format(
-    date=datetime.datetime.now().strftime("%Y-%m-%d"),
-    tomorrow_date=(datetime.datetime.now() + datetime.timedelta(days=1)).strftime(
-        "%Y-%m-%d"
-    ),
-)
 
-system_call_llama += str(tools)
+def system_call_for(use_local_model: bool, now: datetime.datetime = None) -> str:
+    """
+    The system prompt for the OpenAI or local model, dated `now` (default:
+    the current time), so a long-running server doesn't keep the date it
+    started on.
+    """
+    now = now or datetime.datetime.now()
+    if not use_local_model:
+        return SYSTEM_CALL_OPENAI_TEMPLATE.format(date=now.strftime("%Y-%m-%d"))
+    return SYSTEM_CALL_LLAMA_TEMPLATE.format(
+        date=now.strftime("%Y-%m-%d"),
+        tomorrow_date=(now + datetime.timedelta(days=1)).strftime("%Y-%m-%d"),
+    ) + str(tools)
+
 
 LEAVE_REQUEST_TEMPLATE = """
 <html>
@@ -167,6 +195,64 @@ LEAVE_REQUEST_TEMPLATE = """
 </html>
 """
 
+LEAD_DIGEST_TEMPLATE = """
+<html>
+  <body style="font-family: Arial, sans-serif; padding: 20px; background-color: #f5f5f5;">
+    <div style="max-width: 600px; margin: 0 auto; background-color: white; padding: 30px; border-radius: 12px; box-shadow: 0 2px 10px rgba(0,0,0,0.1);">
+      <!-- Header -->
+      <div style="text-align: center; margin-bottom: 30px;">
+        <h1 style="color: #333; margin: 0;">📅 StaffSync.AI</h1>
+        <h2 style="color: #666; font-weight: normal; margin: 10px 0;">New Leave Requests</h2>
+      </div>
+
+      <p style="color: #555; font-size: 16px; line-height: 1.5;">
+        Hi,
+      </p>
+      <p style="color: #555; font-size: 16px; line-height: 1.5;">
+        {count} leave requests from your team are waiting for your decision:
+      </p>
+
+      <!-- Requests -->
+      <div style="background: #fafafa; padding: 20px; border-radius: 8px; border: 1px solid #e0e0e0; margin: 25px 0;">
+        <table style="width: 100%; font-size: 14px; border-collapse: collapse;">
+          <tr>
+            <th style="padding: 6px 4px; text-align: left;">#</th>
+            <th style="padding: 6px 4px; text-align: left;">Employee</th>
+            <th style="padding: 6px 4px; text-align: left;">Type</th>
+            <th style="padding: 6px 4px; text-align: left;">Days</th>
+            <th style="padding: 6px 4px; text-align: left;">Dates</th>
+            <th style="padding: 6px 4px; text-align: left;">Submitted</th>
+          </tr>
+          {rows}
+        </table>
+      </div>
+
+      <p style="color: #555; font-size: 14px; line-height: 1.5; margin-top: 0;">
+        <strong>To decide</strong>, reply with Y (approve) or N (reject) followed by request numbers, e.g.<br>
+        <code>Y {example_ids} / N {example_id}</code><br>
+        A plain Y or N applies to every request not listed otherwise.
+      </p>
+
+      <!-- Footer -->
+      <hr style="border: none; border-top: 1px solid #eee; margin: 25px 0;">
+      <p style="color: #999; font-size: 12px; text-align: center; margin: 0;">
+        Thank you,<br>
+        <strong>StaffSync.AI Team</strong>
+      </p>
+    </div>
+  </body>
+</html>
+"""
+
+LEAD_DIGEST_ROW = """<tr>
+            <td style="padding: 6px 4px;">{request_id}</td>
+            <td style="padding: 6px 4px;">{employee_name}</td>
+            <td style="padding: 6px 4px;">{leave_type}</td>
+            <td style="padding: 6px 4px;">{days}</td>
+            <td style="padding: 6px 4px;">{start_date} – {end_date}</td>
+            <td style="padding: 6px 4px;">{submitted_at}</td>
+          </tr>"""
+
 AUTH_EMAIL_TEMPLATE = """
 <html>
     <body style="font-family: Arial, sans-serif; padding: 20px; background-color: #f5f5f5;">
@@ -239,3 +325,55 @@ LEAVE_STATUS_EMAIL_TEMPLATE = """
   </body>
 </html>
 """
+
+BULK_IMPORT_DIGEST_TEMPLATE = """
+<html>
+  <body style="font-family: Arial, sans-serif; padding: 20px; background-color: #f5f5f5;">
+    <div style="max-width: 600px; margin: 0 auto; background-color: white; padding: 30px; border-radius: 12px; box-shadow: 0 2px 10px rgba(0,0,0,0.1);">
+      <!-- Header -->
+      <div style="text-align: center; margin-bottom: 30px;">
+        <h1 style="color: #333; margin: 0;">📅 StaffSync.AI</h1>
+        <h2 style="color: #666; font-weight: normal; margin: 10px 0;">Imported Leave Requests</h2>
+      </div>
+
+      <p style="color: #555; font-size: 16px; line-height: 1.5;">
+        Hi,
+      </p>
+      <p style="color: #555; font-size: 16px; line-height: 1.5;">
+        {count} leave request(s) for your team were added by a bulk import:
+      </p>
+
+      <!-- Requests -->
+      <div style="background: #fafafa; padding: 20px; border-radius: 8px; border: 1px solid #e0e0e0; margin: 25px 0;">
+        <table style="width: 100%; font-size: 14px; border-collapse: collapse;">
+          <tr>
+            <th style="padding: 6px 4px; text-align: left;">#</th>
+            <th style="padding: 6px 4px; text-align: left;">Employee</th>
+            <th style="padding: 6px 4px; text-align: left;">Type</th>
+            <th style="padding: 6px 4px; text-align: left;">Days</th>
+            <th style="padding: 6px 4px; text-align: left;">Dates</th>
+            <th style="padding: 6px 4px; text-align: left;">Status</th>
+          </tr>
+          {rows}
+        </table>
+      </div>
+
+      <!-- Footer -->
+      <hr style="border: none; border-top: 1px solid #eee; margin: 25px 0;">
+      <p style="color: #999; font-size: 12px; text-align: center; margin: 0;">
+        Thank you,<br>
+        <strong>StaffSync.AI Team</strong>
+      </p>
+    </div>
+  </body>
+</html>
+"""
+
+BULK_IMPORT_DIGEST_ROW = """<tr>
+            <td style="padding: 6px 4px;">{request_id}</td>
+            <td style="padding: 6px 4px;">{employee_name}</td>
+            <td style="padding: 6px 4px;">{leave_type}</td>
+            <td style="padding: 6px 4px;">{days}</td>
+            <td style="padding: 6px 4px;">{start_date} – {end_date}</td>
+            <td style="padding: 6px 4px;">{status}</td>
+          </tr>"""
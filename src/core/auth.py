@@ -1,22 +1,172 @@
+import os
 import secrets
 import string
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import os
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from collections.abc import MutableMapping
 from typing import Dict, Optional, Tuple
 
-from src.sheets_config import directory_ws
+from src.data_loader import find_record
 from src.constants import AUTH_EMAIL_TEMPLATE
-
-# Store authenticated sessions per user
+from src.core.mailer import outbox
+from src.core.rate_limit import SlidingWindowLimiter, try_acquire, wait_text
+from src.core.session_backends import open_session_store
+
+# How long an OTP stays valid
+OTP_TTL_SECONDS = 10 * 60
+
+# Within this long of the last send, a repeat request reuses the pending code
+# without another email
+OTP_RESEND_COOLDOWN_SECONDS = float(os.getenv("OTP_RESEND_COOLDOWN_SECONDS", 60))
+# Most OTP emails per employee, and per chat session, in a window
+OTP_MAX_SENDS = int(os.getenv("OTP_MAX_SENDS", 5))
+OTP_SEND_WINDOW_SECONDS = float(os.getenv("OTP_SEND_WINDOW_SECONDS", 15 * 60))
+# Most verification attempts per employee, and per chat session, in a window
+OTP_MAX_VERIFY_ATTEMPTS = int(os.getenv("OTP_MAX_VERIFY_ATTEMPTS", 5))
+OTP_VERIFY_WINDOW_SECONDS = float(os.getenv("OTP_VERIFY_WINDOW_SECONDS", 10 * 60))
+
+# Store authenticated sessions per user (expire after SESSION_TTL_SECONDS idle)
 # Format: {user_id: True/False}
-authenticated_users = {}
+authenticated_users = open_session_store("authenticated_users")
+
+
+class PendingOtps(MutableMapping):
+    """
+    Pending OTPs by employee, with a reverse index by chat user.
+
+    Looking up a user's pending verification (`employee_for()`) is two key
+    lookups instead of a scan of every OTP in flight. Both sides are session
+    stores with the OTP lifetime, so they expire together through the
+    stores' timer wheel (no separate sweep).
+
+    A user has at most one pending OTP: requesting another one (for a
+    different employee ID) replaces it, just as their pending call is
+    replaced.
+    """
+
+    def __init__(self, ttl: float):
+        # Format: {emp_id: {"otp": str, "expires_at": unix timestamp, "user_id": str,
+        #                   "sent_at": unix timestamp, "masked_email": str}}
+        self._otps = open_session_store("pending_otps", ttl=ttl, sliding=False)
+        # Format: {user_id: emp_id}
+        self._users = open_session_store("pending_otp_users", ttl=ttl, sliding=False)
+        self._otps.on_evict = self._evicted
+        # Called as on_evict(emp_id, otp_data, reason) when an OTP expires
+        self.on_evict = None
+
+    def _unindex(self, emp_id, otp_data):
+        user_id = otp_data["user_id"]
+        if str(self._users.get(user_id)) == str(emp_id):
+            self._users.pop(user_id, None)
+
+    def _evicted(self, emp_id, otp_data, reason):
+        self._unindex(emp_id, otp_data)
+        if self.on_evict:
+            self.on_evict(emp_id, otp_data, reason)
+
+    def employee_for(self, user_id: str) -> Optional[str]:
+        """The employee ID the user has a live OTP pending for, if any."""
+        emp_id = self._users.get(user_id)
+        if emp_id is None:
+            return None
+        otp_data = self._otps.get(emp_id)
+        if otp_data is None or otp_data["user_id"] != user_id:
+            # Expired, or the employee's OTP was re-sent to another session
+            return None
+        return emp_id
+
+    def __getitem__(self, emp_id):
+        return self._otps[emp_id]
+
+    def __setitem__(self, emp_id, otp_data):
+        previous = self._otps.pop(emp_id, None)
+        if previous is not None:
+            self._unindex(emp_id, previous)
+        superseded = self._users.get(otp_data["user_id"])
+        if superseded is not None and str(superseded) != str(emp_id):
+            self._otps.pop(superseded, None)
+        self._otps[emp_id] = otp_data
+        self._users[otp_data["user_id"]] = emp_id
+
+    def __delitem__(self, emp_id):
+        self._unindex(emp_id, self._otps.pop(emp_id))
+
+    def pop(self, emp_id, *default):
+        otp_data = self._otps.pop(emp_id, None)
+        if otp_data is None:
+            if default:
+                return default[0]
+            raise KeyError(emp_id)
+        self._unindex(emp_id, otp_data)
+        return otp_data
+
+    def __contains__(self, emp_id) -> bool:
+        return emp_id in self._otps
+
+    def __iter__(self):
+        return iter(self._otps)
+
+    def items(self):
+        return self._otps.items()
+
+    def __len__(self) -> int:
+        return len(self._otps)
+
+    def expire(self):
+        self._otps.expire()
+        self._users.expire()
+
 
 # Store pending OTPs
-# Format: {emp_id: {"otp": str, "expires_at": datetime, "user_id": str}}
-pending_otps = {}
+pending_otps = PendingOtps(OTP_TTL_SECONDS)
+
+# OTP emails sent, by employee and by chat session
+sends_by_employee = SlidingWindowLimiter(
+    "otp_sends_by_employee", OTP_MAX_SENDS, OTP_SEND_WINDOW_SECONDS
+)
+sends_by_user = SlidingWindowLimiter(
+    "otp_sends_by_user", OTP_MAX_SENDS, OTP_SEND_WINDOW_SECONDS
+)
+# OTP verification attempts, by employee and by chat session
+verifies_by_employee = SlidingWindowLimiter(
+    "otp_verifies_by_employee", OTP_MAX_VERIFY_ATTEMPTS, OTP_VERIFY_WINDOW_SECONDS
+)
+verifies_by_user = SlidingWindowLimiter(
+    "otp_verifies_by_user", OTP_MAX_VERIFY_ATTEMPTS, OTP_VERIFY_WINDOW_SECONDS
+)
+
+# Format: {"sent": n, "reused": n, "throttled_sends": n, "throttled_verifies": n}
+_otp_stats = Counter()
+_otp_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _otp_stats_lock:
+        _otp_stats.update(increments)
+
+
+def otp_stats() -> dict:
+    """
+    OTP send counters for this process.
+
+    `suppressed_sends` counts requests that didn't send an email: a pending
+    code was reused within the cooldown (`reused`) or a send limit was hit
+    (`throttled_sends`).
+    """
+    with _otp_stats_lock:
+        stats = dict(_otp_stats)
+    stats["suppressed_sends"] = stats.get("reused", 0) + stats.get("throttled_sends", 0)
+    return stats
+
+
+def mask_email(email: str) -> str:
+    """Hide most of the local part of an address, e.g. joh****@example.com."""
+    email_parts = email.split("@")
+    if len(email_parts[0]) > 3:
+        return f"{email_parts[0][:3]}{'*' * (len(email_parts[0]) - 3)}@{email_parts[1]}"
+    return f"{'*' * len(email_parts[0])}@{email_parts[1]}"
 
 
 def generate_otp() -> str:
@@ -25,103 +175,87 @@ def generate_otp() -> str:
 
 
 def get_employee_email(emp_id: str) -> Optional[str]:
-    """Get employee email from Google Sheets using employee ID."""
+    """Get employee email from the directory using employee ID."""
     try:
-        directory_data = directory_ws.get_all_records()
-        for record in directory_data:
-            if str(record["Employee ID"]) == str(emp_id):
-                return record["Email"]
-        return None
+        _, record = find_record("directory", emp_id)
+        return record["Email"] if record else None
     except Exception as e:
         print(f"Error fetching employee email: {e}")
         return None
 
 
 def send_mail(email, content, body, subject, otp=True) -> bool:
-    """Send OTP to employee email with improved Gmail support."""
-
-    if otp:
-        email_type = "OTP"
-    else:
-        email_type = "Notification"
-    try:
-        # Email configuration
-        sender_email = os.environ.get("EMAIL_SENDER")
-        password = os.environ.get("EMAIL_PASSWORD")
-
-        if not sender_email or not password:
-            print("⚠️  EMAIL_SENDER or EMAIL_PASSWORD not set in environment variables")
-            print(f"[DEV MODE] {email_type} for {email}: {content}")
-            return True
-
-        # Create message
-        message = MIMEMultipart()
-        message["From"] = sender_email
-        message["To"] = email
-        message["Subject"] = subject
-
-        message.attach(MIMEText(body, "html"))
-
-        # Determine SMTP settings based on sender email
-        if "gmail.com" in sender_email.lower():
-            smtp_server = "smtp.gmail.com"
-            smtp_port = 587
-        elif (
-            "outlook.com" in sender_email.lower()
-            or "hotmail.com" in sender_email.lower()
-        ):
-            smtp_server = "smtp-mail.outlook.com"
-            smtp_port = 587
-        elif "yahoo.com" in sender_email.lower():
-            smtp_server = "smtp.mail.yahoo.com"
-            smtp_port = 587
-        else:
-            # Default to Gmail settings
-            smtp_server = "smtp.gmail.com"
-            smtp_port = 587
-
-        # Connect to SMTP server and send email
-        print(f"📧 Attempting to send {email_type} email via {smtp_server}...")
-
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(sender_email, password)
-        server.send_message(message)
-        server.quit()
-
-        print(f"✅ {email_type} sent successfully to {email}")
-        return True
-
-    except smtplib.SMTPAuthenticationError as e:
-        print(f"❌ SMTP Authentication failed: {e}")
-        print("\n🔧 TROUBLESHOOTING GMAIL AUTHENTICATION:")
-        print(
-            "1. Make sure you're using an App Password, not your regular Gmail password"
-        )
-        print("2. Enable 2-Factor Authentication on your Gmail account")
-        print("3. Generate an App Password: https://myaccount.google.com/apppasswords")
-        print(
-            "4. Use the 16-character App Password in your EMAIL_PASSWORD environment variable"
-        )
-        print(
-            "5. Make sure 'Less secure app access' is NOT enabled (use App Passwords instead)"
-        )
-        print(f"\n[DEV MODE] {email_type} for {email}: {content}")
-        return True  # Return True for dev environment
-
-    except Exception as e:
-        print(f"❌ Error sending {email_type} email: {e}")
-        print(f"[DEV MODE] {email_type} for {email}: {content}")
-        return True  # Return True anyway so flow continues in dev environment
+    """
+    Queue an email for the background outbox (see src/core/mailer.py).
+
+    Returns as soon as the message is queued; delivery, retries and the
+    DEV MODE fallback happen on the outbox's worker threads. OTP mail is
+    kept in memory only; notifications are journaled so they survive a
+    restart.
+
+    Args:
+        email: Recipient address
+        content: Short text printed in place of the email in dev mode
+        body: HTML body
+        subject: Subject line
+        otp: Whether this is an OTP email
+
+    Returns:
+        bool: True once the message is queued
+    """
+    outbox.enqueue(
+        email,
+        subject,
+        body,
+        preview=content,
+        kind="otp" if otp else "notification",
+        durable=not otp,
+    )
+    return True
 
 
 def initiate_authentication(user_id: str, emp_id: str) -> Dict:
     """
     Start the authentication process for a user.
     Returns a dict with authentication status and message.
+
+    A repeat request from the same session within OTP_RESEND_COOLDOWN_SECONDS
+    of the last email reuses the pending code without emailing again (or
+    reading the directory). After the cooldown the same still-valid code is
+    re-sent, and OTP emails are limited per employee and per session.
     """
     print(f"🔐 Initiating authentication for user: {user_id}, employee: {emp_id}")
 
+    now = time.time()
+    pending = pending_otps.get(emp_id)
+    if pending is not None and (
+        pending["user_id"] != user_id or pending["expires_at"] <= now
+    ):
+        pending = None
+
+    if pending is not None and now - pending["sent_at"] < OTP_RESEND_COOLDOWN_SECONDS:
+        _count(reused=1)
+        print(
+            f"♻️ Reusing pending OTP for employee {emp_id} (sent {now - pending['sent_at']:.0f}s ago)"
+        )
+        return {
+            "authenticated": False,
+            "message": f"📧 We've already sent a one-time password (OTP) to {pending['masked_email']}. Please enter it here to continue.",
+        }
+
+    # Counted before the email goes out, in one step with the check, so
+    # concurrent requests can't overshoot the limit
+    retry_after = try_acquire((sends_by_employee, emp_id), (sends_by_user, user_id))
+    if retry_after:
+        _count(throttled_sends=1)
+        print(
+            f"🚦 OTP send throttled for user {user_id}, employee {emp_id} ({retry_after:.0f}s left)"
+        )
+        message = f"⏳ Too many codes have been requested. Please wait {wait_text(retry_after)} and try again."
+        if pending is not None:
+            message += " If you already received a code, you can still enter it here."
+        return {"authenticated": False, "message": message}
+
     # Get employee email
     email = get_employee_email(emp_id)
 
@@ -131,33 +265,37 @@ def initiate_authentication(user_id: str, emp_id: str) -> Dict:
             "message": f"❌ No email found for employee ID {emp_id}. Please check your ID and try again.",
         }
 
-    # Generate and send OTP
-    otp = generate_otp()
+    # Re-send a still-valid code rather than invalidating the one in the inbox.
+    # It keeps its original expiry; only a new code gets a fresh 10 minutes
+    # (and one about to expire is replaced rather than re-sent)
+    if (
+        pending is not None
+        and pending["expires_at"] - now >= OTP_RESEND_COOLDOWN_SECONDS
+    ):
+        otp, expires_at = pending["otp"], pending["expires_at"]
+    else:
+        pending = None
+        otp, expires_at = generate_otp(), now + OTP_TTL_SECONDS
+    masked_email = mask_email(email)
 
-    # Store OTP with 10-minute expiration and associate with this user
+    # Store the OTP and associate it with this user
     pending_otps[emp_id] = {
         "otp": otp,
-        "expires_at": datetime.now() + timedelta(minutes=10),
+        "expires_at": expires_at,
         "user_id": user_id,
+        "sent_at": now,
+        "masked_email": masked_email,
     }
 
     print(
-        f"📱 Generated OTP {otp} for employee {emp_id}, expires at {pending_otps[emp_id]['expires_at']}"
+        f"📱 {'Re-sending' if pending else 'Generated'} OTP {otp} for employee {emp_id}, expires at {datetime.fromtimestamp(expires_at)}"
     )
 
     # Prepare email body
     body = AUTH_EMAIL_TEMPLATE.format(message=otp)
     # Send OTP to employee email
     email_sent = send_mail(email, otp, body, "StaffSync.AI - Authentication Code")
-
-    # Mask the email for privacy
-    email_parts = email.split("@")
-    if len(email_parts[0]) > 3:
-        masked_email = (
-            f"{email_parts[0][:3]}{'*' * (len(email_parts[0]) - 3)}@{email_parts[1]}"
-        )
-    else:
-        masked_email = f"{'*' * len(email_parts[0])}@{email_parts[1]}"
+    _count(sent=1)
 
     if email_sent:
         message = f"📧 Please check your email ({masked_email}) for your one-time password (OTP) and enter it here to continue."
@@ -176,14 +314,27 @@ def verify_otp(user_id: str, emp_id: str, provided_otp: str) -> Dict:
         f"🔍 Verifying OTP for user: {user_id}, employee: {emp_id}, provided: {provided_otp}"
     )
 
-    if emp_id not in pending_otps:
+    retry_after = try_acquire(
+        (verifies_by_employee, emp_id), (verifies_by_user, user_id)
+    )
+    if retry_after:
+        _count(throttled_verifies=1)
+        print(
+            f"🚦 OTP verification throttled for user {user_id}, employee {emp_id} ({retry_after:.0f}s left)"
+        )
+        return {
+            "authenticated": False,
+            "message": f"⏳ Too many attempts. Please wait {wait_text(retry_after)} and try again.",
+        }
+
+    otp_data = pending_otps.get(emp_id)
+    if otp_data is None:
         print(f"❌ No pending OTP found for employee {emp_id}")
         return {
             "authenticated": False,
             "message": "❌ No authentication process was initiated. Please try your request again.",
         }
 
-    otp_data = pending_otps[emp_id]
     print(f"🕐 OTP data: {otp_data}")
 
     # Check if the OTP belongs to this user
@@ -197,9 +348,9 @@ def verify_otp(user_id: str, emp_id: str, provided_otp: str) -> Dict:
         }
 
     # Check if OTP has expired
-    if datetime.now() > otp_data["expires_at"]:
-        print(f"⏰ OTP expired at {otp_data['expires_at']}")
-        del pending_otps[emp_id]
+    if time.time() > otp_data["expires_at"]:
+        print(f"⏰ OTP expired at {datetime.fromtimestamp(otp_data['expires_at'])}")
+        pending_otps.pop(emp_id, None)
         return {
             "authenticated": False,
             "message": "⏰ OTP has expired. Please try your request again.",
@@ -218,7 +369,7 @@ def verify_otp(user_id: str, emp_id: str, provided_otp: str) -> Dict:
         print(f"👥 Mapped user {user_id} to employee {emp_id}")
 
         # Clean up used OTP
-        del pending_otps[emp_id]
+        pending_otps.pop(emp_id, None)
 
         return {
             "authenticated": True,
@@ -241,16 +392,14 @@ def is_authenticated(user_id: str) -> bool:
 
 def clear_authentication(user_id: str):
     """Clear authentication for a user (useful for logout)."""
-    if user_id in authenticated_users:
-        del authenticated_users[user_id]
+    if authenticated_users.pop(user_id, None) is not None:
         print(f"🚪 Cleared authentication for user {user_id}")
 
     # Also clear employee mapping
     from src.core.auth_middleware import authenticated_employee_mapping
 
-    if user_id in authenticated_employee_mapping:
-        emp_id = authenticated_employee_mapping[user_id]
-        del authenticated_employee_mapping[user_id]
+    emp_id = authenticated_employee_mapping.pop(user_id, None)
+    if emp_id is not None:
         print(f"🗑️ Cleared employee mapping for user {user_id} (was employee {emp_id})")
 
 
@@ -271,4 +420,5 @@ def get_authentication_stats():
         "employee_mappings": len(authenticated_employee_mapping),
         "active_sessions": list(authenticated_users.keys()),
         "pending_employees": list(pending_otps.keys()),
+        "otp": otp_stats(),
     }
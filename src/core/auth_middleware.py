@@ -1,20 +1,44 @@
 import re
+from datetime import datetime
 from typing import Any, Callable, Dict, Optional
 
 from src.core.auth import (
+    OTP_TTL_SECONDS,
+    authenticated_users,
     is_authenticated,
     initiate_authentication,
+    otp_stats,
     verify_otp,
     pending_otps,
 )
+from src.core.session_backends import open_session_store
 
 # Store pending function calls while waiting for OTP
 # Format: {user_id: {"func_name": str, "func_args": dict, "emp_id": str}}
-pending_function_calls = {}
+pending_function_calls = open_session_store(
+    "pending_function_calls", ttl=OTP_TTL_SECONDS, sliding=False
+)
 
 # Store which employee ID each user is authenticated as
 # Format: {user_id: employee_id}
-authenticated_employee_mapping = {}
+authenticated_employee_mapping = open_session_store("authenticated_employee_mapping")
+
+
+def _forget_otp(emp_id, otp_data, reason):
+    # An OTP that expired (or was evicted) can't complete its pending call
+    clear_pending_call(otp_data["user_id"])
+
+
+def _forget_authentication(user_id, value, reason):
+    # Being authenticated and knowing as whom go together; when either
+    # expires or is evicted, drop the other as well
+    authenticated_users.pop(user_id, None)
+    authenticated_employee_mapping.pop(user_id, None)
+
+
+pending_otps.on_evict = _forget_otp
+authenticated_users.on_evict = _forget_authentication
+authenticated_employee_mapping.on_evict = _forget_authentication
 
 
 def extract_otp_from_message(message: str) -> Optional[str]:
@@ -29,12 +53,11 @@ def extract_otp_from_message(message: str) -> Optional[str]:
 def find_pending_emp_id_for_user(user_id: str) -> Optional[str]:
     """Find the employee ID associated with a pending OTP verification for this user."""
     print(f"🔍 Looking for pending OTP for user: {user_id}")
-    print(f"📋 Current pending_otps: {pending_otps}")
 
-    for emp_id, otp_data in pending_otps.items():
-        if otp_data.get("user_id") == user_id:
-            print(f"✅ Found pending OTP for employee {emp_id}")
-            return emp_id
+    emp_id = pending_otps.employee_for(user_id)
+    if emp_id is not None:
+        print(f"✅ Found pending OTP for employee {emp_id}")
+        return emp_id
 
     print(f"❌ No pending OTP found for user {user_id}")
     return None
@@ -74,8 +97,8 @@ def authenticate_function_call(
 
         # Check if they're authorized to access this specific employee's data
         # For now, users can only access their own data
-        if user_id in authenticated_employee_mapping:
-            authenticated_emp_id = authenticated_employee_mapping[user_id]
+        authenticated_emp_id = authenticated_employee_mapping.get(user_id)
+        if authenticated_emp_id is not None:
             if str(authenticated_emp_id) == str(requested_emp_id):
                 print(f"✅ User authorized to access employee {requested_emp_id} data")
                 return None
@@ -108,8 +131,7 @@ def authenticate_function_call(
 
 def clear_pending_call(user_id: str):
     """Clear any pending function call for a user."""
-    if user_id in pending_function_calls:
-        del pending_function_calls[user_id]
+    if pending_function_calls.pop(user_id, None) is not None:
         print(f"🗑️ Cleared pending function call for user {user_id}")
 
 
@@ -139,7 +161,7 @@ def debug_auth_state():
         print("📋 Pending OTP details:")
         for emp_id, data in pending_otps.items():
             print(
-                f"  - Employee {emp_id}: User {data.get('user_id', 'N/A')[:8]}..., expires {data.get('expires_at')}"
+                f"  - Employee {emp_id}: User {data.get('user_id', 'N/A')[:8]}..., expires {datetime.fromtimestamp(data.get('expires_at', 0))}"
             )
 
     if pending_function_calls:
@@ -207,21 +229,19 @@ def process_auth_message(user_id: str, message: str) -> Optional[Dict]:
 
 # Utility functions for session management
 def cleanup_expired_sessions():
-    """Clean up expired OTP sessions and stale function calls."""
-    from datetime import datetime
-
-    # Clean up expired OTPs
-    expired_otps = []
-    for emp_id, otp_data in pending_otps.items():
-        if datetime.now() > otp_data["expires_at"]:
-            expired_otps.append(emp_id)
+    """
+    Clean up expired OTP sessions and stale function calls.
 
-    for emp_id in expired_otps:
-        user_id = pending_otps[emp_id]["user_id"]
-        del pending_otps[emp_id]
-        # Also clear associated pending function call
-        clear_pending_call(user_id)
-        print(f"🧹 Cleaned up expired OTP for employee {emp_id}, user {user_id}")
+    The stores expire entries on their own (and the session sweeper does it
+    in the background); this just forces a pass now.
+    """
+    for store in (
+        pending_otps,
+        pending_function_calls,
+        authenticated_users,
+        authenticated_employee_mapping,
+    ):
+        store.expire()
 
 
 def get_auth_stats() -> Dict:
@@ -233,4 +253,5 @@ def get_auth_stats() -> Dict:
         "otp_employees": list(pending_otps.keys()),
         "pending_users": list(pending_function_calls.keys()),
         "employee_mappings": dict(authenticated_employee_mapping),
+        "otp": otp_stats(),
     }
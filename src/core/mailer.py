@@ -0,0 +1,457 @@
+import heapq
+import itertools
+import os
+import queue
+import random
+import smtplib
+import threading
+import time
+import uuid
+from collections import Counter
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Optional, Tuple
+
+from src.core.session_backends import leadership, open_session_store
+from src.journal import Journal, open_journal
+
+# How many delivery statuses to remember (oldest are forgotten first), and
+# for how long
+MAX_TRACKED_MESSAGES = 10000
+MAIL_STATUS_TTL_SECONDS = 7 * 24 * 3600
+
+
+def smtp_settings(sender_email: str) -> Tuple[str, int]:
+    """SMTP host and port for the sender's provider (Gmail by default)."""
+    sender_email = sender_email.lower()
+    if "outlook.com" in sender_email or "hotmail.com" in sender_email:
+        return "smtp-mail.outlook.com", 587
+    if "yahoo.com" in sender_email:
+        return "smtp.mail.yahoo.com", 587
+    return "smtp.gmail.com", 587
+
+
+def _print_auth_help():
+    print("\n🔧 TROUBLESHOOTING GMAIL AUTHENTICATION:")
+    print("1. Make sure you're using an App Password, not your regular Gmail password")
+    print("2. Enable 2-Factor Authentication on your Gmail account")
+    print("3. Generate an App Password: https://myaccount.google.com/apppasswords")
+    print(
+        "4. Use the 16-character App Password in your EMAIL_PASSWORD environment variable"
+    )
+    print(
+        "5. Make sure 'Less secure app access' is NOT enabled (use App Passwords instead)"
+    )
+
+
+class SmtpConnection:
+    """
+    One logged-in SMTP session, opened on first use and kept for reuse.
+
+    A session that has been idle for a while is checked with NOOP before
+    use and transparently reopened if the server dropped it.
+    """
+
+    def __init__(self, sender_email: str, password: str, keepalive: float = 30.0):
+        self.sender_email = sender_email
+        self.password = password
+        self.keepalive = keepalive
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        host, port = smtp_settings(self.sender_email)
+        print(f"📧 Connecting to {host}:{port}...")
+        server = smtplib.SMTP(host, port, timeout=30)
+        try:
+            server.starttls()
+            server.login(self.sender_email, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self.connects += 1
+
+    def _usable(self) -> bool:
+        if self._server is None:
+            return False
+        if time.monotonic() - self._last_used < self.keepalive:
+            return True
+        try:
+            return self._server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def send(self, message):
+        if not self._usable():
+            self.close()
+            self._connect()
+        self._server.send_message(message)
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+class Mailer:
+    """
+    Background email sender with a durable outbox.
+
+    `enqueue()` records the message and returns at once; a small pool of
+    worker threads delivers queued mail, each keeping its own authenticated
+    SMTP connection open between messages instead of connecting, starting
+    TLS and logging in for every email. OTP mail goes ahead of any queued
+    notifications. A failed send drops the connection and the message is
+    set aside until its backoff (with jitter) is up, then requeued for a
+    fresh connection, so the worker moves on to other mail meanwhile. Every
+    message has a delivery status (`status()`).
+
+    Durable messages are written to a journal before `enqueue()` returns and
+    acknowledged once delivered (or given up on), so mail queued before a
+    crash or restart is still sent: delivery is at least once. OTP mail is
+    not journaled, since a code that outlives the process is useless and
+    shouldn't sit on disk.
+
+    With a shared outbox and a `leader`, any process can enqueue, but only
+    the leader sends durable mail: it polls the outbox for messages it
+    hasn't queued yet. OTP mail is still sent by the process that queued it.
+    """
+
+    def __init__(
+        self,
+        journal: Journal,
+        workers: int = 2,
+        max_attempts: int = 5,
+        base_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        idle_timeout: float = 60.0,
+        leader=None,
+        poll_interval: float = 1.0,
+    ):
+        """
+        Args:
+            journal: Outbox for durable messages
+            workers: Number of sender threads (and SMTP connections)
+            max_attempts: Attempts per message before it is marked failed
+            idle_timeout: Close a worker's connection after this long idle
+            leader: Leadership deciding which process sends durable mail
+                from a shared outbox
+            poll_interval: How often the leader checks the outbox
+        """
+        self.journal = journal
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.leader = leader
+        self.poll_interval = poll_interval
+        # Format: (priority, order, seq, entry, attempt), OTP mail first
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        # Format: [(not before, queue item)], a heap of messages backing off
+        self._delayed = []
+        self._wakeup = threading.Condition()
+        # Format: {seq} of the outbox entries queued in this process
+        self._queued = set()
+        self._outbox_lock = threading.Lock()
+        self._poke = threading.Event()
+        self._term = 0
+        # Shared between processes with a SESSION_BACKEND
+        self._statuses = open_session_store(
+            "mail_status",
+            ttl=MAIL_STATUS_TTL_SECONDS,
+            max_entries=MAX_TRACKED_MESSAGES,
+            sliding=False,
+        )
+        self._lock = threading.Lock()
+        self._stats = Counter()
+        self._started = False
+        self._acks_since_compact = 0
+
+    def start(self):
+        """Start the workers (idempotent) and requeue unsent durable mail."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if self.leader is None:
+            backlog = self._take_backlog()
+            if backlog:
+                print(f"🔁 Requeueing {backlog} unsent email(s)")
+        else:
+            threading.Thread(
+                target=self._poll_outbox, name="mailer-outbox", daemon=True
+            ).start()
+        for n in range(self.workers):
+            threading.Thread(target=self._run, name=f"mailer-{n}", daemon=True).start()
+        threading.Thread(
+            target=self._requeue_due, name="mailer-retries", daemon=True
+        ).start()
+
+    def _take_backlog(self) -> int:
+        # Queue the outbox entries not queued in this process yet
+        with self._outbox_lock:
+            backlog = [
+                (seq, entry)
+                for seq, entry in self.journal.pending()
+                if seq not in self._queued
+            ]
+            self._queued.update(seq for seq, _ in backlog)
+        for seq, entry in backlog:
+            self._set_status(entry["id"], "queued", to=entry["to"])
+            self._put(seq, entry, 1)
+        return len(backlog)
+
+    def _poll_outbox(self):
+        while True:
+            self._poke.wait(self.poll_interval)
+            self._poke.clear()
+            if not self.leader.is_leader():
+                continue
+            try:
+                backlog = self._take_backlog()
+                if self.leader.term != self._term:
+                    self._term = self.leader.term
+                    if backlog:
+                        print(f"🔁 Requeueing {backlog} unsent email(s)")
+            except Exception as e:
+                print(f"⚠️ Outbox poll failed, will retry: {e}")
+
+    def enqueue(
+        self,
+        to: str,
+        subject: str,
+        body: str,
+        preview: str = "",
+        kind: str = "notification",
+        durable: bool = True,
+    ) -> str:
+        """
+        Queue an HTML email and return its message ID without waiting for SMTP.
+
+        Args:
+            to: Recipient address
+            subject: Subject line
+            body: HTML body
+            preview: Short text printed instead of sending in dev mode (no
+                EMAIL_SENDER / EMAIL_PASSWORD)
+            kind: Label for logs and stats, e.g. "otp" or "notification"
+            durable: Journal the message so it survives a restart
+        """
+        self.start()
+        entry = {
+            "id": uuid.uuid4().hex[:12],
+            "to": to,
+            "subject": subject,
+            "body": body,
+            "preview": preview,
+            "kind": kind,
+        }
+        self._set_status(entry["id"], "queued", to=to)
+        self._count(queued=1)
+        if not durable:
+            self._put(None, entry, 1)
+        elif self.leader is None:
+            with self._outbox_lock:
+                seq = self.journal.append(entry)
+                self._queued.add(seq)
+            self._put(seq, entry, 1)
+        else:
+            # Sent by whichever process leads
+            self.journal.append(entry)
+            self._poke.set()
+        return entry["id"]
+
+    def status(self, message_id: str) -> Optional[dict]:
+        """Delivery status: queued, sending, retrying, sent, logged (dev mode) or failed."""
+        status = self._statuses.get(message_id)
+        return dict(status) if status else None
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued message has been sent or given up on (e.g.
+        before a CLI exits, since the workers are daemon threads). With a
+        shared outbox, that includes mail the leader has still to send.
+
+        Returns:
+            bool: False if mail was still queued after `timeout` seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._wakeup:
+                idle = not self._queue.unfinished_tasks and not self._delayed
+            if idle and not len(self.journal):
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {**self._stats, "queue_length": self._queue.qsize()}
+        with self._wakeup:
+            stats["backing_off"] = len(self._delayed)
+        return stats
+
+    def _count(self, **increments):
+        with self._lock:
+            self._stats.update(increments)
+
+    def _set_status(self, message_id: str, status: str, **details):
+        with self._lock:
+            record = self._statuses.get(message_id) or {}
+            record.update(
+                details,
+                status=status,
+                updated_at=time.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            self._statuses[message_id] = record
+
+    def _put(self, seq: Optional[int], entry: dict, attempt: int):
+        priority = 0 if entry["kind"] == "otp" else 1
+        self._queue.put((priority, next(self._order), seq, entry, attempt))
+
+    def _retry_later(self, seq: Optional[int], entry: dict, attempt: int, delay):
+        with self._wakeup:
+            heapq.heappush(
+                self._delayed,
+                (time.monotonic() + delay, (next(self._order), seq, entry, attempt)),
+            )
+            self._wakeup.notify()
+
+    def _requeue_due(self):
+        # Moves messages whose backoff is up back onto the queue
+        while True:
+            with self._wakeup:
+                if not self._delayed:
+                    self._wakeup.wait()
+                    continue
+                not_before, item = self._delayed[0]
+                wait = not_before - time.monotonic()
+                if wait > 0:
+                    self._wakeup.wait(wait)
+                    continue
+                heapq.heappop(self._delayed)
+                # Still holding the lock, so flush() never sees it in neither
+                _, seq, entry, attempt = item
+                self._put(seq, entry, attempt)
+
+    def _finish(self, seq: Optional[int]):
+        if seq is None:
+            return
+        with self._outbox_lock:
+            self.journal.ack([seq])
+            self._queued.discard(seq)
+        with self._lock:
+            self._acks_since_compact += 1
+            compact = self._acks_since_compact >= 500
+            if compact:
+                self._acks_since_compact = 0
+        if compact:
+            self.journal.compact()
+
+    def _run(self):
+        sender_email = os.environ.get("EMAIL_SENDER")
+        password = os.environ.get("EMAIL_PASSWORD")
+        connection = (
+            SmtpConnection(sender_email, password)
+            if sender_email and password
+            else None
+        )
+        while True:
+            try:
+                _, _, seq, entry, attempt = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                if connection:
+                    connection.close()
+                continue
+            try:
+                if connection is None:
+                    print(
+                        f"⚠️  EMAIL_SENDER or EMAIL_PASSWORD not set in environment variables"
+                    )
+                    print(
+                        f"[DEV MODE] {entry['kind']} for {entry['to']}: {entry['preview']}"
+                    )
+                    self._set_status(entry["id"], "logged")
+                    self._finish(seq)
+                    continue
+                self._deliver(connection, sender_email, seq, entry, attempt)
+            finally:
+                # A retry is back on the delay heap by now (see flush())
+                self._queue.task_done()
+
+    def _deliver(
+        self, connection: SmtpConnection, sender_email: str, seq, entry, attempt
+    ):
+        message = MIMEMultipart()
+        message["From"] = sender_email
+        message["To"] = entry["to"]
+        message["Subject"] = entry["subject"]
+        message.attach(MIMEText(entry["body"], "html"))
+
+        connects = connection.connects
+        try:
+            self._attempt(connection, message, seq, entry, attempt)
+        finally:
+            self._count(connects=connection.connects - connects)
+
+    def _attempt(self, connection: SmtpConnection, message, seq, entry, attempt):
+        self._set_status(entry["id"], "sending", attempts=attempt)
+        try:
+            connection.send(message)
+        except (
+            smtplib.SMTPAuthenticationError,
+            smtplib.SMTPRecipientsRefused,
+        ) as e:
+            # Retrying won't help with bad credentials or a bad address
+            connection.close()
+            print(f"❌ Couldn't send {entry['kind']} email to {entry['to']}: {e}")
+            if isinstance(e, smtplib.SMTPAuthenticationError):
+                _print_auth_help()
+            print(f"[DEV MODE] {entry['kind']} for {entry['to']}: {entry['preview']}")
+            self._fail(seq, entry, e)
+        except Exception as e:
+            connection.close()
+            if attempt >= self.max_attempts:
+                print(
+                    f"❌ Giving up on {entry['kind']} email to {entry['to']} [{entry['id']}]: {e}"
+                )
+                self._fail(seq, entry, e)
+                return
+            self._count(retries=1)
+            delay = random.uniform(
+                0, min(self.max_backoff, self.base_backoff * 2**attempt)
+            )
+            print(
+                f"⏳ Email to {entry['to']} failed ({e}); retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s"
+            )
+            self._set_status(entry["id"], "retrying", error=str(e))
+            self._retry_later(seq, entry, attempt + 1, delay)
+        else:
+            self._count(sent=1)
+            self._set_status(entry["id"], "sent", error=None)
+            print(
+                f"✅ {entry['kind'].capitalize()} email sent to {entry['to']} [{entry['id']}]"
+            )
+            self._finish(seq)
+
+    def _fail(self, seq, entry, error):
+        self._count(failed=1)
+        self._set_status(entry["id"], "failed", error=str(error))
+        self._finish(seq)
+
+
+outbox = Mailer(
+    open_journal("mail_outbox"),
+    workers=int(os.getenv("SMTP_POOL_SIZE", 2)),
+    max_attempts=int(os.getenv("SMTP_MAX_ATTEMPTS", 5)),
+    leader=leadership,
+)
@@ -0,0 +1,84 @@
+import math
+import threading
+import time
+
+from src.core.session_backends import open_session_store
+
+
+class SlidingWindowLimiter:
+    """
+    Allows at most `limit` events per key in any `window` seconds.
+
+    Each key's recent event times (a sliding-window log) are kept in a
+    session store, so with a persistent SESSION_BACKEND the counts survive a
+    restart, and a key's log expires `window` seconds after its last event.
+
+    `try_acquire()` checks and records under one lock, so concurrent
+    requests can't all pass the check before any of them is counted.
+    """
+
+    def __init__(self, name: str, limit: int, window: float):
+        """
+        Args:
+            name: Store name, e.g. "otp_sends_by_employee"
+            limit: Events allowed per window
+            window: Window length in seconds
+        """
+        self.limit = limit
+        self.window = window
+        # Format: {key: [unix timestamp, ...]} (the last `limit` events)
+        self._events = open_session_store(name, ttl=window, sliding=False)
+
+    def _recent(self, key, now: float) -> list:
+        return [t for t in self._events.get(str(key), []) if t > now - self.window]
+
+    def retry_after(self, key) -> float:
+        """Seconds until `key` may act again (0 if it may act now)."""
+        now = time.time()
+        recent = self._recent(key, now)
+        if len(recent) < self.limit:
+            return 0.0
+        return max(0.0, recent[-self.limit] + self.window - now)
+
+    def hit(self, key):
+        """Record an event for `key`."""
+        now = time.time()
+        self._events[str(key)] = (self._recent(key, now) + [now])[-self.limit :]
+
+    def try_acquire(self, key) -> float:
+        """
+        Record an event for `key` if it may act now.
+
+        Returns:
+            float: 0 if the event was recorded, else seconds until it may act
+        """
+        return try_acquire((self, key))
+
+
+# Held while checking and recording, across all limiters
+_lock = threading.Lock()
+
+
+def try_acquire(*limits) -> float:
+    """
+    Record an event against every (limiter, key) pair, or against none.
+
+    Args:
+        *limits: (SlidingWindowLimiter, key) pairs that must all allow it
+
+    Returns:
+        float: 0 if recorded, else seconds until every limit allows it
+    """
+    with _lock:
+        retry_after = max(limiter.retry_after(key) for limiter, key in limits)
+        if retry_after:
+            return retry_after
+        for limiter, key in limits:
+            limiter.hit(key)
+        return 0.0
+
+
+def wait_text(seconds: float) -> str:
+    """'about 3 minutes' style wording for a retry-after delay."""
+    minutes = max(1, math.ceil(seconds / 60))
+    return f"about {minutes} minute{'s' if minutes != 1 else ''}"
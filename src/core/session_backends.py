@@ -0,0 +1,1000 @@
+import json
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+from typing import Callable, List, Optional, Tuple
+
+from src.core.session_store import (
+    SESSION_MAX_ENTRIES,
+    SESSION_TTL_SECONDS,
+    SessionStore,
+    _MISSING,
+    _stores,
+)
+
+
+class SessionBackend(ABC):
+    """
+    Session state shared between processes (and machines), as JSON text.
+
+    Entries live in namespaces (one per store, e.g. "pending_otps") and
+    carry an absolute expiry; expired entries are never returned.
+
+    The same backend also holds the other state every process has to agree
+    on: counters (e.g. Request IDs), journals (e.g. the leave ledger and the
+    mail outbox) and leases (locks and the leader, see SharedLock and
+    Leadership).
+    """
+
+    @abstractmethod
+    def get(self, namespace: str, key: str, ttl: Optional[float]) -> Optional[str]:
+        """The live value, or None. With `ttl`, also push its expiry to now + ttl."""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: str, ttl: float):
+        """Store a value that expires in `ttl` seconds."""
+
+    @abstractmethod
+    def pop(self, namespace: str, key: str) -> Optional[str]:
+        """Delete a key and return its live value (None if there was none)."""
+
+    @abstractmethod
+    def items(self, namespace: str) -> List[Tuple[str, str]]:
+        """All live (key, value) pairs in a namespace."""
+
+    def count(self, namespace: str) -> int:
+        return len(self.items(namespace))
+
+    def size(self, namespace: str) -> int:
+        """Bytes of stored values in a namespace."""
+        return sum(len(value) for _, value in self.items(namespace))
+
+    def take_expired(self, namespace: str, key: str) -> Optional[str]:
+        """
+        Delete a key if it has expired and return its value (None if it is
+        live or gone), so its eviction callback can run. Backends that
+        expire keys on their own return None unless the namespace is watched.
+        """
+        return None
+
+    def watch_expiry(self, namespace: str):
+        """
+        Keep what backends that expire keys on their own need to report a
+        namespace's expired entries from `take_expired()` and `purge()`.
+        """
+
+    def purge(
+        self,
+        namespace: str,
+        max_entries: Optional[int],
+        max_bytes: Optional[int],
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Drop expired entries, then the least recently used ones over budget.
+        Backends that expire and evict on their own make this a no-op.
+
+        Returns:
+            list: (key, value, "expired" | "evicted") for each dropped entry
+        """
+        return []
+
+    @abstractmethod
+    def incr(self, namespace: str, key: str, amount: int = 1, floor: int = 0) -> int:
+        """
+        Atomically add `amount` to a counter (first raised to `floor` if it
+        is below it; a new counter starts at 0) and return the new value.
+        """
+
+    @abstractmethod
+    def journal_append(self, namespace: str, value: str, seq: int = None) -> int:
+        """
+        Durably add an entry to a journal and return its sequence number
+        (one more than any before it). With `seq`, store it under that
+        number instead (replacing any entry there), e.g. to move a journal
+        over from a file.
+        """
+
+    @abstractmethod
+    def journal_entries(self, namespace: str) -> List[Tuple[int, str]]:
+        """A journal's (seq, value) entries, oldest first."""
+
+    @abstractmethod
+    def journal_remove(self, namespace: str, seqs: List[int]):
+        """Delete journal entries."""
+
+    def journal_count(self, namespace: str) -> int:
+        return len(self.journal_entries(namespace))
+
+    @abstractmethod
+    def acquire_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """
+        Take the named lease for `ttl` seconds if it is free, has expired
+        or is already `holder`'s (which extends it).
+        """
+
+    @abstractmethod
+    def renew_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Extend a lease `holder` still has; False if it doesn't."""
+
+    @abstractmethod
+    def release_lease(self, name: str, holder: str):
+        """Give up a lease, if `holder` has it."""
+
+
+class SqliteSessionBackend(SessionBackend):
+    """
+    Sessions in a local SQLite file, for one machine (readable by any number
+    of processes) and for tests.
+
+    WAL mode lets the processes read while one writes. Every read also
+    records the time, so `purge()` can evict the least recently used.
+    Commits are synced to disk (like the file journals they replace), so
+    journal entries survive a power cut.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=FULL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, used_at REAL NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_expiry "
+                "ON sessions (namespace, expires_at)"
+            )
+            # Covers the budget check (count, total size) and the LRU order
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sessions_lru "
+                "ON sessions (namespace, used_at, size)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value INTEGER NOT NULL, "
+                "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal ("
+                "namespace TEXT NOT NULL, seq INTEGER NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (namespace, seq)) WITHOUT ROWID"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, "
+                "expires_at REAL NOT NULL) WITHOUT ROWID"
+            )
+        print(f"Connected to session database {path}")
+
+    def _transaction(self, func, *args):
+        # Runs func(*args) in a write transaction, so other processes wait
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def get(self, namespace, key, ttl):
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM sessions "
+                "WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            if ttl is None:
+                self.conn.execute(
+                    "UPDATE sessions SET used_at = ? WHERE namespace = ? AND key = ?",
+                    (now, namespace, key),
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE sessions SET used_at = ?, expires_at = ? "
+                    "WHERE namespace = ? AND key = ?",
+                    (now, now + ttl, namespace, key),
+                )
+        return row[0]
+
+    def set(self, namespace, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions "
+                "(namespace, key, value, expires_at, used_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, now + ttl, now, len(value)),
+            )
+
+    def pop(self, namespace, key):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT value, expires_at FROM sessions "
+                    "WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                ).fetchone()
+                self.conn.execute(
+                    "DELETE FROM sessions WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        if row is None or row[1] <= time.time():
+            return None
+        return row[0]
+
+    def items(self, namespace):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT key, value FROM sessions WHERE namespace = ? AND expires_at > ?",
+                (namespace, time.time()),
+            ).fetchall()
+
+    def count(self, namespace):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE namespace = ? AND expires_at > ?",
+                (namespace, time.time()),
+            ).fetchone()[0]
+
+    def size(self, namespace):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM sessions "
+                "WHERE namespace = ? AND expires_at > ?",
+                (namespace, time.time()),
+            ).fetchone()[0]
+
+    def _delete(self, namespace, keys):
+        # Call with self._lock held
+        self.conn.executemany(
+            "DELETE FROM sessions WHERE namespace = ? AND key = ?",
+            [(namespace, key) for key in keys],
+        )
+
+    def take_expired(self, namespace, key):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM sessions "
+                "WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            # Only the process whose delete removes the row reports it
+            deleted = self.conn.execute(
+                "DELETE FROM sessions "
+                "WHERE namespace = ? AND key = ? AND expires_at <= ?",
+                (namespace, key, time.time()),
+            ).rowcount
+        return row[0] if deleted else None
+
+    def purge(self, namespace, max_entries, max_bytes):
+        return self._transaction(self._purge, namespace, max_entries, max_bytes)
+
+    def _purge(self, namespace, max_entries, max_bytes):
+        # Call with self._lock held, in a transaction
+        dropped = [
+            (key, value, "expired")
+            for key, value in self.conn.execute(
+                "SELECT key, value FROM sessions "
+                "WHERE namespace = ? AND expires_at < ?",
+                (namespace, time.time()),
+            ).fetchall()
+        ]
+        self._delete(namespace, [key for key, _, _ in dropped])
+        if max_entries is None and max_bytes is None:
+            return dropped
+        count, total = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM sessions "
+            "WHERE namespace = ?",
+            (namespace,),
+        ).fetchone()
+
+        def over_budget():
+            return (max_entries is not None and count > max_entries) or (
+                max_bytes is not None and total > max_bytes
+            )
+
+        if not over_budget():
+            return dropped
+        # Least recently used first, until back within budget; the newest
+        # entry is kept even if it alone is over the byte budget
+        stale = []
+        cursor = self.conn.execute(
+            "SELECT key, size FROM sessions WHERE namespace = ? ORDER BY used_at",
+            (namespace,),
+        )
+        for key, size in cursor:
+            if count <= 1 or not over_budget():
+                break
+            stale.append(key)
+            count -= 1
+            total -= size
+        cursor.close()
+        for key in stale:
+            value = self.conn.execute(
+                "SELECT value FROM sessions WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()[0]
+            dropped.append((key, value, "evicted"))
+        self._delete(namespace, stale)
+        return dropped
+
+    def _incr(self, namespace, key, amount, floor):
+        # Call in a transaction
+        row = self.conn.execute(
+            "SELECT value FROM counters WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        value = max(row[0] if row else 0, floor) + amount
+        self.conn.execute(
+            "INSERT OR REPLACE INTO counters (namespace, key, value) VALUES (?, ?, ?)",
+            (namespace, key, value),
+        )
+        return value
+
+    def incr(self, namespace, key, amount=1, floor=0):
+        return self._transaction(self._incr, namespace, key, amount, floor)
+
+    def _journal_append(self, namespace, value, seq):
+        # Call in a transaction; the journal's sequence is a counter
+        if seq is None:
+            seq = self._incr("journal", namespace, 1, 0)
+        else:
+            self._incr("journal", namespace, 0, seq)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO journal (namespace, seq, value) VALUES (?, ?, ?)",
+            (namespace, seq, value),
+        )
+        return seq
+
+    def journal_append(self, namespace, value, seq=None):
+        return self._transaction(self._journal_append, namespace, value, seq)
+
+    def journal_entries(self, namespace):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT seq, value FROM journal WHERE namespace = ? ORDER BY seq",
+                (namespace,),
+            ).fetchall()
+
+    def journal_remove(self, namespace, seqs):
+        with self._lock:
+            self.conn.executemany(
+                "DELETE FROM journal WHERE namespace = ? AND seq = ?",
+                [(namespace, seq) for seq in seqs],
+            )
+
+    def journal_count(self, namespace):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM journal WHERE namespace = ?", (namespace,)
+            ).fetchone()[0]
+
+    def _acquire_lease(self, name, holder, ttl, renew_only):
+        # Call in a transaction
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT holder, expires_at FROM leases WHERE name = ?", (name,)
+        ).fetchone()
+        mine = row is not None and row[0] == holder and row[1] > now
+        if not mine and (renew_only or (row is not None and row[1] > now)):
+            return False
+        self.conn.execute(
+            "INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+            (name, holder, now + ttl),
+        )
+        return True
+
+    def acquire_lease(self, name, holder, ttl):
+        return self._transaction(self._acquire_lease, name, holder, ttl, False)
+
+    def renew_lease(self, name, holder, ttl):
+        return self._transaction(self._acquire_lease, name, holder, ttl, True)
+
+    def release_lease(self, name, holder):
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder)
+            )
+
+
+# Claims one expired entry of a watched namespace: returns its value and
+# forgets it, or nil if it is live, not due yet or claimed by another process
+_TAKE_EXPIRED = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) > tonumber(ARGV[2]) then return false end
+if redis.call('EXISTS', KEYS[3]) == 1 then return false end
+redis.call('ZREM', KEYS[1], ARGV[1])
+local value = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+return value
+"""
+
+
+# Raises a counter to ARGV[2] if it is below it, then adds ARGV[1]
+_INCR_WITH_FLOOR = """
+local value = math.max(tonumber(redis.call('GET', KEYS[1]) or '0'), tonumber(ARGV[2]))
+value = value + tonumber(ARGV[1])
+redis.call('SET', KEYS[1], value)
+return value
+"""
+
+# Adds a journal entry: under the next number, or under ARGV[2] if given
+_JOURNAL_APPEND = """
+local seq
+if ARGV[2] == '' then
+  seq = redis.call('INCR', KEYS[2])
+else
+  seq = tonumber(ARGV[2])
+  if tonumber(redis.call('GET', KEYS[2]) or '0') < seq then
+    redis.call('SET', KEYS[2], seq)
+  end
+end
+redis.call('HSET', KEYS[1], seq, ARGV[1])
+return seq
+"""
+
+# Takes (ARGV[3] = '0') or only renews (ARGV[3] = '1') a lease for ARGV[1]
+_ACQUIRE_LEASE = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] or (not holder and ARGV[3] == '0') then
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+  return 1
+end
+return 0
+"""
+
+_RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSessionBackend(SessionBackend):
+    """
+    Sessions in Redis (or any server speaking its protocol), shared by every
+    process on every node.
+
+    Redis expires keys itself; bound memory with the server's `maxmemory`
+    and an LRU `maxmemory-policy` (e.g. `volatile-lru`, which never evicts
+    the journals and counters, as they don't expire). Run it with AOF
+    persistence (`appendonly yes`, `appendfsync always` to match the file
+    journals) so the journals survive a Redis restart. Redis doesn't say
+    what it expired, so for watched namespaces (stores with an eviction
+    callback) each value is also kept in a hash, with its expiry in a
+    sorted set; `purge()` and `take_expired()` claim entries that are past
+    their expiry and gone from Redis, so exactly one process reports each.
+    An entry Redis evicts early under `maxmemory` is reported once its
+    expiry passes.
+    """
+
+    def __init__(self, url: str, prefix: str = "staffsync:session:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError(
+                "SESSION_BACKEND=redis needs the redis package: pip install redis"
+            )
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._watched = set()
+        self._take_expired = self.client.register_script(_TAKE_EXPIRED)
+        self._incr = self.client.register_script(_INCR_WITH_FLOOR)
+        self._journal_append = self.client.register_script(_JOURNAL_APPEND)
+        self._acquire_lease = self.client.register_script(_ACQUIRE_LEASE)
+        self._release_lease = self.client.register_script(_RELEASE_LEASE)
+
+    def _key(self, namespace, key) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def _expiries(self, namespace) -> str:
+        return f"{self.prefix}expiry:{namespace}"
+
+    def _values(self, namespace) -> str:
+        return f"{self.prefix}expiring:{namespace}"
+
+    def watch_expiry(self, namespace):
+        self._watched.add(namespace)
+
+    def get(self, namespace, key, ttl):
+        if ttl is None:
+            return self.client.get(self._key(namespace, key))
+        if namespace not in self._watched:
+            return self.client.getex(
+                self._key(namespace, key), px=math.ceil(ttl * 1000)
+            )
+        pipe = self.client.pipeline()
+        pipe.getex(self._key(namespace, key), px=math.ceil(ttl * 1000))
+        pipe.zadd(self._expiries(namespace), {key: time.time() + ttl}, xx=True)
+        return pipe.execute()[0]
+
+    def set(self, namespace, key, value, ttl):
+        if namespace not in self._watched:
+            self.client.set(self._key(namespace, key), value, px=math.ceil(ttl * 1000))
+            return
+        pipe = self.client.pipeline()
+        pipe.set(self._key(namespace, key), value, px=math.ceil(ttl * 1000))
+        pipe.hset(self._values(namespace), key, value)
+        pipe.zadd(self._expiries(namespace), {key: time.time() + ttl})
+        pipe.execute()
+
+    def pop(self, namespace, key):
+        if namespace not in self._watched:
+            return self.client.getdel(self._key(namespace, key))
+        pipe = self.client.pipeline()
+        pipe.getdel(self._key(namespace, key))
+        pipe.hdel(self._values(namespace), key)
+        pipe.zrem(self._expiries(namespace), key)
+        return pipe.execute()[0]
+
+    def take_expired(self, namespace, key):
+        if namespace not in self._watched:
+            return None
+        return self._take_expired(
+            keys=[
+                self._expiries(namespace),
+                self._values(namespace),
+                self._key(namespace, key),
+            ],
+            args=[key, time.time()],
+        )
+
+    def incr(self, namespace, key, amount=1, floor=0):
+        return int(
+            self._incr(
+                keys=[f"{self.prefix}counter:{namespace}:{key}"], args=[amount, floor]
+            )
+        )
+
+    def _journal(self, namespace) -> str:
+        return f"{self.prefix}journal:{namespace}"
+
+    def journal_append(self, namespace, value, seq=None):
+        return int(
+            self._journal_append(
+                keys=[self._journal(namespace), f"{self._journal(namespace)}:seq"],
+                args=[value, "" if seq is None else seq],
+            )
+        )
+
+    def journal_entries(self, namespace):
+        entries = self.client.hgetall(self._journal(namespace))
+        return sorted((int(seq), value) for seq, value in entries.items())
+
+    def journal_remove(self, namespace, seqs):
+        if seqs:
+            self.client.hdel(self._journal(namespace), *seqs)
+
+    def journal_count(self, namespace):
+        return self.client.hlen(self._journal(namespace))
+
+    def acquire_lease(self, name, holder, ttl):
+        return bool(
+            self._acquire_lease(
+                keys=[f"{self.prefix}lease:{name}"],
+                args=[holder, math.ceil(ttl * 1000), "0"],
+            )
+        )
+
+    def renew_lease(self, name, holder, ttl):
+        return bool(
+            self._acquire_lease(
+                keys=[f"{self.prefix}lease:{name}"],
+                args=[holder, math.ceil(ttl * 1000), "1"],
+            )
+        )
+
+    def release_lease(self, name, holder):
+        self._release_lease(keys=[f"{self.prefix}lease:{name}"], args=[holder])
+
+    def purge(self, namespace, max_entries, max_bytes):
+        if namespace not in self._watched:
+            return []
+        due = self.client.zrangebyscore(
+            self._expiries(namespace), "-inf", time.time(), start=0, num=1000
+        )
+        dropped = []
+        for key in due:
+            raw = self.take_expired(namespace, key)
+            if raw is not None:
+                dropped.append((key, raw, "expired"))
+        return dropped
+
+    def items(self, namespace):
+        start = len(self._key(namespace, ""))
+        keys = list(self.client.scan_iter(match=self._key(namespace, "*"), count=500))
+        if not keys:
+            return []
+        values = self.client.mget(keys)
+        return [(k[start:], v) for k, v in zip(keys, values) if v is not None]
+
+
+class SharedSessionStore(MutableMapping):
+    """
+    The SessionStore interface over a SessionBackend, so sessions outlive
+    the process and other processes see the same ones.
+
+    Values are stored as JSON, so they must be JSON-serialisable, keys come
+    back as strings, and a value changed in place must be assigned back to
+    be saved. Expiry and eviction happen in the backend; `on_evict` is
+    called for the entries this process's sweeps (`expire()`) and reads
+    find expired or evict. Setting it has the backend watch the namespace
+    (see RedisSessionBackend).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backend: SessionBackend,
+        ttl: float = SESSION_TTL_SECONDS,
+        max_entries: Optional[int] = SESSION_MAX_ENTRIES,
+        max_bytes: Optional[int] = None,
+        sliding: bool = True,
+        on_evict=None,
+    ):
+        self.name = name
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sliding = sliding
+        self._on_evict = None
+        self.on_evict = on_evict
+        self._expired = 0
+        self._evicted = 0
+        _stores[id(self)] = self
+
+    @property
+    def on_evict(self):
+        return self._on_evict
+
+    @on_evict.setter
+    def on_evict(self, callback):
+        self._on_evict = callback
+        if callback:
+            self.backend.watch_expiry(self.name)
+
+    def __getitem__(self, key):
+        raw = self.backend.get(self.name, str(key), self.ttl if self.sliding else None)
+        if raw is None:
+            if self.on_evict:
+                expired = self.backend.take_expired(self.name, str(key))
+                if expired is not None:
+                    self._expired += 1
+                    self._notify(str(key), expired, "expired")
+            raise KeyError(key)
+        return json.loads(raw)
+
+    def __setitem__(self, key, value):
+        self.backend.set(self.name, str(key), json.dumps(value), self.ttl)
+
+    def __delitem__(self, key):
+        if self.backend.pop(self.name, str(key)) is None:
+            raise KeyError(key)
+
+    def pop(self, key, default=_MISSING):
+        raw = self.backend.pop(self.name, str(key))
+        if raw is not None:
+            return json.loads(raw)
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def __contains__(self, key) -> bool:
+        return self.backend.get(self.name, str(key), None) is not None
+
+    def __iter__(self):
+        return iter([key for key, _ in self.backend.items(self.name)])
+
+    def items(self):
+        return [(key, json.loads(raw)) for key, raw in self.backend.items(self.name)]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __len__(self) -> int:
+        return self.backend.count(self.name)
+
+    def __repr__(self) -> str:
+        return f"SharedSessionStore({self.name!r}, {type(self.backend).__name__})"
+
+    def expire(self):
+        """Drop expired and over-budget entries (the session sweeper calls this)."""
+        dropped = self.backend.purge(self.name, self.max_entries, self.max_bytes)
+        for key, raw, reason in dropped:
+            if reason == "expired":
+                self._expired += 1
+            else:
+                self._evicted += 1
+            self._notify(key, raw, reason)
+
+    def _notify(self, key: str, raw: str, reason: str):
+        if not self.on_evict:
+            return
+        try:
+            self.on_evict(key, json.loads(raw), reason)
+        except Exception as e:
+            print(f"⚠️ Session store '{self.name}' eviction callback failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": self.backend.count(self.name),
+            "bytes": self.backend.size(self.name),
+            "expired": self._expired,
+            "evicted": self._evicted,
+        }
+
+
+def open_session_backend(backend: str = None) -> Optional[SessionBackend]:
+    """
+    Open the configured session backend.
+
+    Args:
+        backend: "memory" (per process, the default), "sqlite" or "redis";
+            defaults to the SESSION_BACKEND environment variable
+
+    Returns:
+        SessionBackend, or None for in-process memory
+    """
+    backend = (backend or os.getenv("SESSION_BACKEND") or "memory").lower()
+
+    if backend == "memory":
+        return None
+
+    if backend == "sqlite":
+        from src.data_dir import data_path
+
+        return SqliteSessionBackend(
+            os.getenv("SESSION_DATABASE") or data_path("sessions.db")
+        )
+
+    if backend == "redis":
+        return RedisSessionBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+
+    raise RuntimeError(
+        f"Unknown SESSION_BACKEND '{backend}'. Use 'memory', 'sqlite' or 'redis'."
+    )
+
+
+_backend_lock = threading.Lock()
+_backend = _MISSING
+
+
+def shared_backend() -> Optional[SessionBackend]:
+    """The configured SESSION_BACKEND (opened once per process), or None for memory."""
+    global _backend
+    with _backend_lock:
+        if _backend is _MISSING:
+            _backend = open_session_backend()
+    return _backend
+
+
+def open_session_store(name: str, **options):
+    """
+    A store for one kind of session state: a SharedSessionStore over
+    SESSION_BACKEND if one is configured, otherwise an in-process SessionStore.
+
+    Args:
+        name: Store name (the namespace in a shared backend)
+        **options: ttl, max_entries, max_bytes, sliding (see SessionStore)
+    """
+    backend = shared_backend()
+    if backend is None:
+        return SessionStore(name, **options)
+    return SharedSessionStore(name, backend, **options)
+
+
+def _holder_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class SharedLock:
+    """
+    A lock held across every process using the backend (a lease), and
+    reentrant within a process like threading.RLock.
+
+    The lease is renewed in the background while held, and lapses `ttl`
+    seconds after a holder dies. `on_acquire()` runs each time this process
+    takes the lease (not on reentry), e.g. to catch up on what other
+    processes changed meanwhile.
+    """
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        name: str,
+        ttl: float = 30.0,
+        on_acquire: Optional[Callable[[], None]] = None,
+    ):
+        self.backend = backend
+        self.name = f"lock:{name}"
+        self.ttl = ttl
+        self.on_acquire = on_acquire
+        self.holder = _holder_id()
+        self._local = threading.RLock()
+        self._depth = 0
+        # Guards `_held` between the owning thread and the renewer
+        self._state = threading.Lock()
+        self._held = False
+        self._renewer = None
+
+    def acquire(self):
+        self._local.acquire()
+        self._depth += 1
+        if self._depth > 1:
+            return
+        try:
+            delay = 0.005
+            while not self.backend.acquire_lease(self.name, self.holder, self.ttl):
+                time.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            with self._state:
+                self._held = True
+                self._start_renewer()
+            if self.on_acquire:
+                self.on_acquire()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        self._depth -= 1
+        try:
+            if self._depth == 0:
+                with self._state:
+                    held, self._held = self._held, False
+                if held:
+                    self.backend.release_lease(self.name, self.holder)
+        finally:
+            self._local.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _start_renewer(self):
+        # Call with self._state held; the renewer stops once the lock is free
+        if self._renewer is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.ttl / 3)
+                with self._state:
+                    if not self._held:
+                        self._renewer = None
+                        return
+                    try:
+                        if not self.backend.renew_lease(
+                            self.name, self.holder, self.ttl
+                        ):
+                            print(f"⚠️ Lost shared lock '{self.name}' while holding it")
+                    except Exception as e:
+                        print(f"⚠️ Couldn't renew shared lock '{self.name}': {e}")
+
+        self._renewer = threading.Thread(
+            target=run, name=f"{self.name}-renewer", daemon=True
+        )
+        self._renewer.start()
+
+
+class SharedVersion:
+    """
+    A change counter shared by every process, so each can tell when another
+    one has changed some state it keeps a copy of (and reload it).
+    """
+
+    def __init__(self, backend: SessionBackend, name: str):
+        self.backend = backend
+        self.name = name
+        self._seen = None
+
+    def changed(self) -> bool:
+        """True if another process has bumped the version since this one last looked."""
+        current = self.backend.incr("versions", self.name, 0)
+        changed, self._seen = current != self._seen, current
+        return changed
+
+    def bump(self):
+        """Record a change made by this process."""
+        current = self.backend.incr("versions", self.name)
+        # Our own change needs no reload, unless we missed another as well
+        if self._seen is not None and current == self._seen + 1:
+            self._seen = current
+
+
+class Leadership:
+    """
+    Picks one process, the leader, to run the background jobs that must run
+    only once: flushing the write-behind queue, sending queued mail, lead
+    digests, ledger compaction, accruals and the inbox watcher.
+
+    With a shared backend, processes that have called `start()` compete for
+    a lease renewed every `ttl / 3` seconds; if the leader dies, another
+    takes over within `ttl`. Leadership is given up locally before the lease
+    can lapse, so two processes never both think they lead. Without a
+    shared backend there is one process, and it always leads. `term` goes
+    up each time this process becomes leader, so a job can tell when to
+    pick up work another leader left unfinished.
+    """
+
+    def __init__(self, name: str = "leader", ttl: float = 15.0):
+        self.name = name
+        self.ttl = ttl
+        self.holder = _holder_id()
+        self.term = 0
+        self._valid_until = 0.0
+        self._thread = None
+
+    def start(self):
+        """Start competing for the lease (idempotent; a no-op without a shared backend)."""
+        if self._thread is not None or shared_backend() is None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="leadership", daemon=True
+        )
+        self._thread.start()
+
+    def is_leader(self) -> bool:
+        if shared_backend() is None:
+            return True
+        return time.monotonic() < self._valid_until
+
+    def _run(self):
+        backend = shared_backend()
+        while True:
+            asked_at = time.monotonic()
+            try:
+                leading = backend.acquire_lease(self.name, self.holder, self.ttl)
+            except Exception as e:
+                print(f"⚠️ Leader election failed, will retry: {e}")
+                leading = False
+            was_leader = self.is_leader()
+            if leading:
+                if not was_leader:
+                    self.term += 1
+                    print(f"👑 This process ({self.holder}) is now the leader")
+                # Counted from before the request, with a margin, so we stop
+                # leading before the lease can have lapsed
+                self._valid_until = asked_at + self.ttl * 2 / 3
+            elif was_leader:
+                self._valid_until = 0.0
+                print(f"👑 This process ({self.holder}) is no longer the leader")
+            time.sleep(self.ttl / 3)
+
+    def stats(self) -> dict:
+        return {"leader": self.is_leader(), "holder": self.holder, "term": self.term}
+
+
+# Shared by every background job that should run in only one process
+leadership = Leadership()
@@ -0,0 +1,302 @@
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Optional
+
+# Defaults for the per-session stores (see README "Sessions")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 24 * 3600))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", 50000))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", 256))
+
+# Every store, so one sweeper thread can expire them all
+_stores = weakref.WeakValueDictionary()
+
+_MISSING = object()
+
+
+def estimate_size(value, _seen=None) -> int:
+    """Rough deep size of a value in bytes (containers, strings, plain objects)."""
+    seen = _seen if _seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            estimate_size(k, seen) + estimate_size(v, seen) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, seen) for v in value)
+    elif hasattr(value, "__dict__"):
+        size += estimate_size(vars(value), seen)
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "slot")
+
+    def __init__(self, value, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.slot = None
+
+
+class SessionStore(MutableMapping):
+    """
+    Dict-like store for per-session state, bounded in time and in memory.
+
+    - Entries expire `ttl` seconds after they were last written (or, with
+      `sliding=True`, last read). Expired entries are never returned.
+    - Expiry is driven by a hashed timer wheel: each entry sits in the slot
+      for the tick it expires on, and advancing the wheel only looks at the
+      slots that came due, so expiring is O(expired) instead of a scan of
+      every session. Reads just move the deadline; an entry found early in
+      its old slot is rescheduled then.
+    - Beyond `max_entries` entries or `max_bytes` (estimated deep size of
+      the values, or whatever `sizeof` reports), the least recently used
+      entries are evicted.
+
+    Values are measured when written, so a value changed in place (e.g. a
+    conversation list that was appended to) should be assigned back to
+    keep the memory accounting right.
+
+    `on_evict(key, value, reason)` is called for entries that expire
+    ("expired") or are evicted for space ("evicted"), but not for explicit
+    deletes, e.g. to drop related state kept in another store.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = SESSION_TTL_SECONDS,
+        max_entries: Optional[int] = SESSION_MAX_ENTRIES,
+        max_bytes: Optional[int] = None,
+        sliding: bool = True,
+        on_evict: Optional[Callable[[Any, Any, str], None]] = None,
+        resolution: float = 1.0,
+        slots: int = 1024,
+        sizeof: Callable[[Any], int] = estimate_size,
+    ):
+        """
+        Args:
+            name: Label for logs and stats
+            ttl: Seconds an entry lives after its last write (or read, if sliding)
+            max_entries: Most entries kept (None = no limit)
+            max_bytes: Most estimated bytes kept (None = no limit)
+            sliding: Reads also push the expiry back
+            on_evict: Called as on_evict(key, value, reason) for expired and
+                evicted entries
+            resolution: Seconds per timer-wheel tick
+            slots: Number of timer-wheel slots
+            sizeof: Bytes a value counts for against `max_bytes`
+        """
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sliding = sliding
+        self.on_evict = on_evict
+        self.resolution = resolution
+        self.sizeof = sizeof
+        self._lock = threading.RLock()
+        # Format: {key: _Entry}, least recently used first
+        self._entries: "OrderedDict[Any, _Entry]" = OrderedDict()
+        self._wheel = [set() for _ in range(slots)]
+        self._tick = self._tick_for(time.monotonic())
+        self._bytes = 0
+        self._expired = 0
+        self._evicted = 0
+        _stores[id(self)] = self
+
+    def _tick_for(self, when: float) -> int:
+        return int(when // self.resolution)
+
+    def _schedule(self, key, entry: _Entry):
+        # Call with self._lock held
+        tick = max(self._tick_for(entry.expires_at), self._tick + 1)
+        slot = tick % len(self._wheel)
+        if entry.slot == slot:
+            return
+        if entry.slot is not None:
+            self._wheel[entry.slot].discard(key)
+        self._wheel[slot].add(key)
+        entry.slot = slot
+
+    def _drop(self, key) -> _Entry:
+        # Call with self._lock held
+        entry = self._entries.pop(key)
+        self._wheel[entry.slot].discard(key)
+        self._bytes -= entry.size
+        return entry
+
+    def _advance(self, now: float, dropped: list):
+        # Call with self._lock held; expired entries are added to `dropped`
+        tick = self._tick_for(now)
+        if tick <= self._tick:
+            return
+        steps = min(tick - self._tick, len(self._wheel))
+        first = self._tick + 1
+        self._tick = tick
+        for t in range(first, first + steps):
+            slot = self._wheel[t % len(self._wheel)]
+            for key in list(slot):
+                entry = self._entries.get(key)
+                if entry is None:
+                    slot.discard(key)
+                elif entry.expires_at <= now:
+                    dropped.append((key, self._drop(key).value, "expired"))
+                    self._expired += 1
+                else:
+                    # Read since it was scheduled, or due in a later round
+                    self._schedule(key, entry)
+
+    def _enforce_budget(self, keep, dropped: list):
+        # Call with self._lock held
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._entries))
+            if key == keep:
+                # Only the new entry is left; keep it even if it's over budget
+                break
+            dropped.append((key, self._drop(key).value, "evicted"))
+            self._evicted += 1
+
+    def _notify(self, dropped: list):
+        # Called without the lock, so callbacks may use other stores
+        if not dropped or not self.on_evict:
+            return
+        for key, value, reason in dropped:
+            try:
+                self.on_evict(key, value, reason)
+            except Exception as e:
+                print(f"⚠️ Session store '{self.name}' eviction callback failed: {e}")
+
+    def _live(self, key, now: float) -> Optional[_Entry]:
+        # Call with self._lock held
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at > now:
+            return entry
+        return None
+
+    def __getitem__(self, key):
+        dropped = []
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now, dropped)
+            entry = self._live(key, now)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if self.sliding:
+                    entry.expires_at = now + self.ttl
+        self._notify(dropped)
+        if entry is None:
+            raise KeyError(key)
+        return entry.value
+
+    def __setitem__(self, key, value):
+        dropped = []
+        with self._lock:
+            now = time.monotonic()
+            self._advance(now, dropped)
+            if key in self._entries:
+                self._drop(key)
+            entry = _Entry(value, self.sizeof(value), now + self.ttl)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._schedule(key, entry)
+            self._enforce_budget(key, dropped)
+        self._notify(dropped)
+
+    def __delitem__(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            if key in self._entries:
+                self._drop(key)
+        if entry is None:
+            raise KeyError(key)
+
+    def pop(self, key, default=_MISSING):
+        # One locked step, so an entry can't expire between the read and the delete
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            if key in self._entries:
+                self._drop(key)
+        if entry is not None:
+            return entry.value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._live(key, time.monotonic()) is not None
+
+    def __iter__(self):
+        # A snapshot, so callers may delete while iterating
+        with self._lock:
+            now = time.monotonic()
+            return iter([k for k, e in self._entries.items() if e.expires_at > now])
+
+    def items(self):
+        """Snapshot of the live (key, value) pairs; doesn't count as a read."""
+        with self._lock:
+            now = time.monotonic()
+            return [
+                (k, e.value) for k, e in self._entries.items() if e.expires_at > now
+            ]
+
+    def values(self):
+        return [value for _, value in self.items()]
+
+    def __len__(self) -> int:
+        self.expire()
+        with self._lock:
+            return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f"SessionStore({self.name!r}, entries={len(self._entries)})"
+
+    def expire(self):
+        """Drop everything that has expired (the sweeper calls this every tick)."""
+        dropped = []
+        with self._lock:
+            self._advance(time.monotonic(), dropped)
+        self._notify(dropped)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "expired": self._expired,
+                "evicted": self._evicted,
+            }
+
+
+def start_sweeper(interval: float = 1.0) -> threading.Thread:
+    """Expire entries in every SessionStore in the background, so idle stores shrink too."""
+
+    def run():
+        while True:
+            for store in list(_stores.values()):
+                try:
+                    store.expire()
+                except Exception as e:
+                    print(f"⚠️ Session sweep of '{store.name}' failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="session-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def session_stats() -> dict:
+    """Per-store entry counts, estimated bytes and expiry/eviction counters."""
+    return {store.name: store.stats() for store in list(_stores.values())}
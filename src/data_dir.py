@@ -0,0 +1,64 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Local state (ID counters, journals, ...) lives here; override with STAFFSYNC_DATA_DIR
+DATA_DIR = os.getenv("STAFFSYNC_DATA_DIR", "data")
+
+
+def data_path(*parts: str) -> str:
+    """Return a path inside the data directory, creating parent folders as needed."""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return path
+
+
+_lock_file = None
+
+
+def lock_data_dir():
+    """
+    Claim the data directory for this process, or raise RuntimeError if
+    another process (e.g. a second gunicorn worker) already has it.
+
+    Without a shared SESSION_BACKEND, the journals, leave ledger, Request ID
+    counter and schedulers under the data directory are owned by one
+    process; two running at once would reuse sequence numbers and Request
+    IDs and apply balance changes twice. The lock is released when the
+    process exits.
+    """
+    global _lock_file
+    if _lock_file is not None:
+        return
+    path = data_path("staffsync.lock")
+    lock_file = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        try:
+            lock_file.seek(0)
+            holder = f"PID {int(lock_file.read())}"
+        except (OSError, ValueError):
+            holder = "another process"
+        lock_file.close()
+        raise RuntimeError(
+            f"The data directory '{DATA_DIR}' is already in use by {holder}. "
+            "Without SESSION_BACKEND, StaffSync runs as a single process (one "
+            "worker): stop the other one, give this one its own "
+            "STAFFSYNC_DATA_DIR, or set SESSION_BACKEND=sqlite or redis to "
+            "run several."
+        )
+    lock_file.truncate(0)
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    _lock_file = lock_file
@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from .sheets_config import balance_ws, directory_ws, logs_ws
+from .storage import TABLES
+
+_tables = {"balance": balance_ws, "directory": directory_ws, "logs": logs_ws}
+
+_current: ContextVar[Optional["DataLoader"]] = ContextVar("data_loader", default=None)
+
+
+class DataLoader:
+    """
+    Per-request record loader.
+
+    Lookups are memoised for the rest of the request, so the auth check, the
+    tool itself and the email it sends share one fetch of each record.
+    (Balances come from the in-memory leave ledger, so a tool call only needs
+    the caller's directory row; there is nothing left to fetch in parallel.)
+    Records are read-only snapshots: don't use a loader across a write to the
+    same row.
+    """
+
+    def __init__(self):
+        # Format: {(table name, str(key)): (row_number, record)}
+        self._records: Dict[tuple, tuple] = {}
+
+    def find(self, name: str, key):
+        """Return (row_number, record) for `key` in table `name`, loading it if needed."""
+        cache_key = (name, str(key))
+        if cache_key not in self._records:
+            self._records[cache_key] = _find(name, key)
+        return self._records[cache_key]
+
+
+def _find(name: str, key):
+    _, key_column = TABLES[name]
+    return _tables[name].find(key_column, key)
+
+
+def find_record(name: str, key):
+    """
+    Look up a row by its key, going through the current request's loader if
+    there is one.
+
+    Returns:
+        tuple: (row_number, record), or (None, None) if not found
+    """
+    loader = _current.get()
+    if loader is None:
+        return _find(name, key)
+    return loader.find(name, key)
+
+
+@contextmanager
+def request_scope():
+    """Run a tool call with a fresh loader."""
+    loader = DataLoader()
+    token = _current.set(loader)
+    try:
+        yield loader
+    finally:
+        _current.reset(token)
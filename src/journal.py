@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from .core.session_backends import SharedLock, shared_backend
+from .data_dir import data_path
+
+
+class Journal:
+    """
+    Durable append-only journal of JSON entries, one per line.
+
+    `append()` writes and fsyncs an entry before returning, so once it returns
+    the entry survives a crash. When an entry has been handled, `ack()` it;
+    `pending()` returns everything not yet acknowledged (e.g. to replay after a
+    restart). The file is rewritten down to the pending entries by `compact()`.
+
+    File format, one JSON object per line:
+        {"seq": 12, "entry": {...}}   an entry
+        {"ack": [12, 13]}             entries that have been handled
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending: Dict[int, dict] = {}
+        self._next_seq = 1
+        self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from a crash mid-write; skip it
+                    print(f"⚠️ Skipping unreadable line in journal {self.path}")
+                    continue
+                if "seq" in record:
+                    self._pending[record["seq"]] = record["entry"]
+                    self._next_seq = max(self._next_seq, record["seq"] + 1)
+                for seq in record.get("ack", []):
+                    self._pending.pop(seq, None)
+
+    def _write(self, record: dict):
+        # Call with self._lock held
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, entry: dict) -> int:
+        """Durably record an entry and return its sequence number."""
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._write({"seq": seq, "entry": entry})
+            self._pending[seq] = entry
+            return seq
+
+    def ack(self, seqs: Iterable[int]):
+        """Mark entries as handled; they won't be returned by `pending()` again."""
+        seqs = list(seqs)
+        if not seqs:
+            return
+        with self._lock:
+            self._write({"ack": seqs})
+            for seq in seqs:
+                self._pending.pop(seq, None)
+
+    def pending(self) -> List[Tuple[int, dict]]:
+        """Unacknowledged entries, oldest first."""
+        with self._lock:
+            return sorted(self._pending.items())
+
+    def compact(self):
+        """Rewrite the file with only the pending entries, dropping acked history."""
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for seq, entry in sorted(self._pending.items()):
+                    f.write(json.dumps({"seq": seq, "entry": entry}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class SharedJournal:
+    """
+    The Journal interface over the shared session backend (SQLite or Redis),
+    so every process appends to and acknowledges the same entries.
+
+    Sequence numbers come from the backend, so they stay unique and
+    increasing across processes. Acknowledged entries are deleted at once;
+    `compact()` has nothing to do.
+    """
+
+    def __init__(self, backend, name: str):
+        self.backend = backend
+        self.name = name
+
+    def append(self, entry: dict) -> int:
+        """Durably record an entry and return its sequence number."""
+        return self.backend.journal_append(self.name, json.dumps(entry))
+
+    def ack(self, seqs: Iterable[int]):
+        """Mark entries as handled; they won't be returned by `pending()` again."""
+        seqs = list(seqs)
+        if seqs:
+            self.backend.journal_remove(self.name, seqs)
+
+    def pending(self) -> List[Tuple[int, dict]]:
+        """Unacknowledged entries, oldest first."""
+        return [
+            (seq, json.loads(value))
+            for seq, value in self.backend.journal_entries(self.name)
+        ]
+
+    def compact(self):
+        pass
+
+    def __len__(self):
+        return self.backend.journal_count(self.name)
+
+
+def open_journal(name: str):
+    """
+    The journal `name`: shared between processes if SESSION_BACKEND is
+    sqlite or redis, otherwise the file `data/<name>.jsonl`.
+
+    Entries still pending in that file (e.g. from before switching
+    SESSION_BACKEND) are moved into the shared journal on first open,
+    under their own sequence numbers, so moving them again after a crash
+    halfway doesn't duplicate any.
+    """
+    backend = shared_backend()
+    path = data_path(f"{name}.jsonl")
+    if backend is None:
+        return Journal(path)
+    journal = SharedJournal(backend, name)
+    with SharedLock(backend, f"journal:{name}"):
+        if os.path.exists(path):
+            old = Journal(path)
+            backlog = old.pending()
+            old.close()
+            for seq, entry in backlog:
+                backend.journal_append(name, json.dumps(entry), seq=seq)
+            os.replace(path, f"{path}.moved")
+            print(
+                f"🔁 Moved {len(backlog)} pending entries from {path} to the shared backend"
+            )
+    return journal
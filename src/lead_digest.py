@@ -0,0 +1,166 @@
+import re
+import threading
+import time
+from typing import Callable, Dict, Iterable, List
+
+from .journal import Journal
+
+# One decision: "Y", "N", "Y all", "Y 12,14", "N #13"
+_DECISION = re.compile(r"^(y|n)(?:\s+(all|#?\d+(?:\s*,\s*#?\d+)*))?$", re.I)
+
+
+def parse_decisions(lines: Iterable[str], request_ids: List[int]) -> Dict[int, str]:
+    """
+    Read a lead's reply to a (digest) request email.
+
+    Each line holds one or more decisions separated by "/" or ";", e.g.
+    "Y 12,14 / N 13". A bare "Y" / "N" (or "Y all") covers every request in
+    the email not decided otherwise. Reading stops at the first line that
+    isn't a decision (a greeting, signature or the quoted original), and
+    IDs that weren't in the email are ignored.
+
+    Args:
+        lines: Visible (unquoted) lines of the reply, in order
+        request_ids: Requests listed in the email being replied to
+
+    Returns:
+        dict: {request_id: "Approved" | "Rejected"}
+    """
+    decisions, default = {}, None
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        parts = [part.strip() for part in re.split(r"[/;]", line) if part.strip()]
+        matches = [_DECISION.match(part) for part in parts]
+        if not matches or not all(matches):
+            break
+        for match in matches:
+            status = "Approved" if match.group(1).lower() == "y" else "Rejected"
+            targets = match.group(2)
+            if not targets or targets.lower() == "all":
+                default = default or status
+                continue
+            for request_id in map(int, re.findall(r"\d+", targets)):
+                if request_id not in request_ids:
+                    print(f"⚠️ Ignoring decision for #{request_id}: not in this email")
+                    continue
+                decisions.setdefault(request_id, status)
+    if default:
+        for request_id in request_ids:
+            decisions.setdefault(request_id, default)
+    return decisions
+
+
+class LeadDigest:
+    """
+    Coalesces new-request notifications to the same lead.
+
+    The first request for a lead opens a window of `window` seconds; every
+    request for that lead arriving within it joins the same batch, and when
+    the window closes `deliver(lead, items)` is called once for the lot
+    (e.g. to send one digest email instead of one per request). Waiting
+    items are journaled, so a restart doesn't drop them: they are delivered
+    one window after `start()`.
+
+    With a shared journal and a `leader`, only the leader delivers; a
+    process that becomes leader reopens windows for the items waiting.
+    """
+
+    def __init__(
+        self,
+        journal: Journal,
+        deliver: Callable[[str, List[dict]], None],
+        window: float = 300.0,
+        leader=None,
+    ):
+        """
+        Args:
+            journal: Holds items until their batch is delivered
+            deliver: Called with (lead, [item, ...]) when a window closes
+            window: Seconds to collect requests for a lead
+            leader: Leadership deciding which process delivers from a shared
+                journal
+        """
+        self.journal = journal
+        self.deliver = deliver
+        self.window = window
+        self.leader = leader
+        self._term = 0
+        self._lock = threading.Lock()
+        # Format: {lead: time.monotonic() when its window opened}
+        self._opened: Dict[str, float] = {}
+        self._started = False
+
+    def start(self):
+        """Start the background worker (idempotent); reopens windows for waiting items."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        if self.leader is None:
+            self._reopen()
+        threading.Thread(target=self._run, name="lead-digest", daemon=True).start()
+
+    def _reopen(self):
+        # Open a window for every lead with items waiting
+        with self._lock:
+            backlog = self.journal.pending()
+            now = time.monotonic()
+            for _, entry in backlog:
+                self._opened.setdefault(entry["lead"], now)
+        if backlog:
+            print(f"🔁 {len(backlog)} lead notification(s) waiting for their digest")
+
+    def add(self, lead: str, item: dict):
+        """Queue `item` for `lead`'s next digest."""
+        self.start()
+        with self._lock:
+            self.journal.append({"lead": lead, "item": item})
+            self._opened.setdefault(lead, time.monotonic())
+
+    def _run(self):
+        while True:
+            time.sleep(min(1.0, self.window))
+            if self.leader:
+                if not self.leader.is_leader():
+                    continue
+                if self.leader.term != self._term:
+                    self._term = self.leader.term
+                    try:
+                        self._reopen()
+                    except Exception as e:
+                        self._term = 0
+                        print(f"⚠️ Lead digest backlog check failed, will retry: {e}")
+                        continue
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    lead
+                    for lead, opened in self._opened.items()
+                    if now - opened >= self.window
+                ]
+                for lead in due:
+                    del self._opened[lead]
+                batches = {lead: [] for lead in due}
+                for seq, entry in self.journal.pending():
+                    if entry["lead"] in batches:
+                        batches[entry["lead"]].append((seq, entry["item"]))
+
+            delivered = False
+            for lead, batch in batches.items():
+                if not batch:
+                    continue
+                try:
+                    self.deliver(lead, [item for _, item in batch])
+                except Exception as e:
+                    print(f"⚠️ Lead digest for {lead} failed, will retry: {e}")
+                    with self._lock:
+                        self._opened.setdefault(lead, time.monotonic())
+                    continue
+                self.journal.ack(seq for seq, _ in batch)
+                delivered = True
+
+            with self._lock:
+                if delivered and not len(self.journal):
+                    self.journal.compact()
@@ -0,0 +1,200 @@
+import datetime
+import json
+import os
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Log date formats we accept (the sheet may display dates in its own locale)
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y", "%Y/%m/%d")
+
+DEFAULT_REGION = "default"
+
+
+def parse_date(value) -> Optional[datetime.date]:
+    """Parse a log date, or return None if it isn't one we understand."""
+    if isinstance(value, datetime.date):
+        return value
+    text = str(value or "").strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _to_days(values: Iterable) -> np.ndarray:
+    """Dates as a datetime64[D] array; unreadable ones become NaT."""
+    values = list(values)
+    try:
+        return np.array(values, dtype="datetime64[D]")
+    except ValueError:
+        parsed = [parse_date(v) for v in values]
+        return np.array(
+            [d if d is not None else "NaT" for d in parsed], dtype="datetime64[D]"
+        )
+
+
+class LeaveCalendar:
+    """
+    Working-day calendar for one region: a weekmask plus public holidays.
+
+    Counts are done with NumPy's business-day routines, so `count()` works on
+    whole arrays of date ranges at once; `business_days()` is the one-request
+    convenience wrapper. Ranges are inclusive of both ends.
+    """
+
+    def __init__(self, weekmask: str = "1111100", holidays: Iterable = ()):
+        """
+        Args:
+            weekmask: Working days, Monday first, e.g. "1111100" or
+                "Mon Tue Wed Thu Fri"
+            holidays: Public holidays (YYYY-MM-DD)
+        """
+        self.weekmask = weekmask
+        self.holidays = sorted(str(h) for h in holidays)
+        self._calendar = np.busdaycalendar(
+            weekmask=weekmask, holidays=np.array(self.holidays, dtype="datetime64[D]")
+        )
+
+    def count(self, starts, ends) -> np.ndarray:
+        """
+        Working days in each [start, end] range.
+
+        Ranges with an unreadable date or an end before the start count as -1.
+        """
+        starts, ends = _to_days(starts), _to_days(ends)
+        bad = np.isnat(starts) | np.isnat(ends) | (ends < starts)
+        # Fill bad rows with a harmless range so busday_count doesn't choke
+        safe_starts = np.where(bad, np.datetime64("2000-01-01"), starts)
+        safe_ends = np.where(bad, np.datetime64("2000-01-01"), ends)
+        counts = np.busday_count(
+            safe_starts, safe_ends + np.timedelta64(1, "D"), busdaycal=self._calendar
+        )
+        return np.where(bad, -1, counts)
+
+    def business_days(self, start_date, end_date) -> int:
+        """Working days from `start_date` to `end_date` inclusive, or -1 if invalid."""
+        return int(self.count([start_date], [end_date])[0])
+
+
+_calendars: Dict[str, LeaveCalendar] = {}
+_calendars_lock = threading.Lock()
+
+
+def _load_calendars() -> Dict[str, LeaveCalendar]:
+    """
+    Build the region calendars from LEAVE_CALENDAR_FILE, a JSON file like
+    {"default": {"weekmask": "1111100", "holidays": ["2025-12-25"]}, "UAE": {...}}.
+    Without it, the default region uses LEAVE_WEEKMASK and the comma-separated
+    LEAVE_HOLIDAYS.
+    """
+    calendars = {}
+    path = os.getenv("LEAVE_CALENDAR_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for region, spec in json.load(f).items():
+                calendars[region] = LeaveCalendar(
+                    spec.get("weekmask", "1111100"), spec.get("holidays", [])
+                )
+    if DEFAULT_REGION not in calendars:
+        holidays = [h.strip() for h in os.getenv("LEAVE_HOLIDAYS", "").split(",")]
+        calendars[DEFAULT_REGION] = LeaveCalendar(
+            os.getenv("LEAVE_WEEKMASK", "1111100"), [h for h in holidays if h]
+        )
+    return calendars
+
+
+def get_calendar(region: Optional[str] = None) -> LeaveCalendar:
+    """The calendar for a region, falling back to the default one."""
+    with _calendars_lock:
+        if not _calendars:
+            _calendars.update(_load_calendars())
+        return _calendars.get(region or DEFAULT_REGION, _calendars[DEFAULT_REGION])
+
+
+def _problem(start_date, end_date, days, working_days) -> Optional[str]:
+    if working_days < 0 and (
+        parse_date(start_date) is None or parse_date(end_date) is None
+    ):
+        return f"The leave dates {start_date} to {end_date} couldn't be read; please use YYYY-MM-DD."
+    if working_days < 0:
+        return f"The leave dates {start_date} to {end_date} are invalid: the end date must be on or after the start date."
+    if working_days == 0:
+        return f"{start_date} to {end_date} has no working days (weekends and public holidays don't count)."
+    if days != working_days:
+        return f"{start_date} to {end_date} covers {working_days} working day(s), excluding weekends and public holidays, but {days} were requested. Please check the dates or the number of days."
+    return None
+
+
+def check_request(start_date, end_date, days, region: Optional[str] = None):
+    """
+    Check one request's dates against its day count.
+
+    Returns:
+        str: What's wrong, or None if the request is consistent
+    """
+    working_days = get_calendar(region).business_days(start_date, end_date)
+    return _problem(start_date, end_date, days, working_days)
+
+
+def validate_requests(
+    starts, ends, days, regions: Optional[Iterable] = None
+) -> List[Optional[str]]:
+    """
+    Bulk version of `check_request()`: one problem (or None) per request.
+
+    Requests are grouped by region and each group is counted in one
+    vectorised call, so thousands of rows validate in milliseconds.
+    """
+    starts, ends = list(starts), list(ends)
+    days = np.asarray(list(days))
+    regions = np.asarray(
+        list(regions) if regions is not None else [DEFAULT_REGION] * len(starts),
+        dtype=object,
+    )
+    working_days = np.empty(len(starts), dtype=np.int64)
+    start_days, end_days = _to_days(starts), _to_days(ends)
+    for region in set(regions):
+        rows = np.nonzero(regions == region)[0]
+        working_days[rows] = get_calendar(region).count(
+            start_days[rows], end_days[rows]
+        )
+
+    problems = [None] * len(starts)
+    for i in np.nonzero((working_days != days) | (working_days <= 0))[0]:
+        problems[i] = _problem(starts[i], ends[i], days[i], int(working_days[i]))
+    return problems
+
+
+def main(argv=None):
+    """
+    Check a leave log export for day counts that don't match the dates.
+
+    Usage:
+        python -m src.leave_calendar logs.csv
+    """
+    import pandas as pd
+
+    argv = argv if argv is not None else sys.argv[1:]
+    if len(argv) != 1:
+        print(main.__doc__)
+        return 2
+    logs = pd.read_csv(argv[0], dtype=str).fillna("")
+    days = pd.to_numeric(logs["Days"], errors="coerce").fillna(0).astype(int)
+    regions = logs["Region"] if "Region" in logs else None
+    problems = validate_requests(logs["Start Date"], logs["End Date"], days, regions)
+    bad = 0
+    for request_id, problem in zip(logs["Request ID"], problems):
+        if problem:
+            bad += 1
+            print(f"#{request_id}: {problem}")
+    print(f"{bad} of {len(logs)} request(s) have problems")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
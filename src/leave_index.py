@@ -0,0 +1,391 @@
+import datetime
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .availability import _team_key
+from .leave_calendar import parse_date
+
+
+class _Node:
+    __slots__ = ("key", "start", "end", "value", "max_end", "priority", "left", "right")
+
+    def __init__(self, start: int, end: int, value):
+        self.key = (start, str(value))
+        self.start = start
+        self.end = end
+        self.value = value
+        self.max_end = end
+        self.priority = random.random()
+        self.left = None
+        self.right = None
+
+    def update(self):
+        self.max_end = max(
+            self.end,
+            self.left.max_end if self.left else self.end,
+            self.right.max_end if self.right else self.end,
+        )
+
+
+def _split(node, key):
+    # Split into (keys < key, keys >= key)
+    if node is None:
+        return None, None
+    if node.key < key:
+        left, right = _split(node.right, key)
+        node.right = left
+        node.update()
+        return node, right
+    left, right = _split(node.left, key)
+    node.left = right
+    node.update()
+    return left, node
+
+
+def _merge(left, right):
+    # Every key in `left` is smaller than every key in `right`
+    if left is None or right is None:
+        return left or right
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        left.update()
+        return left
+    right.left = _merge(left, right.left)
+    right.update()
+    return right
+
+
+class IntervalTree:
+    """
+    Closed intervals [start, end] over integers (e.g. date ordinals).
+
+    A treap ordered by start, where every node also keeps the largest end in
+    its subtree. That lets `overlapping()` skip any subtree that ends before
+    the query starts, so a query costs O(log n + k) for k results, and
+    inserts / removals are O(log n) (all expected).
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, start: int, end: int, value):
+        """Add an interval; `value` identifies it (e.g. the request ID)."""
+        node = _Node(start, end, value)
+        left, right = _split(self._root, node.key)
+        self._root = _merge(_merge(left, node), right)
+        self._size += 1
+
+    def remove(self, start: int, value) -> bool:
+        """Remove the interval added with this start and value."""
+        key = (start, str(value))
+        left, rest = _split(self._root, key)
+        middle, right = _split(rest, (start, str(value) + "\0"))
+        self._root = _merge(left, right)
+        if middle is None:
+            return False
+        self._size -= 1
+        return True
+
+    def overlapping(self, start: int, end: int) -> List[Tuple[int, int, object]]:
+        """Every (start, end, value) that shares at least one point with [start, end]."""
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None or node.max_end < start:
+                continue
+            stack.append(node.left)
+            if node.start <= end:
+                if node.end >= start:
+                    found.append((node.start, node.end, node.value))
+                # Everything to the right starts at or after node.start
+                stack.append(node.right)
+        return found
+
+
+def _peak_absent(absences: List[Tuple[int, int, str]]) -> int:
+    """
+    Most people off on any single day, from (start, end, employee_id)
+    intervals: a sweep over the interval ends, O(k log k).
+    """
+    events = sorted(
+        [(start, 1, person) for start, _, person in absences]
+        + [(end + 1, -1, person) for _, end, person in absences]
+    )
+    # Format: {employee_id: their requests covering the current day}
+    covering = defaultdict(int)
+    off = peak = 0
+    for i, (day, change, person) in enumerate(events):
+        before = covering[person]
+        covering[person] += change
+        if before == 0 and change > 0:
+            off += 1
+        elif before > 0 and covering[person] == 0:
+            off -= 1
+        # Count once every change on this day has been applied
+        if i + 1 == len(events) or events[i + 1][0] != day:
+            peak = max(peak, off)
+    return peak
+
+
+class LeaveIndex:
+    """
+    Interval index over the leave logs, for overlap and team-conflict checks.
+
+    Holds one interval tree per employee and one per lead, built from the
+    logs and then kept up to date as requests are added, approved or
+    rejected, so a check never rescans the logs sheet. `start_refresher()`
+    rebuilds it periodically from the (cached) tables, so rows added or
+    edited in the sheet by hand are picked up too. Only pending and
+    approved requests are indexed; rejected ones free up their dates.
+
+    With `changes` (a SharedVersion), processes that each keep an index tell
+    each other about the requests they add or remove, and an index reloads
+    before its next use once another process has changed something.
+    Placeholder claims are only seen by the process that made them, so
+    claims that must not race are made under a lock shared by all of them.
+    """
+
+    def __init__(
+        self,
+        logs_table,
+        directory_table,
+        extra_logs: Optional[Callable[[], Iterable[dict]]] = None,
+        team_max_concurrent: int = 0,
+        changes=None,
+    ):
+        """
+        Args:
+            logs_table: The leave logs table
+            directory_table: The employee directory (for each employee's lead)
+            extra_logs: Returns log records not in the table yet (e.g. still
+                in the write-behind queue); called on load
+            team_max_concurrent: How many people under one lead may be off at
+                once; 0 for no limit
+            changes: SharedVersion bumped whenever a process changes a request
+        """
+        self.logs = logs_table
+        self.directory = directory_table
+        self.extra_logs = extra_logs
+        self.team_max_concurrent = team_max_concurrent
+        self.changes = changes
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._by_employee: Dict[str, IntervalTree] = defaultdict(IntervalTree)
+        self._by_lead: Dict[str, IntervalTree] = defaultdict(IntervalTree)
+        # Format: {request_id: (employee_id, lead, start ordinal, end ordinal)}
+        self._requests: Dict[str, Tuple[str, str, int, int]] = {}
+        self._refresher = None
+
+    def load(self, fresh: bool = False):
+        """
+        Build the index with one read of the logs and directory (again on
+        each refresh, so rows added or edited in the sheet are picked up).
+        Requests claimed but not queued yet are kept.
+
+        Args:
+            fresh: Re-read the logs rather than use a cached copy
+        """
+        if self.changes:
+            self.changes.changed()
+        leads = {
+            str(record["Employee ID"]): _team_key(record.get("Lead"))
+            for record in self.directory.get_all_records()
+        }
+        # Queued rows first: one flushed in between is then in the table
+        extra = list(self.extra_logs()) if self.extra_logs else []
+        if fresh:
+            self.logs.invalidate()
+        logs = list(self.logs.get_all_records()) + extra
+        with self._lock:
+            # Placeholder claims (see add_leave_log) aren't in any table yet
+            claims = {
+                request_id: entry
+                for request_id, entry in self._requests.items()
+                if not request_id.isdigit()
+            }
+            self._by_employee.clear()
+            self._by_lead.clear()
+            self._requests.clear()
+            skipped = 0
+            for log in logs:
+                if str(log.get("Status", "")).lower() not in ("pending", "approved"):
+                    continue
+                employee_id = str(log["Employee ID"])
+                start, end = parse_date(log["Start Date"]), parse_date(log["End Date"])
+                if start is None or end is None:
+                    skipped += 1
+                    continue
+                self._insert(
+                    str(log["Request ID"]),
+                    employee_id,
+                    leads.get(employee_id, ""),
+                    start.toordinal(),
+                    end.toordinal(),
+                )
+            for request_id, entry in claims.items():
+                self._insert(request_id, *entry)
+            first = not self._loaded
+            self._loaded = True
+        if first:
+            print(
+                f"📅 Leave index loaded: {len(self._requests)} request(s)"
+                + (f", {skipped} with unreadable dates skipped" if skipped else "")
+            )
+
+    def start_refresher(self, interval: float = 60.0):
+        """Rebuild from the tables every `interval` seconds in a background thread (idempotent)."""
+        if self._refresher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.load()
+                except Exception as e:
+                    print(f"⚠️ Leave index refresh failed, will retry: {e}")
+
+        self._refresher = threading.Thread(
+            target=run, name="leave-index-refresher", daemon=True
+        )
+        self._refresher.start()
+
+    def _ensure_loaded(self):
+        # Call with self._lock held
+        if not self._loaded:
+            self.load()
+        elif self.changes and self.changes.changed():
+            self.load(fresh=True)
+
+    def _changed(self, request_id):
+        # Other processes only ever see requests with a Request ID
+        if self.changes and str(request_id).isdigit():
+            self.changes.bump()
+
+    def _insert(self, request_id, employee_id, lead, start: int, end: int):
+        # Call with self._lock held
+        if request_id in self._requests:
+            self._remove(request_id)
+        lead = _team_key(lead)
+        self._requests[request_id] = (employee_id, lead, start, end)
+        self._by_employee[employee_id].insert(start, end, request_id)
+        if lead:
+            self._by_lead[lead].insert(start, end, request_id)
+
+    def _remove(self, request_id) -> bool:
+        # Call with self._lock held
+        entry = self._requests.pop(request_id, None)
+        if entry is None:
+            return False
+        employee_id, lead, start, _ = entry
+        self._by_employee[employee_id].remove(start, request_id)
+        if lead:
+            self._by_lead[lead].remove(start, request_id)
+        return True
+
+    def conflicts(self, employee_id, lead, start_date, end_date) -> dict:
+        """
+        Check a prospective request against the index.
+
+        Returns:
+            dict: {"overlaps": [request IDs of the employee's own overlapping
+            requests], "teammates": [employee IDs of others under the same lead
+            who are off during the period], "team_full": bool (on some day
+            of the period, team_max_concurrent of them are already off)}
+        """
+        employee_id = str(employee_id)
+        start, end = parse_date(start_date), parse_date(end_date)
+        if start is None or end is None:
+            raise ValueError(f"Unreadable leave dates: {start_date} to {end_date}")
+        start, end = start.toordinal(), end.toordinal()
+        with self._lock:
+            self._ensure_loaded()
+            overlaps = [
+                request_id
+                for _, _, request_id in self._by_employee[employee_id].overlapping(
+                    start, end
+                )
+            ]
+            lead = _team_key(lead)
+            absences = []
+            if lead:
+                for other_start, other_end, request_id in self._by_lead[
+                    lead
+                ].overlapping(start, end):
+                    other = self._requests[request_id][0]
+                    if other != employee_id:
+                        absences.append(
+                            (max(other_start, start), min(other_end, end), other)
+                        )
+            teammates = {other for _, _, other in absences}
+            team_full = bool(self.team_max_concurrent) and (
+                _peak_absent(absences) >= self.team_max_concurrent
+            )
+            return {
+                "overlaps": sorted(overlaps, key=str),
+                "teammates": sorted(teammates),
+                "team_full": team_full,
+            }
+
+    def claim(
+        self, request_id, employee_id, lead, start_date, end_date
+    ) -> Tuple[bool, dict]:
+        """
+        Atomically check a new request and, if it doesn't conflict, index it.
+
+        Returns:
+            tuple: (claimed, conflicts) with conflicts as from `conflicts()`
+        """
+        with self._lock:
+            found = self.conflicts(employee_id, lead, start_date, end_date)
+            if found["overlaps"] or found["team_full"]:
+                return False, found
+            self.add(request_id, employee_id, lead, start_date, end_date)
+            return True, found
+
+    def add(self, request_id, employee_id, lead, start_date, end_date):
+        """Index a request (e.g. one added or approved outside `claim()`)."""
+        start, end = parse_date(start_date), parse_date(end_date)
+        if start is None or end is None:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            self._insert(
+                str(request_id),
+                str(employee_id),
+                lead or "",
+                start.toordinal(),
+                end.toordinal(),
+            )
+        self._changed(request_id)
+
+    def remove(self, request_id) -> bool:
+        """Drop a request from the index (e.g. on rejection)."""
+        with self._lock:
+            removed = self._remove(str(request_id))
+        if removed:
+            self._changed(request_id)
+        return removed
+
+    def rename(self, old_id, new_id) -> bool:
+        """Re-key an indexed request, e.g. a placeholder claim once it has its Request ID."""
+        with self._lock:
+            entry = self._requests.get(str(old_id))
+            if entry is None:
+                return False
+            self._remove(str(old_id))
+            self._insert(str(new_id), *entry)
+        self._changed(new_id)
+        return True
+
+    def __contains__(self, request_id):
+        with self._lock:
+            return str(request_id) in self._requests
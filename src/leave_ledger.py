@@ -0,0 +1,495 @@
+import datetime
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from .core.session_backends import SharedLock, SharedVersion
+from .journal import Journal
+
+LEAVE_TYPES = ["Annual Leave", "Sick Leave", "Casual Leave"]
+
+
+def _tidy(value):
+    # Keep whole numbers as ints so the sheet shows "8", not "8.0"
+    return int(value) if float(value).is_integer() else value
+
+
+class LeaveLedger:
+    """
+    Event-sourced leave balances.
+
+    Every change to a balance is appended to a durable journal as a debit or
+    credit, and applied to an in-memory materialised balance under one lock,
+    so concurrent debits can't lose updates and reads are O(1) dict lookups.
+    Periodically `compact()` folds the journaled changes back into the Leaves
+    Balance table in one batched write and acknowledges them.
+
+    Compaction re-reads the table first and writes `current value + pending
+    changes`, so a manual edit to the sheet in the meantime is kept rather
+    than overwritten.
+
+    Pending leave requests hold a reservation against the balance
+    (`reserve()`), so two requests can't both spend the same days. Approval
+    turns the reservation into a debit; rejection releases it. Debits and
+    credit-backs are idempotent per request (`commit()` / `refund()`), so a
+    request approved twice is only debited once; which requests are settled
+    is written to the journal at each compaction, so this survives restarts.
+
+    With a shared backend, several processes keep a ledger each over one
+    shared journal. Every operation holds a lock shared by all of them and
+    first applies the entries the others appended since (reservations are
+    journaled too, when they get their Request ID). After a compaction,
+    which changes the table underneath, the others reload.
+    """
+
+    def __init__(
+        self,
+        balance_table,
+        journal: Journal,
+        pending_requests: Optional[Callable[..., Iterable[Tuple]]] = None,
+        backend=None,
+    ):
+        """
+        Args:
+            balance_table: The Leaves Balance table
+            journal: Where balance changes are recorded until compacted
+            pending_requests: Returns (request_id, employee_id, leave_type,
+                days) for every request still awaiting a decision; called on
+                load so each gets a reservation, with fresh=True when cached
+                logs may be out of date
+            backend: Shared session backend, if the journal is shared with
+                other processes
+        """
+        self.table = balance_table
+        self.journal = journal
+        self.pending_requests = pending_requests
+        if backend is None:
+            self._lock = threading.RLock()
+            self._compactions = None
+        else:
+            self._lock = SharedLock(backend, "leave_ledger", on_acquire=self._sync)
+            # Bumped by whichever process compacts
+            self._compactions = SharedVersion(backend, "leave_ledger_compactions")
+        self._last_seq = 0
+        self._loaded = False
+        # Format: {employee_id: {leave_type: value}} as last read from the table
+        self._base: Dict[str, Dict[str, float]] = {}
+        # Format: {employee_id: {leave_type: sum of un-compacted changes}}
+        self._delta = defaultdict(lambda: defaultdict(float))
+        # Format: {request_id: (employee_id, leave_type, days)}
+        self._reservations: Dict[str, Tuple[str, str, float]] = {}
+        # Format: {employee_id: {leave_type: days held by pending requests}}
+        self._reserved = defaultdict(lambda: defaultdict(float))
+        # Format: {request_id: "committed" | "refunded"}, the last balance
+        # change made for each request (kept across compactions)
+        self._settled: Dict[str, str] = {}
+        self._compactor = None
+
+    # Loading
+
+    def load(self, fresh: bool = False):
+        """
+        Read the balance table once, replay un-compacted changes and rebuild
+        reservations.
+
+        Args:
+            fresh: Re-read the tables rather than use cached copies (e.g.
+                after another process compacted)
+        """
+        with self._lock:
+            if self._compactions:
+                self._compactions.changed()
+            if fresh:
+                self.table.invalidate()
+            self._read_base()
+            self._delta.clear()
+            pending = self.journal.pending()
+            applied = set()
+            for seq, entry in pending:
+                if "compaction" not in entry:
+                    continue
+                # A compaction was interrupted; if the table already holds its
+                # target values, its changes must not be applied again
+                targets = entry["targets"]
+                done = all(
+                    self._base.get(employee_id, {}).get(t) == value
+                    for employee_id, values in targets.items()
+                    for t, value in values.items()
+                )
+                if done:
+                    applied.update(entry["compaction"])
+                self.journal.ack([seq] + (entry["compaction"] if done else []))
+            # Placeholder claims (see add_leave_log) aren't in any table yet
+            claims = {
+                request_id: held
+                for request_id, held in self._reservations.items()
+                if not request_id.isdigit()
+            }
+            self._reservations.clear()
+            self._reserved.clear()
+            pending_requests = (
+                self.pending_requests(fresh=fresh) if self.pending_requests else ()
+            )
+            for request_id, employee_id, leave_type, days in pending_requests:
+                self._hold(str(request_id), str(employee_id), leave_type, days)
+            for request_id, held in claims.items():
+                self._hold(request_id, *held)
+            for seq, entry in pending:
+                if "compaction" not in entry:
+                    self._replay(entry, counted=seq not in applied)
+            if pending:
+                self._last_seq = max(self._last_seq, pending[-1][0])
+            first = not self._loaded
+            self._loaded = True
+        if first:
+            print(
+                f"📒 Leave ledger loaded: {len(self._base)} employees, "
+                f"{len(self.journal)} un-compacted change(s), "
+                f"{len(self._reservations)} pending reservation(s)"
+            )
+
+    def _replay(self, entry: dict, counted: bool = True):
+        # Call with self._lock held; applies one journal entry in memory
+        if "settled" in entry:
+            # Written at each compaction, so debits and refunds that are
+            # already folded into the table still count
+            self._settled.update(entry["settled"])
+        elif "hold" in entry:
+            self._unhold(str(entry.get("replaces")))
+            self._hold(
+                str(entry["hold"]),
+                entry["employee_id"],
+                entry["leave_type"],
+                entry["days"],
+            )
+        elif "release" in entry:
+            self._unhold(str(entry["release"]))
+        elif "delta" in entry:
+            if entry.get("ref") is not None:
+                self._settled[str(entry["ref"])] = (
+                    "committed" if entry["delta"] < 0 else "refunded"
+                )
+            if counted:
+                self._delta[entry["employee_id"]][entry["leave_type"]] += entry["delta"]
+
+    def _sync(self):
+        # Runs as this process takes the shared lock: catch up on what the
+        # others did since
+        if not self._loaded:
+            return
+        if self._compactions.changed():
+            self.load(fresh=True)
+            return
+        for seq, entry in self.journal.pending():
+            if seq > self._last_seq and "compaction" not in entry:
+                self._replay(entry)
+                self._last_seq = seq
+
+    def _append(self, entry: dict) -> int:
+        # Call with self._lock held
+        seq = self.journal.append(entry)
+        self._last_seq = max(self._last_seq, seq)
+        return seq
+
+    def _ensure_employee(self, employee_id: str) -> bool:
+        # Call with self._lock held
+        if not self._loaded:
+            self.load()
+        if employee_id not in self._base:
+            # Maybe added to the sheet since we loaded (e.g. a new hire)
+            _, record = self.table.find("Employee ID", employee_id)
+            if not record:
+                return False
+            self._base[employee_id] = {t: record.get(t) or 0 for t in LEAVE_TYPES}
+        return True
+
+    # Reads
+
+    def balances(self, employee_id) -> Optional[Dict[str, float]]:
+        """Current balance per leave type, or None if the employee is unknown."""
+        employee_id = str(employee_id)
+        with self._lock:
+            if not self._ensure_employee(employee_id):
+                return None
+            delta = self._delta.get(employee_id, {})
+            return {
+                t: _tidy(self._base[employee_id][t] + delta.get(t, 0))
+                for t in LEAVE_TYPES
+            }
+
+    def reserved(self, employee_id) -> Dict[str, float]:
+        """Days held by pending requests, per leave type."""
+        with self._lock:
+            held = self._reserved.get(str(employee_id), {})
+            return {t: _tidy(held.get(t, 0)) for t in LEAVE_TYPES}
+
+    def available(self, employee_id, leave_type: str) -> Optional[float]:
+        """Balance minus days held by pending requests."""
+        balances = self.balances(employee_id)
+        if balances is None:
+            return None
+        return _tidy(balances[leave_type] - self.reserved(employee_id)[leave_type])
+
+    # Writes
+
+    def _record(self, employee_id: str, leave_type: str, delta: float, ref=None):
+        # Call with self._lock held; journal first so the change is durable
+        self._append(
+            {
+                "employee_id": employee_id,
+                "leave_type": leave_type,
+                "delta": delta,
+                "ref": ref,
+                "at": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+        )
+        self._delta[employee_id][leave_type] += delta
+
+    def apply(self, employee_id, leave_type: str, days_change: float, ref=None):
+        """
+        Credit (positive) or debit (negative) a balance atomically.
+
+        Returns:
+            bool: False if the employee is unknown
+        """
+        employee_id = str(employee_id)
+        if leave_type not in LEAVE_TYPES:
+            raise ValueError(f"Unknown leave type: {leave_type}")
+        with self._lock:
+            if not self._ensure_employee(employee_id):
+                return False
+            self._record(employee_id, leave_type, days_change, ref)
+            return True
+
+    def _hold(self, request_id: str, employee_id: str, leave_type: str, days):
+        # Call with self._lock held
+        self._unhold(request_id)
+        self._reservations[request_id] = (employee_id, leave_type, days)
+        self._reserved[employee_id][leave_type] += days
+
+    def _unhold(self, request_id: str) -> bool:
+        # Call with self._lock held
+        held = self._reservations.pop(request_id, None)
+        if held is None:
+            return False
+        employee_id, leave_type, days = held
+        self._reserved[employee_id][leave_type] -= days
+        return True
+
+    def _publish_hold(self, request_id: str, replaces: Optional[str] = None):
+        # Call with self._lock held. Holds under a Request ID are journaled
+        # for the other processes; placeholder claims stay in this one
+        if not request_id.isdigit():
+            return
+        employee_id, leave_type, days = self._reservations[request_id]
+        self._append(
+            {
+                "hold": request_id,
+                "replaces": replaces,
+                "employee_id": employee_id,
+                "leave_type": leave_type,
+                "days": days,
+            }
+        )
+
+    def reserve(self, request_id, employee_id, leave_type: str, days) -> bool:
+        """
+        Hold `days` for a pending request if that many are available.
+
+        Returns:
+            bool: True if reserved, False if the balance doesn't cover it
+        """
+        request_id, employee_id = str(request_id), str(employee_id)
+        with self._lock:
+            available = self.available(employee_id, leave_type)
+            if available is None or available < days:
+                return False
+            self._hold(request_id, employee_id, leave_type, days)
+            self._publish_hold(request_id)
+            return True
+
+    def release(self, request_id) -> bool:
+        """Drop a pending request's reservation (e.g. on rejection)."""
+        request_id = str(request_id)
+        with self._lock:
+            if not self._unhold(request_id):
+                return False
+            if request_id.isdigit():
+                self._append({"release": request_id})
+            return True
+
+    def rename(self, old_id, new_id) -> bool:
+        """
+        Move a reservation to another key, e.g. a placeholder claim once its
+        row is queued under its Request ID.
+        """
+        old_id, new_id = str(old_id), str(new_id)
+        with self._lock:
+            held = self._reservations.get(old_id)
+            if held is None:
+                return False
+            self._unhold(old_id)
+            self._hold(new_id, *held)
+            self._publish_hold(new_id, replaces=old_id)
+            return True
+
+    def commit(self, request_id, employee_id, leave_type: str, days) -> bool:
+        """
+        Turn a request's reservation (if any) into a debit, atomically.
+
+        A request that is already debited isn't debited again (e.g. when
+        it is approved twice).
+        """
+        request_id = str(request_id)
+        with self._lock:
+            self.release(request_id)
+            if self._settled.get(request_id) == "committed":
+                return True
+            if not self.apply(employee_id, leave_type, -days, ref=request_id):
+                return False
+            self._settled[request_id] = "committed"
+            return True
+
+    def refund(self, request_id, employee_id, leave_type: str, days) -> bool:
+        """
+        Credit back an approved request's days (e.g. approved, then rejected).
+
+        Like `commit()`, this happens at most once per request.
+        """
+        request_id = str(request_id)
+        with self._lock:
+            if self._settled.get(request_id) == "refunded":
+                return True
+            if not self.apply(employee_id, leave_type, days, ref=request_id):
+                return False
+            self._settled[request_id] = "refunded"
+            return True
+
+    # Compaction
+
+    def _read_base(self):
+        # Call with self._lock held
+        self._base = {
+            str(record["Employee ID"]): {t: record.get(t) or 0 for t in LEAVE_TYPES}
+            for record in self.table.get_all_records()
+        }
+
+    def compact(self) -> int:
+        """
+        Fold journaled changes into the balance table with one batched write.
+
+        Returns:
+            int: Number of balance cells written
+        """
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            # Fresh read so manual edits made in the sheet are picked up
+            self.table.invalidate()
+            self._read_base()
+
+            pending = self.journal.pending()
+            entries = [(seq, e) for seq, e in pending if "delta" in e]
+            if not entries:
+                return 0
+
+            updates, targets, missing = {}, {}, set()
+            for employee_id, changes in self._delta.items():
+                changes = {t: d for t, d in changes.items() if d}
+                if not changes:
+                    continue
+                row_num, _ = self.table.find("Employee ID", employee_id)
+                if not row_num:
+                    missing.add(employee_id)
+                    continue
+                base = self._base[employee_id]
+                values = {t: _tidy(base[t] + d) for t, d in changes.items()}
+                updates[row_num] = values
+                targets[employee_id] = values
+            if missing:
+                # Kept in the journal (and the balances) until the employee is
+                # back in the sheet, rather than silently dropped
+                print(
+                    f"⚠️ Leave ledger: {', '.join(sorted(missing))} not in the "
+                    "balance sheet; keeping their changes un-compacted"
+                )
+                entries = [
+                    (seq, e) for seq, e in entries if e["employee_id"] not in missing
+                ]
+                if not entries:
+                    return 0
+
+            # If we crash after the write but before the ack, this marker lets
+            # load() tell that the changes already reached the table
+            marker = self._append(
+                {"compaction": [seq for seq, _ in entries], "targets": targets}
+            )
+            # Which requests are settled outlives the entries acked below
+            self._append({"settled": dict(self._settled)})
+            # Reservations are rebuilt from the pending requests on load, so
+            # their entries only matter until then
+            done = [
+                seq
+                for seq, e in pending
+                if "settled" in e or "hold" in e or "release" in e
+            ]
+            self.table.update_rows(updates)
+            self.journal.ack([seq for seq, _ in entries] + done + [marker])
+            self.journal.compact()
+            if self._compactions:
+                self._compactions.bump()
+
+            for employee_id, values in targets.items():
+                self._base[employee_id].update(values)
+            for employee_id in list(self._delta):
+                if employee_id not in missing:
+                    del self._delta[employee_id]
+            print(
+                f"📒 Ledger compacted {len(entries)} change(s) into {len(updates)} row(s)"
+            )
+            return sum(len(v) for v in updates.values())
+
+    def exclusive(self, func):
+        """
+        Run `func` (e.g. a bulk rewrite of the balance table) with the ledger
+        held: pending changes are compacted into the table first, nothing else
+        can change a balance meanwhile, and the ledger re-reads the table
+        afterwards.
+        """
+        with self._lock:
+            self.compact()
+            try:
+                return func()
+            finally:
+                self.table.invalidate()
+                self._read_base()
+                if self._compactions:
+                    self._compactions.bump()
+
+    def start_compactor(self, interval: float = 60.0, leader=None):
+        """
+        Compact every `interval` seconds in a background thread (idempotent).
+
+        Args:
+            interval: Seconds between compactions
+            leader: If given, only compact while this process leads (every
+                compaction makes the other processes reload)
+        """
+        if self._compactor is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                if leader and not leader.is_leader():
+                    continue
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"⚠️ Ledger compaction failed, will retry: {e}")
+
+        self._compactor = threading.Thread(
+            target=run, name="ledger-compactor", daemon=True
+        )
+        self._compactor.start()
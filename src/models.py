@@ -1,22 +1,218 @@
 from openai import OpenAI
+import copy
 import os
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import threading
+from collections import Counter, OrderedDict
 from dotenv import load_dotenv
 from pydantic import ValidationError
 import textwrap
-from .constants import tools
+from .constants import system_call_for, tools
+from .core.session_store import SessionStore
 from .validation import ToolCall, extract_response, MAX_REPAIR_TRIES
 
 load_dotenv()
 
 MODEL_ID = os.getenv("HF_MODEL_ID")
-if MODEL_ID:
+tokenizer = None
+model = None
+
+# System prompts whose key/value cache is kept: today's, and yesterday's for
+# conversations that started before midnight
+PROMPT_CACHE_SIZE = 2
+
+# Format: {system prompt text: (input_ids, DynamicCache)}, least recently used first
+_prompt_caches = OrderedDict()
+_prompt_cache_lock = threading.Lock()
+_prompt_cache_stats = Counter()
+
+# Per-conversation key/value caches: total tensor size (RAM or VRAM, wherever
+# the model lives) and idle lifetime
+MODEL_SESSION_CACHE_MB = float(os.getenv("MODEL_SESSION_CACHE_MB", 1024))
+MODEL_SESSION_CACHE_TTL_SECONDS = float(
+    os.getenv("MODEL_SESSION_CACHE_TTL_SECONDS", 30 * 60)
+)
+
+
+class _SessionCache:
+    """A conversation's rendered text so far, its token IDs and their keys/values."""
+
+    __slots__ = ("text", "input_ids", "cache")
+
+    def __init__(self, text: str, input_ids, cache):
+        self.text = text
+        self.input_ids = input_ids
+        self.cache = cache
+
+
+def _cache_bytes(cache) -> int:
+    """Bytes held by a DynamicCache's key and value tensors."""
+    layers = getattr(cache, "layers", None)
+    if layers is not None:
+        tensors = [t for layer in layers for t in (layer.keys, layer.values)]
+    else:
+        # transformers < 4.54
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors if t is not None)
+
+
+def _session_cache_bytes(entry: _SessionCache) -> int:
+    return _cache_bytes(entry.cache) + entry.input_ids.numel() * 8
+
+
+# Format: {session_id: _SessionCache}, least recently used evicted over budget
+session_caches = SessionStore(
+    "model_session_caches",
+    ttl=MODEL_SESSION_CACHE_TTL_SECONDS,
+    max_entries=None,
+    max_bytes=int(MODEL_SESSION_CACHE_MB * 1024 * 1024),
+    sizeof=_session_cache_bytes,
+)
+
+
+def load_local_model():
+    """Load the local HF model and tokenizer (startup step; no-op without HF_MODEL_ID)."""
+    global tokenizer, model
+    if not MODEL_ID or model is not None:
+        return
+    # Imported here so the OpenAI-only setup never pays for torch/transformers
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
     cache_dir = r"D:\LLMs"
     model_id = MODEL_ID
     print("Loading model:", model_id)
     tokenizer = AutoTokenizer.from_pretrained(model_id, cache_dir=cache_dir)
     model = AutoModelForCausalLM.from_pretrained(model_id, cache_dir=cache_dir)
     print("Model loaded successfully.")
+    _system_prefix({"role": "system", "content": system_call_for(True)})
+
+
+def _system_prefix(system_message: dict):
+    """
+    Token IDs and key/value cache for a conversation's system message.
+
+    The system prompt (with the whole tool schema) is the same for every
+    session, so it is run through the model once and the result reused by
+    every request. It is keyed by the prompt text, which changes with the
+    date in it, so a new day's prompt is prefilled once, on first use.
+    """
+    import torch
+    from transformers import DynamicCache
+
+    key = system_message["content"]
+    with _prompt_cache_lock:
+        if key in _prompt_caches:
+            _prompt_caches.move_to_end(key)
+            return _prompt_caches[key]
+        # Tokenized exactly like full prompts, so the IDs line up
+        prompt = tokenizer.apply_chat_template([system_message], tokenize=False)
+        enc = tokenizer(prompt, return_tensors="pt").to(model.device)
+        cache = DynamicCache()
+        with torch.no_grad():
+            model(**enc, past_key_values=cache, use_cache=True)
+        _prompt_caches[key] = (enc.input_ids, cache)
+        while len(_prompt_caches) > PROMPT_CACHE_SIZE:
+            _prompt_caches.popitem(last=False)
+        _prompt_cache_stats["builds"] += 1
+        print(f"🧠 Cached system prompt ({enc.input_ids.shape[-1]} tokens)")
+        return _prompt_caches[key]
+
+
+def _cached_prefix(input_messages, input_ids) -> dict:
+    """
+    `generate()` arguments that start from the system prompt's cached
+    keys/values, so only the rest of the conversation is prefilled.
+
+    Returns {} (a full prefill) if the conversation doesn't open with a
+    system message or its tokens don't start with the cached ones.
+    """
+    import torch
+
+    if not input_messages or input_messages[0].get("role") != "system":
+        return {}
+    prefix_ids, cache = _system_prefix(input_messages[0])
+    length = prefix_ids.shape[-1]
+    if input_ids.shape[-1] <= length or not torch.equal(
+        input_ids[0, :length], prefix_ids[0]
+    ):
+        with _prompt_cache_lock:
+            _prompt_cache_stats["misses"] += 1
+        return {}
+    with _prompt_cache_lock:
+        _prompt_cache_stats.update(hits=1, tokens_reused=length)
+    # generate() appends to the cache it is given, so each call gets a copy
+    return {"past_key_values": copy.deepcopy(cache)}
+
+
+def _encode_prompt(input_messages, prompt: str, session_id: str = None):
+    """
+    Token IDs for a rendered prompt, and `generate()` arguments that reuse
+    whatever is already cached for them.
+
+    If the session's cache covers the start of the prompt (the conversation
+    has only grown since the last call), only the new text is tokenized and
+    prefilled. Otherwise the whole prompt is tokenized and prefilled from
+    the system prompt's cache.
+
+    Returns:
+        tuple: (input_ids, generate() kwargs)
+    """
+    import torch
+
+    # Taken out of the store while in use, so a concurrent request for the
+    # same session falls back to a full prefill instead of sharing it
+    entry = session_caches.pop(session_id, None) if session_id else None
+    if entry is not None and prompt.startswith(entry.text):
+        new_ids = tokenizer(
+            prompt[len(entry.text) :], add_special_tokens=False, return_tensors="pt"
+        ).input_ids.to(model.device)
+        with _prompt_cache_lock:
+            _prompt_cache_stats.update(
+                session_hits=1, tokens_reused=entry.input_ids.shape[-1]
+            )
+        input_ids = torch.cat([entry.input_ids, new_ids], dim=-1)
+        return input_ids, {"past_key_values": entry.cache}
+
+    if entry is not None:
+        # The conversation was reset or rewritten
+        with _prompt_cache_lock:
+            _prompt_cache_stats["session_misses"] += 1
+    input_ids = tokenizer(prompt, return_tensors="pt").input_ids.to(model.device)
+    return input_ids, _cached_prefix(input_messages, input_ids)
+
+
+def _keep_session_cache(session_id: str, input_messages, prompt: str, input_ids, cache):
+    """
+    Keep a conversation's keys/values, up to the end of its last message,
+    for its next turn. The generation prompt and the reply are cropped off:
+    the reply comes back as a message, re-rendered by the chat template.
+    """
+    if not session_id or cache is None:
+        return
+    text = tokenizer.apply_chat_template(input_messages, tokenize=False)
+    if not prompt.startswith(text):
+        return
+    header = tokenizer(prompt[len(text) :], add_special_tokens=False).input_ids
+    length = input_ids.shape[-1] - len(header)
+    if length <= 0:
+        return
+    extra = cache.get_seq_length() - length
+    if extra > 0:
+        cache.crop(-extra)
+    entry = _SessionCache(text, input_ids[:, :length], cache)
+    if _session_cache_bytes(entry) > session_caches.max_bytes:
+        # Bigger than the whole budget: the next turn does a full prefill
+        return
+    session_caches[session_id] = entry
+
+
+def prompt_cache_stats() -> dict:
+    """
+    Key/value cache counters: system-prompt `hits`, `misses` (full
+    prefills) and `builds`, per-conversation `session_hits` and
+    `session_misses`, and prompt `tokens_reused` instead of prefilled.
+    """
+    with _prompt_cache_lock:
+        return {**_prompt_cache_stats, "cached_prompts": len(_prompt_caches)}
 
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -28,7 +224,20 @@ if not OPENAI_API_KEY and not MODEL_ID:
 client = OpenAI(api_key=OPENAI_API_KEY)
 
 
-def generate_response(input_messages, use_local_model, tools=tools):
+def generate_response(input_messages, use_local_model, tools=tools, session_id=None):
+    """
+    Get the model's next reply to a conversation.
+
+    Args:
+        input_messages: The conversation so far (system message first)
+        use_local_model: Use the local HF model instead of OpenAI
+        tools: Tool schema (OpenAI only; the local model has it in its prompt)
+        session_id: Conversation to keep the local model's key/value cache
+            for between turns (None = don't keep one)
+
+    Returns:
+        tuple: (is_tool_call, tool call or reply text)
+    """
     if not use_local_model:
         print("Generating response with input:", input_messages)
         response = client.responses.create(
@@ -43,6 +252,8 @@ def generate_response(input_messages, use_local_model, tools=tools):
                 return False, output.content[0].text
 
     else:
+        import torch
+
         for attempt in range(1, MAX_REPAIR_TRIES + 1):
             # generate
             if tokenizer.pad_token is None:
@@ -53,18 +264,25 @@ def generate_response(input_messages, use_local_model, tools=tools):
             prompt = tokenizer.apply_chat_template(
                 input_messages, add_generation_prompt=True, tokenize=False
             )
-            enc = tokenizer(prompt, return_tensors="pt").to(model.device)
+            input_ids, cached = _encode_prompt(input_messages, prompt, session_id)
 
-            ids = model.generate(
-                **enc,
+            output = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                **cached,
                 max_new_tokens=256,
                 eos_token_id=[
                     tokenizer.convert_tokens_to_ids("<|eot_id|>"),
                     tokenizer.convert_tokens_to_ids("<|eom_id|>"),
                 ],
                 pad_token_id=tokenizer.pad_token_id,
+                return_dict_in_generate=True,
+            )
+            ids = output.sequences
+            prompt_len = input_ids.shape[-1]
+            _keep_session_cache(
+                session_id, input_messages, prompt, input_ids, output.past_key_values
             )
-            prompt_len = enc.input_ids.shape[-1]
             raw_reply = tokenizer.decode(
                 ids[0][prompt_len:], skip_special_tokens=False  # skip prompt tokens
             )
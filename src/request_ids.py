@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+from .data_dir import data_path
+
+
+class RequestIdAllocator:
+    """
+    Hands out leave request IDs without reading the logs sheet each time.
+
+    The last issued ID (high-water mark) is a counter in the shared session
+    backend when there is one, so every process takes IDs from the same
+    sequence; otherwise it is kept in memory and persisted to a small JSON
+    file after every allocation, so a restart carries on where it left off.
+    The sheet is only consulted to reconcile: once on first use, and again
+    whenever an ID we are about to hand out turns out to exist already
+    (someone added rows by hand).
+    """
+
+    def __init__(self, logs_ws, state_path: str, backend=None):
+        """
+        Args:
+            logs_ws: The leave logs table
+            state_path: JSON file for the high-water mark (without a backend,
+                and to carry it over when switching to one)
+            backend: Shared session backend holding the counter, if any
+        """
+        self.logs_ws = logs_ws
+        self.state_path = state_path
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._last_id = None
+        self._reconciled = False
+
+    def _read_state(self) -> int:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return int(json.load(f)["last_id"])
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError, json.JSONDecodeError) as e:
+            print(f"⚠️ Ignoring unreadable request ID state {self.state_path}: {e}")
+            return 0
+
+    def _write_state(self, last_id: int):
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"last_id": last_id}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _max_id_in_sheet(self) -> int:
+        ids = [
+            int(log["Request ID"])
+            for log in self.logs_ws.get_all_records()
+            if str(log.get("Request ID", "")).strip().isdigit()
+        ]
+        return max(ids, default=0)
+
+    def _take(self, count: int, floor: int = 0) -> int:
+        # Call with self._lock held; moves the high-water mark past `floor`
+        # and `count` more IDs, and returns the first of them
+        if self.backend is not None:
+            return self.backend.incr("request_ids", "last_id", count, floor) - count + 1
+        if self._last_id is None:
+            self._last_id = self._read_state()
+        first = max(self._last_id, floor) + 1
+        self._last_id = first + count - 1
+        self._write_state(self._last_id)
+        return first
+
+    def _reconcile_locked(self):
+        floor = self._max_id_in_sheet()
+        if self.backend is not None:
+            # Carries on from the file when switching to a shared backend
+            floor = max(floor, self._read_state())
+        last_id = self._take(0, floor) - 1
+        self._reconciled = True
+        print(f"🔢 Request IDs reconciled; last issued ID is {last_id}")
+
+    def reconcile(self):
+        """Re-read the logs sheet and move the high-water mark past its largest ID."""
+        with self._lock:
+            self.logs_ws.invalidate()
+            self._reconcile_locked()
+
+    def next_id(self) -> int:
+        """Reserve and return the next request ID. Safe to call from any thread or process."""
+        return self.next_ids(1)[0]
+
+    def next_ids(self, count: int) -> list:
+        """Reserve `count` consecutive IDs with a single state write (for bulk imports)."""
+        if count <= 0:
+            return []
+        with self._lock:
+            if not self._reconciled:
+                self._reconcile_locked()
+
+            first = self._take(count)
+            # O(1) drift check against the cached Request ID index
+            if any(
+                self.logs_ws.find("Request ID", candidate)[0]
+                for candidate in range(first, first + count)
+            ):
+                print(f"⚠️ Request IDs from {first} already in the sheet; reconciling")
+                self.logs_ws.invalidate()
+                first = self._take(count, self._max_id_in_sheet())
+                self._reconciled = True
+            return list(range(first, first + count))
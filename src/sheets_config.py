@@ -1,35 +1,51 @@
-import os
-from dotenv import load_dotenv
-import gspread
-from google.oauth2.service_account import Credentials
-import pandas as pd
-import datetime
-
-load_dotenv()
-
-creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-if not creds_path:
-    raise RuntimeError(
-        "GOOGLE_APPLICATION_CREDENTIALS is not set. "
-        "Copy .env.example → .env and put the full path to your JSON key."
-    )
-
-creds = Credentials.from_service_account_file(
-    creds_path,
-    scopes=[
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ],
-)
-
-gc = gspread.authorize(creds)
-
-balance_wb = gc.open("StaffSync.AI - Leaves Balance")
-directory_wb = gc.open("StaffSync.AI - Employee Directory")
-logs_wb = gc.open("StaffSync.AI - Leaves Logs")
-
-balance_ws = balance_wb.sheet1
-directory_ws = directory_wb.sheet1
-logs_ws = logs_wb.sheet1
-
-print("Connected to Google Sheets successfully!")
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import open_tables
+
+_tables = None
+_connect_lock = threading.Lock()
+
+
+def connect():
+    """
+    Open the tables on first call (Google Sheets by default; set
+    STORAGE_BACKEND=sqlite for a local database, see src/storage/).
+    Later calls return the same tables.
+    """
+    global _tables
+    with _connect_lock:
+        if _tables is None:
+            balance, directory, logs = open_tables()
+            _tables = {"balance": balance, "directory": directory, "logs": logs}
+    return _tables
+
+
+class _LazyTable:
+    """Stands in for a table until the first access, so importing doesn't block on the network."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(connect()[self._name], attr)
+
+
+balance_ws = _LazyTable("balance")
+directory_ws = _LazyTable("directory")
+logs_ws = _LazyTable("logs")
+
+
+def warm_up():
+    """Connect and load all three tables in parallel (used at startup)."""
+    tables = connect()
+    with ThreadPoolExecutor(max_workers=len(tables)) as pool:
+        futures = [pool.submit(table.get_all_records) for table in tables.values()]
+        for future in futures:
+            future.result()  # Re-raise any load error
+
+
+def invalidate_sheet_caches():
+    """Force the next read of every table to go to the backing store."""
+    for ws in (balance_ws, directory_ws, logs_ws):
+        ws.invalidate()
@@ -0,0 +1,61 @@
+import threading
+from collections import Counter
+from typing import Callable, Dict, Hashable
+
+# Every group created, by name, so their counters can be reported together
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    """
+    Duplicate call suppression ("singleflight").
+
+    `do(key, func)` runs `func` unless a call with the same key is already in
+    flight, in which case it waits for that call and returns its result (or
+    raises its exception). N concurrent callers asking for the same thing cost
+    one call instead of N. Nothing is cached once the call completes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stats = Counter()
+        # Format: {key: {"done": Event, "result": ..., "error": ...}}
+        self._calls = {}
+        self._lock = threading.Lock()
+        _groups[name] = self
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {
+                    "done": threading.Event(),
+                    "result": None,
+                    "error": None,
+                }
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = func(*args, **kwargs)
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call["done"].set()
+
+
+def singleflight_stats() -> Dict[str, dict]:
+    """Per-group counters: `calls` actually made and `shared` (suppressed duplicates)."""
+    return {name: dict(group.stats) for name, group in _groups.items()}
@@ -0,0 +1,296 @@
+import argparse
+import datetime
+import json
+import os
+from typing import List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .leave_calendar import parse_date
+from .storage import BALANCE_COLUMNS, DIRECTORY_COLUMNS
+
+# Typed Arrow schemas for the three tables (same column names as the sheets)
+BALANCE_SCHEMA = pa.schema(
+    [("Employee ID", pa.string())]
+    + [(name, pa.float64()) for name in BALANCE_COLUMNS[1:]]
+)
+DIRECTORY_SCHEMA = pa.schema([(name, pa.string()) for name in DIRECTORY_COLUMNS])
+LOGS_SCHEMA = pa.schema(
+    [
+        ("Request ID", pa.int64()),
+        ("Employee ID", pa.string()),
+        ("Employee Name", pa.string()),
+        ("Leave Type", pa.string()),
+        ("Days", pa.float64()),
+        ("Start Date", pa.date32()),
+        ("End Date", pa.date32()),
+        ("Status", pa.string()),
+        ("Submitted At", pa.timestamp("s")),
+        ("Approved By", pa.string()),
+        ("Approval Date", pa.timestamp("s")),
+    ]
+)
+
+# Log columns that change after a request is first written
+_MUTABLE_LOG_COLUMNS = ["Status", "Approved By", "Approval Date"]
+
+
+def default_snapshot_dir() -> str:
+    from .data_dir import data_path
+
+    return os.getenv("SNAPSHOT_DIR") or data_path("snapshots")
+
+
+# Converting sheet values
+
+
+def _text(value) -> Optional[str]:
+    return None if value in ("", None) else str(value)
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _integer(value) -> Optional[int]:
+    number = _number(value)
+    return int(number) if number is not None else None
+
+
+def _timestamp(value) -> Optional[datetime.datetime]:
+    text = str(value or "").strip()
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    day = parse_date(text)
+    return datetime.datetime.combine(day, datetime.time()) if day else None
+
+
+_CONVERTERS = {
+    pa.string(): _text,
+    pa.float64(): _number,
+    pa.int64(): _integer,
+    pa.date32(): parse_date,
+    pa.timestamp("s"): _timestamp,
+}
+
+
+def to_arrow(records: Sequence[dict], schema: pa.Schema) -> pa.Table:
+    """Turn sheet records into a typed table; unreadable cells become nulls."""
+    columns = {}
+    for field in schema:
+        convert = _CONVERTERS[field.type]
+        columns[field.name] = pa.array(
+            [convert(record.get(field.name)) for record in records], type=field.type
+        )
+    return pa.table(columns, schema=schema)
+
+
+# Files
+
+
+def _write(table: pa.Table, path: str):
+    # Uncompressed Arrow IPC, so readers can memory-map it
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _read(path: str) -> pa.Table:
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _manifest_path(directory: str) -> str:
+    return os.path.join(directory, "manifest.json")
+
+
+def _read_manifest(directory: str) -> dict:
+    try:
+        with open(_manifest_path(directory), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"log_parts": [], "next_part": 1}
+
+
+def _write_manifest(directory: str, manifest: dict):
+    tmp_path = f"{_manifest_path(directory)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, _manifest_path(directory))
+
+
+# Export
+
+
+def load_logs(directory: Optional[str] = None) -> pa.Table:
+    """
+    All exported log rows, latest version of each request.
+
+    Log parts only ever get appended: a request whose status changed appears
+    again in a later part, so parts are read newest first and older copies
+    of a request are dropped.
+    """
+    directory = directory or default_snapshot_dir()
+    parts = _read_manifest(directory)["log_parts"]
+    seen = pa.array([], type=pa.int64())
+    tables = []
+    for part in reversed(parts):
+        table = _read(os.path.join(directory, part))
+        table = table.filter(pc.invert(pc.is_in(table["Request ID"], value_set=seen)))
+        seen = pa.concat_arrays([seen, table["Request ID"].combine_chunks()])
+        tables.append(table)
+    if not tables:
+        return LOGS_SCHEMA.empty_table()
+    return pa.concat_tables(reversed(tables))
+
+
+def _changed_logs(current: pa.Table, exported: pa.Table) -> pa.Table:
+    """Rows of `current` that are new or differ from their exported version."""
+    if exported.num_rows == 0:
+        return current
+    is_new = pc.invert(
+        pc.is_in(current["Request ID"], value_set=exported["Request ID"])
+    )
+    # Line the exported rows up with the current ones to compare the mutable columns
+    positions = pc.index_in(current["Request ID"], value_set=exported["Request ID"])
+    changed = is_new
+    for name in _MUTABLE_LOG_COLUMNS:
+        before = pc.take(exported[name], positions)
+        differs = pc.invert(pc.fill_null(pc.equal(current[name], before), False))
+        both_null = pc.and_(pc.is_null(current[name]), pc.is_null(before))
+        changed = pc.or_(changed, pc.and_(differs, pc.invert(both_null)))
+    return current.filter(pc.fill_null(changed, True))
+
+
+def export(tables: dict, directory: Optional[str] = None) -> dict:
+    """
+    Snapshot the three tables into `directory`.
+
+    Balances and the directory are small and rewritten each time. Logs are
+    written incrementally: each export appends one part file holding only
+    the requests that are new or whose status changed since the last one.
+
+    Args:
+        tables: {"balance": Table, "directory": Table, "logs": Table}
+
+    Returns:
+        dict: Rows written per table
+    """
+    directory = directory or default_snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+    manifest = _read_manifest(directory)
+
+    balance = to_arrow(tables["balance"].get_all_records(), BALANCE_SCHEMA)
+    _write(balance, os.path.join(directory, "balance.arrow"))
+    people = to_arrow(tables["directory"].get_all_records(), DIRECTORY_SCHEMA)
+    _write(people, os.path.join(directory, "directory.arrow"))
+
+    current = to_arrow(tables["logs"].get_all_records(), LOGS_SCHEMA)
+    current = current.filter(pc.is_valid(current["Request ID"]))
+    new_rows = _changed_logs(current, load_logs(directory))
+    if new_rows.num_rows:
+        part = f"logs-{manifest['next_part']:06d}.arrow"
+        _write(new_rows, os.path.join(directory, part))
+        manifest["log_parts"].append(part)
+        manifest["next_part"] += 1
+    manifest["exported_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+    _write_manifest(directory, manifest)
+
+    written = {
+        "balance": balance.num_rows,
+        "directory": people.num_rows,
+        "logs": new_rows.num_rows,
+    }
+    print(f"📦 Snapshot written to {directory}: {written}")
+    return written
+
+
+def compact_logs(directory: Optional[str] = None):
+    """Merge all log parts into one (e.g. after many small exports)."""
+    directory = directory or default_snapshot_dir()
+    manifest = _read_manifest(directory)
+    old_parts = manifest["log_parts"]
+    if len(old_parts) <= 1:
+        return
+    merged = load_logs(directory).sort_by("Request ID")
+    part = f"logs-{manifest['next_part']:06d}.arrow"
+    _write(merged, os.path.join(directory, part))
+    manifest["log_parts"] = [part]
+    manifest["next_part"] += 1
+    _write_manifest(directory, manifest)
+    for old in old_parts:
+        os.remove(os.path.join(directory, old))
+    print(f"📦 Compacted {len(old_parts)} log parts into {part}")
+
+
+# Queries
+
+
+def load_directory(directory: Optional[str] = None) -> pa.Table:
+    return _read(os.path.join(directory or default_snapshot_dir(), "directory.arrow"))
+
+
+def load_balances(directory: Optional[str] = None) -> pa.Table:
+    return _read(os.path.join(directory or default_snapshot_dir(), "balance.arrow"))
+
+
+def days_by_type_month_team(
+    directory: Optional[str] = None, statuses: Sequence[str] = ("Approved",)
+) -> pa.Table:
+    """
+    Days taken per team (lead), month (of the start date) and leave type.
+
+    Returns:
+        pa.Table: columns Lead, Month (YYYY-MM), Leave Type, Days, Requests
+    """
+    logs = load_logs(directory)
+    logs = logs.filter(pc.is_in(logs["Status"], value_set=pa.array(list(statuses))))
+    logs = logs.append_column(
+        "Month", pc.strftime(logs["Start Date"].cast(pa.timestamp("s")), "%Y-%m")
+    )
+    teams = load_directory(directory).select(["Employee ID", "Lead"])
+    joined = logs.join(teams, keys="Employee ID", join_type="left outer")
+    result = joined.group_by(["Lead", "Month", "Leave Type"]).aggregate(
+        [("Days", "sum"), ("Request ID", "count")]
+    )
+    result = result.rename_columns(["Lead", "Month", "Leave Type", "Days", "Requests"])
+    return result.sort_by([("Lead", "ascending"), ("Month", "ascending")])
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Columnar snapshots of the HR sheets")
+    parser.add_argument(
+        "--dir", help="Snapshot directory (default: SNAPSHOT_DIR or data/snapshots)"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("export", help="Snapshot the sheets (logs incrementally)")
+    commands.add_parser("compact", help="Merge log parts into one file")
+    report = commands.add_parser("report", help="Days by team, month and leave type")
+    report.add_argument(
+        "--status", action="append", help="Statuses to include (default: Approved)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        from .storage import open_tables
+
+        balance, people, logs = open_tables()
+        export({"balance": balance, "directory": people, "logs": logs}, args.dir)
+    elif args.command == "compact":
+        compact_logs(args.dir)
+    else:
+        table = days_by_type_month_team(args.dir, args.status or ("Approved",))
+        print(table.to_pandas().to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Failed components are retried with backoff between these delays (seconds)
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", 300))
+
+# Format: {name: {"func": callable, "status": str, "error": str | None,
+#                 "attempts": int, "started_at": float | None,
+#                 "ready_at": float | None, "event": threading.Event}}
+_components: Dict[str, Dict] = {}
+_lock = threading.Lock()
+_started = False
+
+
+class ComponentNotReady(RuntimeError):
+    """Raised when a component failed to start or didn't become ready in time."""
+
+
+def register(name: str, func: Callable[[], None]):
+    """
+    Register a startup step. Steps run in parallel once `start()` is called.
+
+    Args:
+        name: Component name used by `wait_for()` and `/readyz` (e.g. "sheets")
+        func: Callable that does the (blocking) initialisation
+    """
+    with _lock:
+        _components[name] = {
+            "func": func,
+            "status": "pending",
+            "error": None,
+            "attempts": 0,
+            "started_at": None,
+            "ready_at": None,
+            "event": threading.Event(),
+        }
+
+
+def _run(name: str):
+    """
+    Start a component, retrying with backoff until it succeeds, so a
+    transient Sheets or vector-store error doesn't leave it (and /readyz)
+    failed for the life of the process.
+    """
+    component = _components[name]
+    component["started_at"] = time.time()
+    while True:
+        component["attempts"] += 1
+        component["status"] = "starting"
+        try:
+            component["func"]()
+        except Exception as e:
+            component["status"] = "failed"
+            component["error"] = str(e)
+            delay = min(
+                RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (component["attempts"] - 1)
+            )
+            delay = random.uniform(delay / 2, delay)
+            print(f"❌ Startup: {name} failed: {e}; retrying in {delay:.0f}s")
+            # Wake waiters with the failure, then make them wait for the retry
+            component["event"].set()
+            time.sleep(delay)
+            component["event"].clear()
+            continue
+        component["status"] = "ready"
+        component["error"] = None
+        component["ready_at"] = time.time()
+        took = component["ready_at"] - component["started_at"]
+        print(f"✅ Startup: {name} ready in {took:.1f}s")
+        component["event"].set()
+        return
+
+
+def start():
+    """Kick off every registered step in its own background thread (once)."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+        names = list(_components)
+
+    print(f"🚀 Starting components in background: {', '.join(names)}")
+    for name in names:
+        threading.Thread(
+            target=_run, args=(name,), name=f"startup-{name}", daemon=True
+        ).start()
+
+
+def is_ready(name: str) -> bool:
+    """True if the component finished starting (unregistered names count as ready)."""
+    component = _components.get(name)
+    return component is None or component["status"] == "ready"
+
+
+def wait_for(name: str, timeout: Optional[float] = None):
+    """
+    Block until a component is ready.
+
+    Raises:
+        ComponentNotReady: if it failed, or is still starting after `timeout` seconds
+    """
+    component = _components.get(name)
+    if component is None:
+        return
+    if not component["event"].wait(timeout):
+        raise ComponentNotReady(f"{name} is still starting up")
+    if component["status"] != "ready":
+        raise ComponentNotReady(f"{name} failed to start: {component['error']}")
+
+
+def status() -> Dict:
+    """Per-component startup status, for /readyz."""
+    return {
+        name: {
+            "status": c["status"],
+            "error": c["error"],
+            "attempts": c["attempts"],
+            "startup_seconds": (
+                round(c["ready_at"] - c["started_at"], 2) if c["ready_at"] else None
+            ),
+        }
+        for name, c in _components.items()
+    }
+
+
+def all_ready() -> bool:
+    return all(c["status"] == "ready" for c in _components.values())
@@ -0,0 +1,38 @@
+import os
+
+from dotenv import load_dotenv
+
+from .base import Table, TABLES, BALANCE_COLUMNS, DIRECTORY_COLUMNS, LOGS_COLUMNS
+
+load_dotenv()
+
+
+def open_tables(backend: str = None):
+    """
+    Open the (balance, directory, logs) tables for the configured backend.
+
+    Args:
+        backend: "sheets" (Google Sheets, the default) or "sqlite"; defaults to
+            the STORAGE_BACKEND environment variable
+
+    Returns:
+        tuple: (balance, directory, logs) Table objects
+    """
+    backend = (backend or os.getenv("STORAGE_BACKEND") or "sheets").lower()
+
+    if backend == "sheets":
+        from .sheets import open_sheets_tables
+
+        return open_sheets_tables()
+
+    if backend == "sqlite":
+        from .sqlite import open_sqlite_tables
+        from ..data_dir import data_path
+
+        return open_sqlite_tables(
+            os.getenv("SQLITE_DATABASE") or data_path("staffsync.db")
+        )
+
+    raise RuntimeError(
+        f"Unknown STORAGE_BACKEND '{backend}'. Use 'sheets' or 'sqlite'."
+    )
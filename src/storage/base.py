@@ -0,0 +1,79 @@
+from abc import ABC, abstractmethod
+
+# Column layout of the three tables (same as the Google Sheets headers)
+BALANCE_COLUMNS = ["Employee ID", "Annual Leave", "Sick Leave", "Casual Leave"]
+DIRECTORY_COLUMNS = ["Employee ID", "Name", "Email", "Lead"]
+LOGS_COLUMNS = [
+    "Request ID",
+    "Employee ID",
+    "Employee Name",
+    "Leave Type",
+    "Days",
+    "Start Date",
+    "End Date",
+    "Status",
+    "Submitted At",
+    "Approved By",
+    "Approval Date",
+]
+
+# Format: {table name: (columns, indexed key column)}
+TABLES = {
+    "balance": (BALANCE_COLUMNS, "Employee ID"),
+    "directory": (DIRECTORY_COLUMNS, "Employee ID"),
+    "logs": (LOGS_COLUMNS, "Request ID"),
+}
+
+
+class Table(ABC):
+    """
+    One of the balances / directory / logs tables.
+
+    Mirrors the subset of the gspread worksheet API the tools use, plus
+    `find()` and `update_row()`. Rows are addressed by 1-based row numbers
+    where row 1 is the header, so row numbers from `find()` can be passed
+    straight to `update_cell()` / `update_row()` on any backend.
+    """
+
+    name: str
+
+    @abstractmethod
+    def get_all_records(self) -> list:
+        """Return every row as a dict keyed by header."""
+
+    @abstractmethod
+    def row_values(self, row: int) -> list:
+        """Return the values of one row (row 1 is the header)."""
+
+    @abstractmethod
+    def find(self, column: str, value):
+        """Return (row_number, record) for the first row whose `column` equals `value`, or (None, None)."""
+
+    @abstractmethod
+    def update_cell(self, row: int, col: int, value):
+        """Set one cell; `col` is the 1-based column number."""
+
+    @abstractmethod
+    def update_row(self, row: int, values: dict):
+        """Set several cells of one row, given as {header: value}, in one write."""
+
+    def update_rows(self, updates: dict):
+        """Apply {row number: {header: value}} updates; backends override this to do it in one write."""
+        for row, values in updates.items():
+            self.update_row(row, values)
+
+    @abstractmethod
+    def append_row(self, values, **kwargs):
+        """Append one row, given as a list in column order."""
+
+    def append_rows(self, rows, **kwargs):
+        """Append several rows; backends override this to do it in one write."""
+        for values in rows:
+            self.append_row(values, **kwargs)
+
+    def column_number(self, header: str) -> int:
+        """Return the 1-based column number for a header."""
+        return self.row_values(1).index(header) + 1
+
+    def invalidate(self):
+        """Drop any cached data. Backends without a cache ignore this."""
@@ -0,0 +1,180 @@
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import requests
+from gspread.exceptions import APIError
+
+from ..singleflight import SingleFlight
+
+# gspread worksheet methods that count against the read / write quota
+READ_METHODS = {"get_all_values", "get_all_records", "row_values", "col_values", "get"}
+WRITE_METHODS = {
+    "update_cell",
+    "update",
+    "batch_update",
+    "append_row",
+    "append_rows",
+}
+# Writes that add rows again if repeated; only retried when the call
+# definitely wasn't applied (a 429)
+APPEND_METHODS = {"append_row", "append_rows"}
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter.
+
+    Refills at `rate_per_minute` tokens per minute up to `burst` tokens.
+    `acquire()` takes a token, sleeping until one is available; callers are
+    served in arrival order because each one reserves its token up front.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = burst or max(1, int(rate_per_minute // 6))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token; returns how long (seconds) the caller had to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    if isinstance(error, APIError) and error.code == 429:
+        return True
+    if not idempotent:
+        # A 5xx or a dropped connection may come after the rows were added
+        return False
+    if isinstance(error, APIError):
+        return error.code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class QuotaAwareWorksheet:
+    """
+    Wraps a gspread worksheet so every API call respects the Sheets quotas.
+
+    Reads and writes each take a token from their (shared) bucket first, so
+    under peak load calls slow down instead of hitting the per-minute quota.
+    429 and 5xx responses (and dropped connections) are retried with
+    exponential backoff and full jitter; appends, which would add the rows
+    twice if the failed call had gone through, are retried on 429 only. Identical reads that are in flight at
+    the same time are coalesced into one API call (see src/singleflight.py).
+    Counters are kept in `stats` (shared across worksheets).
+    """
+
+    def __init__(
+        self,
+        worksheet,
+        name: str,
+        read_bucket: TokenBucket,
+        write_bucket: TokenBucket,
+        stats: Counter,
+        max_retries: int = 5,
+        base_backoff: float = 1.0,
+        max_backoff: float = 32.0,
+    ):
+        self.worksheet = worksheet
+        self.read_bucket = read_bucket
+        self.write_bucket = write_bucket
+        self.stats = stats
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # Identical concurrent reads share one API call
+        self._reads = SingleFlight(f"sheets-api:{name}")
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            self.stats.update(increments)
+
+    def _call_with_retries(self, kind: str, func, args, kwargs, idempotent=True):
+        bucket = self.read_bucket if kind == "read" else self.write_bucket
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            self._count(calls=1, **{f"{kind}s": 1})
+            if waited:
+                self._count(throttled=1, throttle_wait_seconds=waited)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if not _is_retryable(e, idempotent) or attempt >= self.max_retries:
+                    self._count(failures=1)
+                    raise
+                if isinstance(e, APIError) and e.code == 429:
+                    self._count(quota_errors=1)
+                attempt += 1
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.base_backoff * 2**attempt)
+                )
+                self._count(retries=1)
+                print(
+                    f"⏳ Sheets {kind} failed ({e}); retry {attempt}/{self.max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+
+    def _coalesced_read(self, name: str, func, args, kwargs):
+        try:
+            key = (name, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return self._call_with_retries("read", func, args, kwargs)
+        return self._reads.do(key, self._call_with_retries, "read", func, args, kwargs)
+
+    def __getattr__(self, attr):
+        value = getattr(self.worksheet, attr)
+        if not callable(value):
+            return value
+        if attr in READ_METHODS:
+            return lambda *args, **kwargs: self._coalesced_read(
+                attr, value, args, kwargs
+            )
+        if attr in WRITE_METHODS:
+            return lambda *args, **kwargs: self._call_with_retries(
+                "write", value, args, kwargs, idempotent=attr not in APPEND_METHODS
+            )
+        return value
+
+
+# One set of buckets and counters for the whole process: the Sheets quota is
+# per project / user, not per spreadsheet.
+_stats = Counter()
+_read_bucket = TokenBucket(float(os.getenv("SHEETS_READS_PER_MINUTE", 60)))
+_write_bucket = TokenBucket(float(os.getenv("SHEETS_WRITES_PER_MINUTE", 60)))
+
+
+def quota_aware(worksheet, name: str) -> QuotaAwareWorksheet:
+    """Wrap a worksheet with the process-wide rate limits and retry policy."""
+    return QuotaAwareWorksheet(
+        worksheet,
+        name,
+        _read_bucket,
+        _write_bucket,
+        _stats,
+        max_retries=int(os.getenv("SHEETS_MAX_RETRIES", 5)),
+    )
+
+
+def quota_stats() -> dict:
+    """Counters for Sheets API calls, throttling and retries."""
+    stats = dict(_stats)
+    if "throttle_wait_seconds" in stats:
+        stats["throttle_wait_seconds"] = round(stats["throttle_wait_seconds"], 2)
+    return stats
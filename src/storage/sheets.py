@@ -0,0 +1,321 @@
+import os
+import threading
+import time
+
+import gspread
+from google.oauth2.service_account import Credentials
+from gspread.utils import numericise_all, rowcol_to_a1
+
+from .base import Table, TABLES
+from .quota import quota_aware
+from ..singleflight import SingleFlight
+
+# Spreadsheet names per table; the first worksheet of each is used
+SPREADSHEETS = {
+    "balance": "StaffSync.AI - Leaves Balance",
+    "directory": "StaffSync.AI - Employee Directory",
+    "logs": "StaffSync.AI - Leaves Logs",
+}
+
+# Cache TTL (seconds) for sheets without a default of their own
+DEFAULT_TTL = 60
+# Per-sheet default TTLs; the directory changes rarely
+DEFAULT_TTLS = {"directory": 300}
+
+
+def ttl_from_env(name: str) -> float:
+    """
+    A sheet's cache TTL (seconds): `SHEETS_CACHE_TTL_<NAME>` if set, else the
+    sheet's own default (DEFAULT_TTLS), else `SHEETS_CACHE_TTL` (default 60).
+    The global setting doesn't override a sheet's own default.
+    """
+    value = os.getenv(f"SHEETS_CACHE_TTL_{name.upper()}")
+    if value:
+        return float(value)
+    if name in DEFAULT_TTLS:
+        return DEFAULT_TTLS[name]
+    return float(os.getenv("SHEETS_CACHE_TTL") or DEFAULT_TTL)
+
+
+class CachedWorksheet(Table):
+    """
+    Write-through cache around a gspread worksheet.
+
+    `get_all_records()` and `row_values(1)` are served from memory for `ttl`
+    seconds; `update_cell` and `append_row` go straight to the sheet and then
+    patch the cached copy, so reads after a write never need a re-download.
+    A ttl of 0 disables caching. Call `invalidate()` to force the next read to
+    hit the sheet (e.g. after someone edits the sheet by hand).
+
+    Each column in `index_columns` gets a hash index from cell value to sheet
+    row number, rebuilt on refresh and kept up to date on writes, so `find()`
+    is O(1) instead of a scan over `get_all_records()`.
+    """
+
+    def __init__(self, worksheet, name: str, ttl: float = 60, index_columns=()):
+        self.worksheet = worksheet
+        self.name = name
+        self.ttl = ttl
+        self.index_columns = tuple(index_columns)
+        self._lock = threading.RLock()
+        # Concurrent cache misses share one download instead of each fetching
+        self._refreshes = SingleFlight(f"sheet-cache:{name}")
+        self._records = None
+        self._headers = None
+        self._loaded_at = 0.0
+        # Format: {column: {str(cell value): position in self._records}}
+        self._indexes = {}
+        # Bumped on invalidate() so an in-flight refresh can't resurrect stale data
+        self._generation = 0
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._records is not None
+            and self.ttl > 0
+            and time.monotonic() - self._loaded_at < self.ttl
+        )
+
+    def _download(self):
+        # One download gives us both the header row and the records
+        values = self.worksheet.get_all_values()
+        headers = values[0] if values else []
+        records = [dict(zip(headers, numericise_all(row))) for row in values[1:]]
+        return headers, records
+
+    def _store(self, headers, records):
+        # Call with self._lock held
+        self._records = records
+        self._headers = headers
+        self._indexes = {
+            column: self._build_index(records, column) for column in self.index_columns
+        }
+        self._loaded_at = time.monotonic()
+
+    def _refresh(self):
+        self._refreshes.do("refresh", self._load)
+
+    def _load(self):
+        # Another flight may have refreshed between our miss and this call
+        if self._is_fresh():
+            return
+        with self._lock:
+            generation = self._generation
+        headers, records = self._download()
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._store(headers, records)
+        print(f"📥 Loaded {len(records)} rows from '{self.name}' sheet")
+
+    def _ensure_loaded(self):
+        # Call with self._lock held. Only loads here if invalidate() raced a
+        # refresh, which is rare enough that blocking writers is fine.
+        if self._records is None:
+            self._store(*self._download())
+
+    @staticmethod
+    def _build_index(records, column):
+        index = {}
+        for position, record in enumerate(records):
+            # First match wins, same as a linear scan would
+            index.setdefault(str(record.get(column, "")), position)
+        return index
+
+    def find(self, column: str, value):
+        """
+        Look up a row by the value in an indexed column.
+
+        Args:
+            column: Header of the column to search (e.g. "Employee ID")
+            value: Value to match; compared as a string
+
+        Returns:
+            tuple: (row_number, record) where row_number is the 1-based sheet
+            row, or (None, None) if no row matches
+        """
+        if not self._is_fresh():
+            self._refresh()
+        with self._lock:
+            self._ensure_loaded()
+            index = self._indexes.get(column)
+            if index is None:
+                index = self._indexes[column] = self._build_index(self._records, column)
+            position = index.get(str(value))
+            if position is None:
+                return None, None
+            return position + 2, dict(self._records[position])
+
+    def get_all_records(self):
+        """Return all rows as a list of dicts (copies, safe to mutate)."""
+        if not self._is_fresh():
+            self._refresh()
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(record) for record in self._records]
+
+    def row_values(self, row: int):
+        """Return a row's values; the header row is served from the cache."""
+        if row != 1:
+            return self.worksheet.row_values(row)
+        if not self._is_fresh():
+            self._refresh()
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._headers)
+
+    def _mirror_cell(self, row: int, column: str, value) -> bool:
+        # Call with self._lock held. Returns False if the row isn't cached.
+        index = row - 2  # Header row + 1-based rows
+        if not 0 <= index < len(self._records):
+            return False
+        record = self._records[index]
+        column_index = self._indexes.get(column)
+        if column_index is not None:
+            if column_index.get(str(record.get(column, ""))) == index:
+                del column_index[str(record.get(column, ""))]
+            column_index.setdefault(str(value), index)
+        record[column] = value
+        return True
+
+    def update_cell(self, row: int, col: int, value):
+        """Write a single cell to the sheet and mirror it in the cache."""
+        result = self.worksheet.update_cell(row, col, value)
+        with self._lock:
+            if self._records is not None and self._headers:
+                if col > len(self._headers) or not self._mirror_cell(
+                    row, self._headers[col - 1], value
+                ):
+                    self.invalidate()  # Outside what we know about
+        return result
+
+    def update_row(self, row: int, values: dict):
+        """
+        Write several cells of one row in a single API call.
+
+        Args:
+            row: 1-based sheet row number (e.g. from `find()`)
+            values: {header: new value} for each cell to change
+
+        Returns:
+            The gspread batch_update response
+        """
+        return self.update_rows({row: values})
+
+    def update_rows(self, updates: dict):
+        """
+        Write cells across many rows in a single API call.
+
+        Args:
+            updates: {row number: {header: new value}}
+
+        Returns:
+            The gspread batch_update response
+        """
+        data = [
+            {
+                "range": rowcol_to_a1(row, self.column_number(header)),
+                "values": [[value]],
+            }
+            for row, values in updates.items()
+            for header, value in values.items()
+        ]
+        if not data:
+            return None
+        # raw=False matches update_cell, which parses values as if typed in
+        result = self.worksheet.batch_update(data, raw=False)
+        with self._lock:
+            if self._records is not None:
+                for row, values in updates.items():
+                    for header, value in values.items():
+                        if not self._mirror_cell(row, header, value):
+                            self.invalidate()
+                            return result
+        return result
+
+    def append_row(self, values, **kwargs):
+        """Append a row to the sheet and mirror it in the cache."""
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, rows, **kwargs):
+        """Append several rows in a single API call and mirror them in the cache."""
+        rows = [list(values) for values in rows]
+        if len(rows) == 1:
+            result = self.worksheet.append_row(rows[0], **kwargs)
+        else:
+            result = self.worksheet.append_rows(rows, **kwargs)
+        with self._lock:
+            if self._records is not None and self._headers:
+                for values in rows:
+                    record = {header: "" for header in self._headers}
+                    record.update(zip(self._headers, values))
+                    self._records.append(record)
+                    for column, column_index in self._indexes.items():
+                        column_index.setdefault(
+                            str(record.get(column, "")), len(self._records) - 1
+                        )
+        return result
+
+    def invalidate(self):
+        """Drop the cached copy; the next read downloads the sheet again."""
+        with self._lock:
+            self._records = None
+            self._headers = None
+            self._indexes = {}
+            self._loaded_at = 0.0
+            self._generation += 1
+
+    def __getattr__(self, attr):
+        # Anything we don't cache (batch_update, etc.) goes to the worksheet
+        # directly; drop the cache since we can't know what it changed.
+        value = getattr(self.worksheet, attr)
+        if callable(value):
+
+            def passthrough(*args, **kwargs):
+                try:
+                    return value(*args, **kwargs)
+                finally:
+                    self.invalidate()
+
+            return passthrough
+        return value
+
+
+def open_sheets_tables():
+    """
+    Connect to Google Sheets and return cached (balance, directory, logs) tables.
+    """
+    creds_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+    if not creds_path:
+        raise RuntimeError(
+            "GOOGLE_APPLICATION_CREDENTIALS is not set. "
+            "Copy .env.example → .env and put the full path to your JSON key."
+        )
+
+    creds = Credentials.from_service_account_file(
+        creds_path,
+        scopes=[
+            "https://www.googleapis.com/auth/spreadsheets",
+            "https://www.googleapis.com/auth/drive",
+        ],
+    )
+    gc = gspread.authorize(creds)
+
+    # Reads are cached per sheet (see SHEETS_CACHE_TTL* in .env.example); writes
+    # go through to Google Sheets and update the cached copy. Rows are indexed
+    # by their ID column so lookups don't scan the sheet. Underneath, every API
+    # call is rate limited and retried on quota errors (see quota.py).
+    tables = []
+    for name in ("balance", "directory", "logs"):
+        _, key_column = TABLES[name]
+        spreadsheet = SPREADSHEETS[name]
+        tables.append(
+            CachedWorksheet(
+                quota_aware(gc.open(spreadsheet).sheet1, name),
+                spreadsheet.split(" - ", 1)[1],
+                ttl=ttl_from_env(name),
+                index_columns=[key_column],
+            )
+        )
+
+    print("Connected to Google Sheets successfully!")
+    return tuple(tables)
@@ -0,0 +1,191 @@
+import argparse
+import csv
+import re
+import sqlite3
+import threading
+
+from .base import Table, TABLES
+
+_INT_RE = re.compile(r"^-?\d+$")
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _numericise(value):
+    # Key columns are stored as TEXT so lookups can use the index; hand back
+    # whole numbers as ints, the same way gspread's get_all_records() does.
+    if isinstance(value, str) and _INT_RE.match(value):
+        return int(value)
+    return value
+
+
+class SqliteTable(Table):
+    """
+    A table stored in a local SQLite database.
+
+    Each table has a hidden `_row` primary key, exposed as row number
+    `_row + 1` so that rows line up with sheet row numbers (row 1 being the
+    header). The key column is stored as TEXT with an index on it, so
+    `find()` is an index lookup. Every write runs in its own transaction.
+    """
+
+    def __init__(self, conn, lock, name: str, columns, key_column: str):
+        self.conn = conn
+        self.name = name
+        self.columns = list(columns)
+        self.key_column = key_column
+        self._lock = lock
+        self._table = _quote(name)
+
+        column_defs = ", ".join(
+            f"{_quote(c)} TEXT" if c == key_column else _quote(c) for c in self.columns
+        )
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                f"(_row INTEGER PRIMARY KEY, {column_defs})"
+            )
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{name}_key')} "
+                f"ON {self._table} ({_quote(key_column)})"
+            )
+
+    def _to_record(self, row) -> dict:
+        record = dict(zip(self.columns, row))
+        record[self.key_column] = _numericise(record[self.key_column])
+        return record
+
+    def _select(self) -> str:
+        return ", ".join(_quote(c) for c in self.columns)
+
+    def get_all_records(self):
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {self._select()} FROM {self._table} ORDER BY _row"
+            ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def row_values(self, row: int):
+        if row == 1:
+            return list(self.columns)
+        with self._lock:
+            values = self.conn.execute(
+                f"SELECT {self._select()} FROM {self._table} WHERE _row = ?",
+                (row - 1,),
+            ).fetchone()
+        return list(values) if values else []
+
+    def find(self, column: str, value):
+        if column not in self.columns:
+            raise KeyError(column)
+        # Only the key column is TEXT; compare others as text too, unindexed
+        target = (
+            _quote(column)
+            if column == self.key_column
+            else f"CAST({_quote(column)} AS TEXT)"
+        )
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT _row, {self._select()} FROM {self._table} "
+                f"WHERE {target} = ? ORDER BY _row LIMIT 1",
+                (str(value),),
+            ).fetchone()
+        if row is None:
+            return None, None
+        return row[0] + 1, self._to_record(row[1:])
+
+    def update_cell(self, row: int, col: int, value):
+        return self.update_row(row, {self.columns[col - 1]: value})
+
+    def update_row(self, row: int, values: dict):
+        return self.update_rows({row: values})
+
+    def update_rows(self, updates: dict):
+        """Apply {row number: {header: value}} updates in one transaction."""
+        with self._lock, self.conn:
+            for row, values in updates.items():
+                for header in values:
+                    if header not in self.columns:
+                        raise KeyError(header)
+                assignments = ", ".join(f"{_quote(h)} = ?" for h in values)
+                params = [
+                    str(v) if h == self.key_column else v for h, v in values.items()
+                ]
+                self.conn.execute(
+                    f"UPDATE {self._table} SET {assignments} WHERE _row = ?",
+                    (*params, row - 1),
+                )
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values])
+
+    def append_rows(self, rows, **kwargs):
+        """Append several rows in a single transaction."""
+        key_position = self.columns.index(self.key_column)
+        prepared = []
+        for values in rows:
+            values = list(values) + [""] * (len(self.columns) - len(values))
+            values[key_position] = str(values[key_position])
+            prepared.append(values[: len(self.columns)])
+        placeholders = ", ".join("?" for _ in self.columns)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO {self._table} ({self._select()}) "
+                f"VALUES ({placeholders})",
+                prepared,
+            )
+
+
+def open_sqlite_tables(path: str):
+    """
+    Open (creating if needed) the SQLite database at `path` and return
+    (balance, directory, logs) tables.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # One connection shared by all tables and threads, so one lock
+    lock = threading.RLock()
+    tables = tuple(
+        SqliteTable(conn, lock, name, *TABLES[name])
+        for name in ("balance", "directory", "logs")
+    )
+    print(f"Connected to SQLite database {path} successfully!")
+    return tables
+
+
+def import_csv(table: SqliteTable, csv_path: str) -> int:
+    """Append every row of a CSV export of a sheet (with its header row) to `table`."""
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = [[row.get(c, "") for c in table.columns] for row in reader]
+    rows = [[_numeric_or_text(v) for v in row] for row in rows]
+    table.append_rows(rows)
+    return len(rows)
+
+
+def _numeric_or_text(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+if __name__ == "__main__":
+    # Seed a local database from CSV exports of the three sheets, e.g.
+    # python -m src.storage.sqlite data/staffsync.db --balance balance.csv ...
+    parser = argparse.ArgumentParser(description="Seed the SQLite storage backend")
+    parser.add_argument("database")
+    for name in TABLES:
+        parser.add_argument(f"--{name}", help=f"CSV export of the {name} sheet")
+    args = parser.parse_args()
+
+    balance, directory, logs = open_sqlite_tables(args.database)
+    for name, table in (("balance", balance), ("directory", directory), ("logs", logs)):
+        csv_path = getattr(args, name)
+        if csv_path:
+            print(f"Imported {import_csv(table, csv_path)} rows into {name}")
@@ -1,18 +1,238 @@
 import datetime
 import os
 import json
+import threading
+import uuid
+from contextlib import nullcontext
 from .core.auth_middleware import authenticate_function_call, pending_function_calls
 from .core.auth import send_mail
+from .core.session_backends import (
+    SharedLock,
+    SharedVersion,
+    leadership,
+    shared_backend,
+)
 from .sheets_config import balance_ws, directory_ws, logs_ws
-from .constants import LEAVE_REQUEST_TEMPLATE, LEAVE_STATUS_EMAIL_TEMPLATE
-from .hr_policy_vault import (
-    search_policy,
-    load_policies,
-    get_or_create_policy_collection,
+from .data_dir import data_path
+from .request_ids import RequestIdAllocator
+from .journal import open_journal
+from .data_loader import find_record, request_scope
+from .leave_ledger import LeaveLedger
+from .leave_index import LeaveIndex
+from .leave_calendar import check_request
+from .availability import TeamAvailability, _team_key
+from .storage import LOGS_COLUMNS
+from .write_behind import WriteBehindQueue
+from . import startup
+from .lead_digest import LeadDigest
+from .constants import (
+    LEAD_DIGEST_ROW,
+    LEAD_DIGEST_TEMPLATE,
+    LEAVE_REQUEST_TEMPLATE,
+    LEAVE_STATUS_EMAIL_TEMPLATE,
+)
+
+# How long a tool call waits for a component that is still starting up
+STARTUP_WAIT_SECONDS = float(os.getenv("STARTUP_WAIT_SECONDS", 20))
+
+# Which startup component each tool needs (see src/startup.py)
+TOOL_COMPONENTS = {
+    "get_employee_balance": "sheets",
+    "add_leave_log": "sheets",
+    "get_team_availability": "sheets",
+    "file_search": "policies",
+}
+
+
+_policy_lock = threading.Lock()
+_policy_collection = None
+
+
+def policy_collection():
+    """
+    The ChromaDB policy collection, created on first use so that importing
+    the app never waits on (or fails in) the vector store.
+    """
+    global _policy_collection
+    with _policy_lock:
+        if _policy_collection is None:
+            from .hr_policy_vault import get_or_create_policy_collection
+
+            _policy_collection = get_or_create_policy_collection()
+        return _policy_collection
+
+
+def init_policies():
+    """Chunk and embed the policy files into ChromaDB (startup step)."""
+    from .hr_policy_vault import load_policies
+
+    load_policies(policy_collection())
+
+
+# With SESSION_BACKEND set to sqlite or redis, the journals, Request IDs and
+# change notices below are shared by every app process, and background jobs
+# run in the leader only (see Leadership in src/core/session_backends.py)
+_backend = shared_backend()
+
+request_id_allocator = RequestIdAllocator(
+    logs_ws, data_path("request_id_state.json"), backend=_backend
+)
+
+# Held from claiming a new request's dates until its row is queued, so
+# requests handled by different processes can't both pass the checks
+leave_request_lock = (
+    SharedLock(_backend, "leave_requests") if _backend else nullcontext()
+)
+
+
+def send_lead_notification(lead, requests):
+    """
+    Email a lead about one or more new leave requests.
+
+    A single request gets the usual one-request email (reply Y / N); several
+    are listed in one digest that the lead can answer with e.g. "Y 12,14 / N 13".
+    """
+    if len(requests) == 1:
+        notify = requests[0]
+        request_id = notify["request_id"]
+        subject = f"New Leave Request #{request_id}"
+        email_body = LEAVE_REQUEST_TEMPLATE.format(
+            employee_name=notify["employee_name"],
+            request_id=request_id,
+            leave_type=notify["leave_type"],
+            days=notify["days"],
+            start_date=notify["start_date"],
+            end_date=notify["end_date"],
+            submitted_at=notify["submitted_at"],
+        )
+    else:
+        request_ids = [notify["request_id"] for notify in requests]
+        subject = "New Leave Requests " + ", ".join(f"#{r}" for r in request_ids)
+        email_body = LEAD_DIGEST_TEMPLATE.format(
+            count=len(requests),
+            rows="\n".join(LEAD_DIGEST_ROW.format(**notify) for notify in requests),
+            example_ids=",".join(str(r) for r in request_ids[:-1]),
+            example_id=request_ids[-1],
+        )
+
+    email_sent = send_mail(
+        lead,
+        subject,
+        email_body,
+        f"StaffSync.AI - {subject}",
+        otp=False,
+    )
+    if email_sent:
+        print(f"✅ Email queued to LEAD: {lead} for {subject}")
+    else:
+        print(f"⚠️ Failed to queue email to {lead} for {subject}")
+
+
+# With LEAD_DIGEST_WINDOW_SECONDS set, requests to the same lead within that
+# window are combined into one email (see src/lead_digest.py)
+LEAD_DIGEST_WINDOW_SECONDS = float(os.getenv("LEAD_DIGEST_WINDOW_SECONDS", 0))
+lead_digest = (
+    LeadDigest(
+        open_journal("lead_digest"),
+        send_lead_notification,
+        window=LEAD_DIGEST_WINDOW_SECONDS,
+        leader=leadership,
+    )
+    if LEAD_DIGEST_WINDOW_SECONDS > 0
+    else None
 )
 
-hr_docs = get_or_create_policy_collection()
-load_policies(hr_docs)
+
+def notify_lead_of_request(entry):
+    """Email the lead about a new leave request once its log row has been written."""
+    notify = entry.get("notify")
+    if not notify:
+        return
+    if lead_digest:
+        lead_digest.add(notify["lead"], notify)
+    else:
+        send_lead_notification(notify["lead"], [notify])
+
+
+def drop_rejected_request(entry, error):
+    """Free what a request held once the logs table has refused its row."""
+    request_id = entry["row"][0]
+    leave_ledger.release(request_id)
+    leave_index.remove(request_id)
+    team_availability.set_status(request_id, "Rejected")
+
+
+# New log rows are journaled locally and appended to the logs table in
+# batches by a background worker (see src/write_behind.py); rows the table
+# rejects are set aside in logs_dead_letter.jsonl
+log_writer = WriteBehindQueue(
+    "logs",
+    logs_ws,
+    open_journal("logs_write_behind"),
+    key_column="Request ID",
+    on_flushed=notify_lead_of_request,
+    dead_letters=open_journal("logs_dead_letter"),
+    on_dead_letter=drop_rejected_request,
+    batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 100)),
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", 1.0)),
+    leader=leadership,
+)
+
+
+def queued_logs():
+    """Log records still waiting in the write-behind queue."""
+    for _, entry in log_writer.journal.pending():
+        yield dict(zip(LOGS_COLUMNS, entry["row"]))
+
+
+def pending_leave_requests(fresh=False):
+    """
+    (request_id, employee_id, leave_type, days) for every request awaiting a
+    decision.
+
+    Args:
+        fresh: Re-read the logs rather than use the cached copy
+    """
+    # Queued rows first: one flushed in between is then in the table
+    queued = list(queued_logs())
+    if fresh:
+        logs_ws.invalidate()
+    seen = set()
+    for log in logs_ws.get_all_records():
+        seen.add(str(log["Request ID"]))
+        if str(log.get("Status", "")).lower() == "pending":
+            yield log["Request ID"], log["Employee ID"], log["Leave Type"], log["Days"]
+    for log in queued:
+        if str(log["Request ID"]) not in seen and log["Status"].lower() == "pending":
+            yield log["Request ID"], log["Employee ID"], log["Leave Type"], log["Days"]
+
+
+# Balances are read from and debited in the ledger, and folded back into the
+# Leaves Balance sheet every LEDGER_COMPACT_SECONDS (see src/leave_ledger.py)
+leave_ledger = LeaveLedger(
+    balance_ws,
+    open_journal("leave_ledger"),
+    pending_requests=pending_leave_requests,
+    backend=_backend,
+)
+
+# Pending and approved leave by employee and by lead, for overlap and
+# team-conflict checks (see src/leave_index.py)
+leave_index = LeaveIndex(
+    logs_ws,
+    directory_ws,
+    extra_logs=queued_logs,
+    team_max_concurrent=int(os.getenv("TEAM_MAX_CONCURRENT_LEAVE", 0)),
+    changes=SharedVersion(_backend, "leave_index") if _backend else None,
+)
+
+# Who is off, by lead and by day (see src/availability.py)
+team_availability = TeamAvailability(
+    logs_ws,
+    directory_ws,
+    extra_logs=queued_logs,
+    changes=SharedVersion(_backend, "team_availability") if _backend else None,
+)
 
 
 def get_employee_balance(employee_id):
@@ -26,20 +246,25 @@ def get_employee_balance(employee_id):
         dict: Employee's leave balances or None if employee not found
     """
     print("Called get_employee_balance with employee_id:", employee_id)
-    balance_data = balance_ws.get_all_records()
-    print("Fetched balance data:", balance_data)
-    for record in balance_data:
-        if str(record["Employee ID"]) == str(employee_id):
-            return {
-                "Annual Leave": record["Annual Leave"],
-                "Sick Leave": record["Sick Leave"],
-                "Casual Leave": record["Casual Leave"],
-                "Message": "You currently have {} Annual Leave(s), {} Sick Leave(s), and {} Casual Leave(s).".format(
-                    record["Annual Leave"],
-                    record["Sick Leave"],
-                    record["Casual Leave"],
-                ),
-            }
+    record = leave_ledger.balances(employee_id)
+    print("Fetched balance record:", record)
+    if record:
+        message = "You currently have {} Annual Leave(s), {} Sick Leave(s), and {} Casual Leave(s).".format(
+            record["Annual Leave"],
+            record["Sick Leave"],
+            record["Casual Leave"],
+        )
+        held = {t: d for t, d in leave_ledger.reserved(employee_id).items() if d}
+        if held:
+            message += " Pending requests are holding {}.".format(
+                ", ".join(f"{d} {t}" for t, d in held.items())
+            )
+        return {
+            "Annual Leave": record["Annual Leave"],
+            "Sick Leave": record["Sick Leave"],
+            "Casual Leave": record["Casual Leave"],
+            "Message": message,
+        }
 
     return None  # Employee not found
 
@@ -54,15 +279,15 @@ def get_employee_info(employee_id):
     Returns:
         dict: Employee's information or None if employee not found
     """
-    directory_data = directory_ws.get_all_records()
-
-    for record in directory_data:
-        if str(record["Employee ID"]) == str(employee_id):
-            return {
-                "name": record["Name"],
-                "email": record["Email"],
-                "lead": record["Lead"],
-            }
+    _, record = find_record("directory", employee_id)
+    if record:
+        return {
+            "name": record["Name"],
+            "email": record["Email"],
+            "lead": record["Lead"],
+            # Optional directory column picking the holiday calendar
+            "region": record.get("Region", ""),
+        }
 
     return None  # Employee not found
 
@@ -85,6 +310,40 @@ def get_employee_logs(employee_id=None):
         return logs_data
 
 
+def get_team_availability(employee_id, start_date, end_date):
+    """
+    List who on an employee's team is off between two dates.
+
+    Args:
+        employee_id: The employee's ID (a lead sees the people reporting to them)
+        start_date: First day to check (YYYY-MM-DD)
+        end_date: Last day to check (YYYY-MM-DD)
+
+    Returns:
+        dict: Message for the user, plus the per-day absences
+    """
+    lead = team_availability.team_lead_for(employee_id)
+    if not lead:
+        return {"Message": f"I couldn't find a team for employee ID {employee_id}."}
+    try:
+        view = team_availability.who_is_off(lead, start_date, end_date)
+    except ValueError as e:
+        return {"Message": str(e)}
+
+    if not view["days"]:
+        return {
+            "Message": f"Nobody on your team has leave booked between {start_date} and {end_date}.",
+            "Days": {},
+        }
+    lines = [f"Team absences between {start_date} and {end_date}:"]
+    for day, absences in view["days"].items():
+        people = ", ".join(
+            f"{a['name']} ({a['leave_type']}, {a['status'].lower()})" for a in absences
+        )
+        lines.append(f"- {day}: {people}")
+    return {"Message": "\n".join(lines), "Days": view["days"]}
+
+
 def update_leave_balance(employee_id, leave_type, days_change):
     """
     Update an employee's leave balance.
@@ -97,29 +356,9 @@ def update_leave_balance(employee_id, leave_type, days_change):
     Returns:
         bool: True if successful, False if employee not found
     """
-    # Find the employee row
-    all_balances = balance_ws.get_all_records()
-    employee_row = None
-
-    for i, record in enumerate(all_balances):
-        if str(record["Employee ID"]) == str(employee_id):
-            # Add 2 for header row and zero-indexing
-            employee_row = i + 2
-            current_balance = record[leave_type]
-            break
-
-    if not employee_row:
+    # Recorded in the leave ledger; written to the sheet on the next compaction
+    if not leave_ledger.apply(employee_id, leave_type, days_change):
         return "Employee Not Found"  # Employee not found
-
-    # Update the balance
-    new_balance = current_balance + days_change
-
-    # Find the column index
-    headers = balance_ws.row_values(1)
-    col_index = headers.index(leave_type) + 1
-
-    # Update the cell
-    balance_ws.update_cell(employee_row, col_index, new_balance)
     return "Leave balance updated successfully"
 
 
@@ -138,83 +377,190 @@ def add_leave_log(
         status: Status of the request (default "Pending")
 
     Returns:
-        int: The new request ID
+        dict: Message for the user, including the new request ID
     """
 
-    leaves_balance = get_employee_balance(employee_id)
-    if not leaves_balance:
+    # Balance minus days already held by other pending requests
+    available = leave_ledger.available(employee_id, leave_type)
+    if available is None:
         print(f"Employee ID {employee_id} not found or has no leave balance.")
         return {
             "Message": f"Employee ID {employee_id} not found or has no leave balance."
         }
 
-    if leaves_balance[leave_type] < days:
+    if available < days:
         print(
-            f"Insufficient {leave_type} balance for employee ID {employee_id}. Available: {leaves_balance[leave_type]}, Requested: {days}."
+            f"Insufficient {leave_type} balance for employee ID {employee_id}. Available: {available}, Requested: {days}."
         )
         return {
-            "Message": f"Insufficient {leave_type} balance for employee ID {employee_id}. Available: {leaves_balance[leave_type]}, Requested: {days}."
+            "Message": f"Insufficient {leave_type} balance for employee ID {employee_id}. Available: {available}, Requested: {days}."
         }
 
     employee_info = get_employee_info(employee_id)
     employee_name = employee_info["name"]
-    # Generate a new request ID
-    logs_data = logs_ws.get_all_records()
-    if logs_data:
-        new_request_id = max([int(log.get("Request ID", 0)) for log in logs_data]) + 1
-    else:
-        new_request_id = 1
-
-    # Create the new log entry
-    submitted_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    new_row = [
-        new_request_id,
-        employee_id,
-        employee_name,
-        leave_type,
-        days,
-        start_date,
-        end_date,
-        status,
-        submitted_at,
-        "",  # Approved By (empty for new requests)
-        "",  # Approval Date (empty for new requests)
-    ]
-
-    # Append to the sheet
-    logs_ws.append_row(new_row)
-
-    email_body = LEAVE_REQUEST_TEMPLATE.format(
-        employee_name=employee_name,
-        request_id=new_request_id,
-        leave_type=leave_type,
-        days=days,
-        start_date=start_date,
-        end_date=end_date,
-        submitted_at=submitted_at,
-    )
 
-    email_sent = send_mail(
-        employee_info["lead"],
-        f"New Leave Request #{new_request_id}",
-        email_body,
-        f"StaffSync.AI - New Leave Request #{new_request_id}",
-        otp=False,
-    )
+    # Days must match the working days in the range for the employee's region
+    problem = check_request(start_date, end_date, days, employee_info["region"])
+    if problem:
+        return {"Message": problem}
+
+    # Only one process at a time gets from claiming dates to queuing the row
+    with leave_request_lock:
+        # Reject overlapping leave and enforce the team limit; on success the
+        # request is indexed straight away (under a placeholder ID) so a
+        # concurrent request sees it
+        claim_id = f"claim:{uuid.uuid4().hex}"
+        claimed, conflicts = leave_index.claim(
+            claim_id, employee_id, employee_info["lead"], start_date, end_date
+        )
+        if conflicts["overlaps"]:
+            overlapping = ", ".join(f"#{r}" for r in conflicts["overlaps"])
+            return {
+                "Message": f"You already have leave booked that overlaps {start_date} to {end_date} (request {overlapping})."
+            }
+        if not claimed:
+            return {
+                "Message": f"Too many of your teammates are already off between {start_date} and {end_date} (limit {leave_index.team_max_concurrent}). Please choose other dates or talk to your lead."
+            }
 
-    if email_sent:
-        print(
-            f"✅ Email sent to LEAD: {employee_info['lead']} for new leave request #{new_request_id}"
+        # Hold the days until the lead decides (re-checked atomically)
+        if status == "Pending" and not leave_ledger.reserve(
+            claim_id, employee_id, leave_type, days
+        ):
+            leave_index.remove(claim_id)
+            return {
+                "Message": f"Insufficient {leave_type} balance for employee ID {employee_id}. Another request was just submitted; please check your balance and try again."
+            }
+
+        # Only now take a request ID, so rejected requests leave no gaps
+        try:
+            new_request_id = request_id_allocator.next_id()
+        except Exception:
+            leave_ledger.release(claim_id)
+            leave_index.remove(claim_id)
+            raise
+
+        # Create the new log entry
+        submitted_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        new_row = [
+            new_request_id,
+            employee_id,
+            employee_name,
+            leave_type,
+            days,
+            start_date,
+            end_date,
+            status,
+            submitted_at,
+            "",  # Approved By (empty for new requests)
+            "",  # Approval Date (empty for new requests)
+        ]
+
+        # Queue the row; it is appended in the background and the lead is
+        # emailed once it's in the sheet
+        log_writer.submit(
+            new_row,
+            notify={
+                "lead": employee_info["lead"],
+                "employee_name": employee_name,
+                "request_id": new_request_id,
+                "leave_type": leave_type,
+                "days": days,
+                "start_date": start_date,
+                "end_date": end_date,
+                "submitted_at": submitted_at,
+            },
         )
-        return {
-            "Message": f"I have added your leave request, and an email has been sent to your lead."
-        }
-    else:
-        print(f"⚠️ Failed to send email for new leave request #{new_request_id}")
-        return {
-            "Message": f"{new_request_id} - I have added your leave request successfully, but email notification failed."
-        }
+        # Re-keyed only once the row is queued, so a reload in between keeps
+        # the placeholder or finds the queued row
+        leave_ledger.rename(claim_id, new_request_id)
+        leave_index.rename(claim_id, new_request_id)
+        team_availability.add(
+            new_request_id,
+            employee_id,
+            employee_name,
+            employee_info["lead"],
+            leave_type,
+            start_date,
+            end_date,
+            status,
+        )
+    print(f"📝 Queued leave request #{new_request_id} for employee {employee_id}")
+
+    message = f"I have added your leave request (#{new_request_id}), and your lead will be notified by email."
+    if conflicts["teammates"]:
+        names = []
+        for teammate_id in conflicts["teammates"]:
+            teammate = get_employee_info(teammate_id)
+            names.append(teammate["name"] if teammate else teammate_id)
+        message += (
+            f" Note: {', '.join(names)} will also be off during some of these days."
+        )
+    return {"Message": message}
+
+
+def update_leave_log_statuses(
+    decisions, approved_by=None, only_pending=False, from_lead=None
+):
+    """
+    Approve or reject several leave requests with one write to the logs sheet.
+
+    Args:
+        decisions: {request_id: new status ("Approved", "Rejected", etc.)}
+        approved_by: Name of the person who approved/rejected
+        only_pending: Leave requests that were already decided alone (for
+            digest replies, where "Y" covers every request in the digest)
+        from_lead: If given (e.g. the sender of an email reply), only decide
+            requests from employees whose lead this is
+
+    Returns:
+        dict: {request_id: True if updated and the employee notified, False
+        if not (e.g. request not found, or already in that status)}
+    """
+    results, found, log_updates = {}, {}, {}
+    if _backend:
+        # Another process may have decided these since our copy was read
+        logs_ws.invalidate()
+    approval_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for request_id, new_status in decisions.items():
+        row_num, log = logs_ws.find("Request ID", request_id)
+        if not row_num:
+            results[request_id] = False  # Request not found
+            continue
+        old_status = str(log.get("Status", ""))
+        if old_status.lower() == new_status.lower():
+            # e.g. a second "Y" reply; nothing to write, debit or email
+            print(f"ℹ️ Request {request_id} is already {old_status}; skipping")
+            results[request_id] = False
+            continue
+        if only_pending and old_status.lower() != "pending":
+            print(f"ℹ️ Request {request_id} was already {old_status}; skipping")
+            results[request_id] = False
+            continue
+        if from_lead is not None:
+            employee_info = get_employee_info(log["Employee ID"])
+            lead = employee_info["lead"] if employee_info else ""
+            if _team_key(lead) != _team_key(from_lead):
+                print(
+                    f"⚠️ {from_lead} isn't the lead for request {request_id}; skipping"
+                )
+                results[request_id] = False
+                continue
+        found[request_id] = (log, old_status)
+        # Status and approver info for every request go out as one batched write
+        log_updates[row_num] = {"Status": new_status}
+        if approved_by:
+            log_updates[row_num]["Approved By"] = approved_by
+            log_updates[row_num]["Approval Date"] = approval_date
+    if log_updates:
+        logs_ws.update_rows(log_updates)
+
+    for request_id, (log, old_status) in found.items():
+        results[request_id] = _apply_status_change(
+            request_id, log, old_status, decisions[request_id], approved_by
+        )
+    return results
 
 
 def update_leave_log_status(request_id, new_status, approved_by=None):
@@ -227,74 +573,86 @@ def update_leave_log_status(request_id, new_status, approved_by=None):
         approved_by: Name of the person who approved/rejected
 
     Returns:
-        bool: True if successful, False if request not found
+        bool: True if successful, False if request not found or unchanged
     """
-    logs_data = logs_ws.get_all_records()
+    return update_leave_log_statuses({request_id: new_status}, approved_by)[request_id]
+
+
+def _apply_status_change(request_id, log, old_status, new_status, approved_by):
+    """Ledger, index and availability updates plus the employee email, after the sheet write."""
+    employee_name = log["Employee Name"]
+    employee_id = log["Employee ID"]
+
+    if new_status.lower() == "approved":
+        # Turn the pending request's hold into a debit in the leave ledger
+        # (at most once per request)
+        leave_ledger.commit(request_id, employee_id, log["Leave Type"], log["Days"])
+        if request_id not in leave_index:
+            # e.g. a request rejected earlier and approved on second thought
+            employee_info = get_employee_info(employee_id)
+            lead = employee_info["lead"] if employee_info else ""
+            leave_index.add(
+                request_id, employee_id, lead, log["Start Date"], log["End Date"]
+            )
+            team_availability.add(
+                request_id,
+                employee_id,
+                employee_name,
+                lead,
+                log["Leave Type"],
+                log["Start Date"],
+                log["End Date"],
+                new_status,
+            )
+    else:
+        if old_status.lower() == "approved":
+            # Approved earlier, now reversed: credit the days back
+            leave_ledger.refund(request_id, employee_id, log["Leave Type"], log["Days"])
+        if new_status.lower() == "rejected":
+            # Free the held days (if still pending) and dates
+            leave_ledger.release(request_id)
+            leave_index.remove(request_id)
+    team_availability.set_status(request_id, new_status)
+    print(f"✅ Request {request_id} updated to {new_status}")
 
-    # Find the request
-    for i, log in enumerate(logs_data):
-        if int(log["Request ID"]) == int(request_id):
-            row_num = i + 2  # Adjust for header and zero-indexing
-
-            employee_name = log["Employee Name"]
-            employee_id = log["Employee ID"]
-            # Update status
-            logs_ws.update_cell(row_num, 8, new_status)
-
-            # Update approver info if provided
-            if approved_by:
-                logs_ws.update_cell(row_num, 10, approved_by)  # Approved By
-                approval_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                logs_ws.update_cell(row_num, 11, approval_date)  # Approval Date
-
-            if new_status.lower() == "approved":
-                # Update leave balance
-                leave_type = log["Leave Type"]
-                days = log["Days"]
-                update_leave_balance(employee_id, leave_type, -days)
-            elif new_status.lower() == "rejected":
-                # No balance update needed for rejection
-                pass
-            print(f"✅ Request {request_id} updated to {new_status}")
-
-            try:
-                email_body = LEAVE_STATUS_EMAIL_TEMPLATE.format(
-                    employee_name=employee_name,
-                    request_id=request_id,
-                    new_status=new_status.lower(),
-                    approved_by=approved_by,
-                )
-                employee_info = get_employee_info(employee_id)
-
-                to_addr = employee_info["email"]  # ← match the real key
-                subject = f"Leave status {new_status} - Request #{request_id}"
-                # Send email notification
-                email_sent = send_mail(
-                    to_addr,
-                    subject,
-                    email_body,
-                    f"StaffSync.AI - {subject}",
-                    otp=False,
-                )
-                if email_sent:
-                    print(
-                        f"✅ Email sent to employee: {to_addr} for request #{request_id}"
-                    )
-                    return True
-                else:
-                    print(f"⚠️ Failed to send email for request #{request_id}")
-                    return False
-            except Exception as e:
-                print(
-                    f"⚠️ Error updating leave log status for request #{request_id}: {e}"
-                )
+    try:
+        email_body = LEAVE_STATUS_EMAIL_TEMPLATE.format(
+            employee_name=employee_name,
+            request_id=request_id,
+            new_status=new_status.lower(),
+            approved_by=approved_by,
+        )
+        employee_info = get_employee_info(employee_id)
+
+        to_addr = employee_info["email"]  # ← match the real key
+        subject = f"Leave status {new_status} - Request #{request_id}"
+        # Send email notification
+        email_sent = send_mail(
+            to_addr,
+            subject,
+            email_body,
+            f"StaffSync.AI - {subject}",
+            otp=False,
+        )
+        if email_sent:
+            print(f"✅ Email queued to employee: {to_addr} for request #{request_id}")
+            return True
+        else:
+            print(f"⚠️ Failed to queue email for request #{request_id}")
+            return False
+    except Exception as e:
+        print(f"⚠️ Error updating leave log status for request #{request_id}: {e}")
 
-    return False  # Request not found
+    return False
 
 
 def file_search(query_text):
+    from .hr_policy_vault import search_policy
+
     print("Called file_search with query_text:", query_text)
-    contextful_message = search_policy(query_text, n_results=3, collection=hr_docs)
+    contextful_message = search_policy(
+        query_text, n_results=3, collection=policy_collection()
+    )
     print("Generated contextful message using file_search:", contextful_message)
 
     context_text = ""
@@ -335,8 +693,8 @@ def infer_imap(host_email: str) -> tuple[str, int]:
         return env_host or "imap.gmail.com", int(os.getenv("EMAIL_IMAP_PORT", 993))
 
 
-def first_visible_line(msg) -> str:
-    """Return the first non-quoted, non-blank line (plain-text > HTML). This function is utilized for watching the inbox."""
+def visible_lines(msg) -> list:
+    """Return the non-quoted, non-blank lines (plain-text > HTML). This function is utilized for watching the inbox."""
     for part in msg.walk():
         if part.get_content_type() == "text/plain":
             body = part.get_payload(decode=True).decode(
@@ -352,18 +710,26 @@ def first_visible_line(msg) -> str:
             body = bs4.BeautifulSoup(html_body, "html.parser").get_text()
             break
     else:
-        return ""
+        return []
 
+    lines = []
     for line in body.splitlines():
         line = line.strip()
         if line and not line.startswith((">", "|")):
-            return line
-    return ""
+            lines.append(line)
+    return lines
+
+
+def first_visible_line(msg) -> str:
+    """Return the first non-quoted, non-blank line (plain-text > HTML). This function is utilized for watching the inbox."""
+    lines = visible_lines(msg)
+    return lines[0] if lines else ""
 
 
 function_map = {
     "get_employee_balance": get_employee_balance,
     "add_leave_log": add_leave_log,
+    "get_team_availability": get_team_availability,
     "file_search": file_search,
 }
 
@@ -373,31 +739,46 @@ def call_function(name, raw_args, user_id):
         args = json.loads(raw_args)
         func = function_map.get(name)
 
-        # Auth check
-        auth_message = authenticate_function_call(user_id, "", name, args)
-        if auth_message:
+        # Only wait for the part of the system this tool needs
+        try:
+            startup.wait_for(
+                TOOL_COMPONENTS.get(name, "sheets"), timeout=STARTUP_WAIT_SECONDS
+            )
+        except startup.ComponentNotReady as e:
+            print(f"⏳ Can't run {name} yet: {e}")
             return {
-                "message": auth_message,
-                "auth_required": True,
+                "message": "⏳ I'm still starting up and can't do that just yet. Please try again in a moment.",
+                "auth_required": False,
                 "is_file_search": False,
                 "ok": False,
             }
 
-        if func:
-            result = func(**args)
-            message = result["Message"]
-            is_file_search = "fileSearch" in result
-
-            # Clear any pending call
-            if user_id in pending_function_calls:
-                del pending_function_calls[user_id]
-
-            return {
-                "message": message,
-                "auth_required": False,
-                "is_file_search": is_file_search,
-                "ok": True,
-            }
+        # Auth and the tool share one lookup of each record
+        with request_scope():
+            # Auth check
+            auth_message = authenticate_function_call(user_id, "", name, args)
+            if auth_message:
+                return {
+                    "message": auth_message,
+                    "auth_required": True,
+                    "is_file_search": False,
+                    "ok": False,
+                }
+
+            if func:
+                result = func(**args)
+                message = result["Message"]
+                is_file_search = "fileSearch" in result
+
+                # Clear any pending call
+                pending_function_calls.pop(user_id, None)
+
+                return {
+                    "message": message,
+                    "auth_required": False,
+                    "is_file_search": is_file_search,
+                    "ok": True,
+                }
 
         return {
             "message": f"❌ Unknown function '{name}'",
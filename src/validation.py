@@ -5,6 +5,7 @@ from pydantic import (
     StringConstraints,
     ValidationError,
     field_validator,
+    model_validator,
 )
 import re, json, textwrap, time
 from datetime import datetime, timedelta
@@ -60,16 +61,46 @@ class AddLeaveLogArgs(BaseModel):
     def validate_id(cls, v: str) -> str:
         return validate_employee_id(v)
 
+    @model_validator(mode="after")
+    def validate_dates(self):
+        # Working-day counts are checked in add_leave_log, which knows the
+        # employee's region (see src/leave_calendar.py)
+        try:
+            start = datetime.strptime(self.start_date, "%Y-%m-%d")
+            end = datetime.strptime(self.end_date, "%Y-%m-%d")
+        except ValueError as e:
+            raise ValueError(f"Invalid date: {e}")
+        if end < start:
+            raise ValueError("end_date must be on or after start_date.")
+        return self
+
+
+class GetTeamAvailabilityArgs(BaseModel):
+    employee_id: EmployeeID
+    start_date: DateYMD
+    end_date: DateYMD
+
+    @field_validator("employee_id")
+    @classmethod
+    def validate_id(cls, v: str) -> str:
+        return validate_employee_id(v)
+
 
 class FileSearchArgs(BaseModel):
     query_text: Annotated[str, Field(min_length=3, strip_whitespace=True)]
 
 
 class ToolCall(BaseModel):
-    name: Literal["get_employee_balance", "add_leave_log", "file_search"]
+    name: Literal[
+        "get_employee_balance",
+        "add_leave_log",
+        "get_team_availability",
+        "file_search",
+    ]
     parameters: Union[
         GetEmployeeBalanceArgs,
         AddLeaveLogArgs,
+        GetTeamAvailabilityArgs,
         FileSearchArgs,
     ]
 
@@ -1,18 +1,21 @@
 import time
 import imaplib, email, re, os
-from src.utils import update_leave_log_status, first_visible_line, infer_imap
+from src.utils import update_leave_log_statuses, visible_lines, infer_imap
+from src.lead_digest import parse_decisions
+from src.core.session_backends import leadership
 
 IMAP_USER = os.environ["EMAIL_SENDER"]
 IMAP_PASS = os.environ["EMAIL_PASSWORD"]
 IMAP_HOST, IMAP_PORT = infer_imap(IMAP_USER)  # keep both host & port
 
-PATTERN = re.compile(r"Leave Request #(\d+)", re.I)
+# "Leave Request #12", or "Leave Requests #12, #14, #15" for a digest
+PATTERN = re.compile(r"Leave Requests? (#\d+(?:,\s*#\d+)*)", re.I)
 
 POLL_SECONDS = 5  # how often to check
 
 
 def _process_unseen_messages(imap):
-    typ, data = imap.search(None, '(UNSEEN SUBJECT "Leave Request #")')
+    typ, data = imap.search(None, '(UNSEEN SUBJECT "Leave Request")')
     for num in data[0].split():
         typ, raw = imap.fetch(num, "(RFC822)")
         msg = email.message_from_bytes(raw[0][1])
@@ -20,20 +23,32 @@ def _process_unseen_messages(imap):
         m = PATTERN.search(msg["Subject"] or "")
         if not m:
             continue
-        request_id = int(m.group(1))
+        request_ids = [int(r) for r in re.findall(r"\d+", m.group(1))]
         lead_email = email.utils.parseaddr(msg["From"])[1].lower()
 
-        reply = first_visible_line(msg).strip().lower()
-        if reply == "y":
-            update_leave_log_status(request_id, "Approved", approved_by=lead_email)
-        elif reply == "n":
-            update_leave_log_status(request_id, "Rejected", approved_by=lead_email)
+        # "Y" / "N", or per request for a digest: "Y 12,14 / N 13". A digest
+        # reply only decides requests still pending, so a late "Y" to the
+        # whole digest can't flip one decided since; a reply about a single
+        # request can still reverse it. Either way only the requests the
+        # sender is the lead for are decided
+        decisions = parse_decisions(visible_lines(msg), request_ids)
+        if decisions:
+            update_leave_log_statuses(
+                decisions,
+                approved_by=lead_email,
+                only_pending=len(request_ids) > 1,
+                from_lead=lead_email,
+            )
 
         imap.store(num, "+FLAGS", "\\Seen")  # mark processed
 
 
 def watch_inbox():
     while True:
+        # With several app processes, only the leader reads the inbox
+        if not leadership.is_leader():
+            time.sleep(POLL_SECONDS)
+            continue
         try:
             with imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT) as imap:
                 imap.login(IMAP_USER, IMAP_PASS)
@@ -0,0 +1,231 @@
+import datetime
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+from .journal import Journal
+
+
+def _is_permanent(error: Exception) -> bool:
+    """True for errors that retrying the same rows won't fix (e.g. a 400 for a bad row)."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and 400 <= code < 500:
+        return code not in (408, 429)
+    return isinstance(error, (ValueError, TypeError))
+
+
+class WriteBehindQueue:
+    """
+    Accepts rows for a table immediately and appends them in the background.
+
+    `submit()` only writes the row to a local journal (fsynced, so it survives
+    a crash) and returns. A worker thread drains the queue with `append_rows`,
+    so a burst of submissions becomes a handful of API calls. Failed flushes
+    are retried with exponential backoff and jitter; before a retry, rows
+    whose key already made it into the table are dropped so nothing is
+    appended twice. Unflushed rows are replayed from the journal on start.
+
+    `on_flushed(entry)` is called for each entry once its row is in the table
+    (e.g. to send the notification email), so nobody is told about a row that
+    isn't there yet. Entries are acknowledged only after their callback has
+    run, so a crash in between repeats the callback on restart rather than
+    losing it (the callback should hand its work to something durable, like
+    the mail outbox).
+
+    Rows the table rejects outright (a 4xx other than 429, or a bad value)
+    would block every later row if retried forever. The batch is split until
+    the bad rows are found; the others are written, and the bad ones move to
+    the `dead_letters` journal, are reported to `on_dead_letter(entry,
+    error)` and counted in `stats()`.
+
+    With a shared journal, any process can submit, but only the current
+    `leader` (see Leadership in src/core/session_backends.py) flushes. A new
+    leader treats the rows already queued as replayed, since the previous
+    one may have appended them just before it stopped.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        table,
+        journal: Journal,
+        key_column: str,
+        on_flushed: Optional[Callable[[dict], None]] = None,
+        dead_letters: Optional[Journal] = None,
+        on_dead_letter: Optional[Callable[[dict, Exception], None]] = None,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_backoff: float = 60.0,
+        leader=None,
+    ):
+        self.name = name
+        self.table = table
+        self.journal = journal
+        self.key_column = key_column
+        self.on_flushed = on_flushed
+        self.dead_letters = dead_letters
+        self.on_dead_letter = on_dead_letter
+        self._dead_lettered = 0
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.leader = leader
+        self._term = 0
+        self._wakeup = threading.Event()
+        self._idle = threading.Condition()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._failures = 0
+        # Rows up to this journal seq were replayed after a restart and may
+        # have been appended before the crash
+        self._replayed_upto = 0
+
+    def start(self):
+        """Start the background worker (idempotent); replays unflushed rows."""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        backlog = self.journal.pending()
+        if backlog:
+            print(f"🔁 Replaying {len(backlog)} unflushed row(s) for '{self.name}'")
+            self._replayed_upto = backlog[-1][0]
+        threading.Thread(
+            target=self._run, name=f"write-behind-{self.name}", daemon=True
+        ).start()
+
+    def submit(self, row: list, **extra) -> int:
+        """
+        Queue a row for appending and return immediately.
+
+        Args:
+            row: Values in column order
+            **extra: Stored with the row and passed to `on_flushed`
+
+        Returns:
+            int: Journal sequence number of the queued row
+        """
+        self.start()
+        seq = self.journal.append({"row": row, **extra})
+        self._wakeup.set()
+        return seq
+
+    def pending_count(self) -> int:
+        return len(self.journal)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.journal),
+            "dead_lettered": (
+                len(self.dead_letters) if self.dead_letters else self._dead_lettered
+            ),
+        }
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Block until the queue is empty (or `timeout`); True if it drained."""
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while len(self.journal):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def _drop_already_written(self, batch):
+        # After a failed call we can't tell whether the rows landed; re-read
+        # the table and acknowledge the ones that did.
+        self.table.invalidate()
+        remaining, written = [], []
+        for seq, entry in batch:
+            row_num, _ = self.table.find(self.key_column, entry["row"][0])
+            (written if row_num else remaining).append((seq, entry))
+        return remaining, written
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            # Let a burst build up into one batch
+            time.sleep(min(0.2, self.flush_interval))
+            if self.leader:
+                if not self.leader.is_leader():
+                    continue
+                if self.leader.term != self._term:
+                    self._term = self.leader.term
+                    backlog = self.journal.pending()
+                    self._replayed_upto = backlog[-1][0] if backlog else 0
+
+            while not self.leader or self.leader.is_leader():
+                batch = self.journal.pending()[: self.batch_size]
+                if not batch:
+                    break
+                try:
+                    if self._failures or batch[0][0] <= self._replayed_upto:
+                        batch, written = self._drop_already_written(batch)
+                        self._acknowledge(written)
+                    if batch:
+                        self._write(batch)
+                    self._failures = 0
+                except Exception as e:
+                    self._failures += 1
+                    delay = min(self.max_backoff, 2 ** (self._failures - 1))
+                    delay *= random.uniform(0.5, 1.5)
+                    print(
+                        f"⚠️ Write-behind flush to '{self.name}' failed "
+                        f"(attempt {self._failures}), retrying in {delay:.1f}s: {e}"
+                    )
+                    time.sleep(delay)
+
+            with self._idle:
+                if not len(self.journal):
+                    self.journal.compact()
+                self._idle.notify_all()
+
+    def _write(self, batch):
+        try:
+            self.table.append_rows([entry["row"] for _, entry in batch])
+        except Exception as e:
+            if not _is_permanent(e):
+                raise
+            if len(batch) == 1:
+                self._dead_letter(*batch[0], e)
+                return
+            # Halve the batch until the rejected rows are isolated
+            middle = len(batch) // 2
+            self._write(batch[:middle])
+            self._write(batch[middle:])
+            return
+        self._acknowledge(batch)
+        print(f"📤 Flushed {len(batch)} row(s) to '{self.name}'")
+
+    def _dead_letter(self, seq: int, entry: dict, error: Exception):
+        print(f"❌ '{self.name}' rejected row {entry['row']}; moved aside: {error}")
+        if self.dead_letters:
+            self.dead_letters.append(
+                {
+                    **entry,
+                    "error": str(error),
+                    "at": datetime.datetime.now().isoformat(timespec="seconds"),
+                }
+            )
+        self._dead_lettered += 1
+        if self.on_dead_letter:
+            try:
+                self.on_dead_letter(entry, error)
+            except Exception as e:
+                print(f"⚠️ Dead-letter callback failed: {e}")
+        self.journal.ack([seq])
+
+    def _acknowledge(self, entries):
+        if not entries:
+            return
+        if self.on_flushed:
+            for _, entry in entries:
+                try:
+                    self.on_flushed(entry)
+                except Exception as e:
+                    print(f"⚠️ Post-flush callback failed: {e}")
+        self.journal.ack(seq for seq, _ in entries)